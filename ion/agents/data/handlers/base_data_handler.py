@@ -234,6 +234,9 @@ class BaseDataHandler(object):
         if not get_safe(config, 'new_data_check'):
             config['new_data_check'] = None
 
+        # Allows the data handler to persist its new data check
+        config['rr_client'] = self._rr_cli
+
             # Create a publisher to pass into the greenlet
         publisher = self._stream_registrar.create_publisher(stream_id=stream_id)
 
@@ -33,59 +33,118 @@ class NetcdfDataHandler(BaseDataHandler):
     @classmethod
     def _new_data_constraints(cls, config):
         """
-        Returns a constraints dictionary with
+        Returns a constraints dictionary with the 'temporal_slice' of the new data and the updated
+        'new_data_check' watermark. The watermark from the ExternalDataset's update_description holds the
+        last time value, the number of time steps and a sha1 of the tail of the time variable; when the
+        tail is unchanged only the appended steps are new and the time variable is not read in full.
+        The watermark takes precedence over a NewDataCheck attachment, which is only read when the
+        ExternalDataset has no watermark yet. The updated watermark is written back to the resource registry.
         @param config Dict of configuration parameters - may be used to generate the returned 'constraints' dict
         """
-        #TODO: Sort out what the config needs to look like - dataset_in??
         ext_dset_res = get_safe(config, 'external_dataset_res', None)
+        ds = get_safe(config, 'dataset_object')
         log.debug('ExternalDataset Resource: {0}'.format(ext_dset_res))
-        if ext_dset_res:
-            #TODO: Use the external dataset resource to determine what data is new (i.e. pull 'old' fingerprint from here)
-            log.debug('ext_dset_res.dataset_description = {0}'.format(ext_dset_res.dataset_description))
-            log.debug('ext_dset_res.update_description = {0}'.format(ext_dset_res.update_description))
-#            base_fingerprint = ext_dset_res.update_description
-            base_nd_check = get_safe(ext_dset_res.update_description.parameters,'new_data_check')
-#            base_nd_check = '\x83\xa7content\xdc\x00\xc9\xceM\xa0\xf3\x00\xceM\xa2D\x80\xceM\xa3\x96\x00\xceM\xa4\xe7\x80\xceM\xa69\x00\xceM\xa7\x8a\x80\xceM\xa8\xdc\x00\xceM\xaa-\x80\xceM\xab\x7f\x00\xceM\xac\xd0\x80\xceM\xae"\x00\xceM\xafs\x80\xceM\xb0\xc5\x00\xceM\xb2\x16\x80\xceM\xb3h\x00\xceM\xb4\xb9\x80\xceM\xb6\x0b\x00\xceM\xb7\\\x80\xceM\xb8\xae\x00\xceM\xb9\xff\x80\xceM\xbbQ\x00\xceM\xbc\xa2\x80\xceM\xbd\xf4\x00\xceM\xbfE\x80\xceM\xc0\x97\x00\xceM\xc1\xe8\x80\xceM\xc3:\x00\xceM\xc4\x8b\x80\xceM\xc5\xdd\x00\xceM\xc7.\x80\xceM\xc8\x80\x00\xceM\xc9\xd1\x80\xceM\xcb#\x00\xceM\xcct\x80\xceM\xcd\xc6\x00\xceM\xcf\x17\x80\xceM\xd0i\x00\xceM\xd1\xba\x80\xceM\xd3\x0c\x00\xceM\xd4]\x80\xceM\xd5\xaf\x00\xceM\xd7\x00\x80\xceM\xd8R\x00\xceM\xd9\xa3\x80\xceM\xda\xf5\x00\xceM\xdcF\x80\xceM\xdd\x98\x00\xceM\xde\xe9\x80\xceM\xe0;\x00\xceM\xe1\x8c\x80\xceM\xe2\xde\x00\xceM\xe4/\x80\xceM\xe5\x81\x00\xceM\xe6\xd2\x80\xceM\xe8$\x00\xceM\xe9u\x80\xceM\xea\xc7\x00\xceM\xec\x18\x80\xceM\xedj\x00\xceM\xee\xbb\x80\xceM\xf0\r\x00\xceM\xf1^\x80\xceM\xf2\xb0\x00\xceM\xf4\x01\x80\xceM\xf5S\x00\xceM\xf6\xa4\x80\xceM\xf7\xf6\x00\xceM\xf9G\x80\xceM\xfa\x99\x00\xceM\xfb\xea\x80\xceM\xfd<\x00\xceM\xfe\x8d\x80\xceM\xff\xdf\x00\xceN\x010\x80\xceN\x02\x82\x00\xceN\x03\xd3\x80\xceN\x05%\x00\xceN\x06v\x80\xceN\x07\xc8\x00\xceN\t\x19\x80\xceN\nk\x00\xceN\x0b\xbc\x80\xceN\r\x0e\x00\xceN\x0e_\x80\xceN\x0f\xb1\x00\xceN\x11\x02\x80\xceN\x12T\x00\xceN\x13\xa5\x80\xceN\x14\xf7\x00\xceN\x16H\x80\xceN\x17\x9a\x00\xceN\x18\xeb\x80\xceN\x1a=\x00\xceN\x1b\x8e\x80\xceN\x1c\xe0\x00\xceN\x1e1\x80\xceN\x1f\x83\x00\xceN \xd4\x80\xceN"&\x00\xceN#w\x80\xceN$\xc9\x00\xceN&\x1a\x80\xceN\'l\x00\xceN(\xbd\x80\xceN*\x0f\x00\xceN+`\x80\xceN,\xb2\x00\xceN.\x03\x80\xceN/U\x00\xceN0\xa6\x80\xceN1\xf8\x00\xceN3I\x80\xceN4\x9b\x00\xceN5\xec\x80\xceN7>\x00\xceN8\x8f\x80\xceN9\xe1\x00\xceN;2\x80\xceN<\x84\x00\xceN=\xd5\x80\xceN?\'\x00\xceN@x\x80\xceNA\xca\x00\xceNC\x1b\x80\xceNDm\x00\xceNE\xbe\x80\xceNG\x10\x00\xceNHa\x80\xceNI\xb3\x00\xceNK\x04\x80\xceNLV\x00\xceNM\xa7\x80\xceNN\xf9\x00\xceNPJ\x80\xceNQ\x9c\x00\xceNR\xed\x80\xceNT?\x00\xceNU\x90\x80\xceNV\xe2\x00\xceNX3\x80\xceNY\x85\x00\xceNZ\xd6\x80\xceN\\(\x00\xceN]y\x80\xceN^\xcb\x00\xceN`\x1c\x80\xceNan\x00\xceNb\xbf\x80\xceNd\x11\x00\xceNeb\x80\xceNf\xb4\x00\xceNh\x05\x80\xceNiW\x00\xceNj\xa8\x80\xceNk\xfa\x00\xceNmK\x80\xceNn\x9d\x00\xceNo\xee\x80\xceNq@\x00\xceNr\x91\x80\xceNs\xe3\x00\xceNu4\x80\xceNv\x86\x00\xceNw\xd7\x80\xceNy)\x00\xceNzz\x80\xceN{\xcc\x00\xceN}\x1d\x80\xceN~o\x00\xceN\x7f\xc0\x80\xceN\x81\x12\x00\xceN\x82c\x80\xceN\x83\xb5\x00\xceN\x85\x06\x80\xceN\x86X\x00\xceN\x87\xa9\x80\xceN\x88\xfb\x00\xceN\x8aL\x80\xceN\x8b\x9e\x00\xceN\x8c\xef\x80\xceN\x8eA\x00\xceN\x8f\x92\x80\xceN\x90\xe4\x00\xceN\x925\x80\xceN\x93\x87\x00\xceN\x94\xd8\x80\xceN\x96*\x00\xceN\x97{\x80\xceN\x98\xcd\x00\xceN\x9a\x1e\x80\xceN\x9bp\x00\xceN\x9c\xc1\x80\xceN\x9e\x13\x00\xceN\x9fd\x80\xceN\xa0\xb6\x00\xceN\xa2\x07\x80\xceN\xa3Y\x00\xceN\xa4\xaa\x80\xceN\xa5\xfc\x00\xceN\xa7M\x80\xceN\xa8\x9f\x00\xa6header\x83\xa2nd\x01\xa5shape\x91\xcc\xc9\xa4type\xa5int32\xad__ion_array__\xc3'
+        if ext_dset_res and ds:
+            base_nd_check = get_safe(ext_dset_res.update_description.parameters,'new_data_check') or get_safe(config, 'new_data_check')
 
-#            log.warn(base_nd_check)
+            t_vname = ext_dset_res.dataset_description.parameters['temporal_dimension']
+            t_var = ds.variables[t_vname]
+            t_slice = cls._new_temporal_slice(t_var, cls._decode_watermark(base_nd_check))
 
-#
-#
-#
-#            log.warn(old_arr)
+            new_nd_check = cls._calc_watermark(t_var)
+            ext_dset_res.update_description.parameters['new_data_check'] = new_nd_check
+            cls._persist_watermark(config, new_nd_check)
 
+            return {
+                'temporal_slice':t_slice,
+                'new_data_check':new_nd_check,
+            }
 
-            t_slice = slice(None)
-            if base_nd_check:
-                t_new_vname = ext_dset_res.dataset_description.parameters['temporal_dimension']
-                t_new_arr = ds.variables[t_new_vname][t_slice]
+        return None
 
-                new_data = msgpack.packb(t_new_arr, default=encode_ion)
-                if new_data != base_nd_check:
-                    #new time data has arrived, figure out what's different and build the new slice
-                    first_index = -1
-                    last_index = -1
-                    t_old_arr = msgpack.unpackb(base_nd_check, object_hook=decode_ion)
-                    for old_data in t_old_arr:
-                        if not old_data in t_new_arr:
-                            if first_index == -1:
-                                first_index = np.nonzero(t_new_arr == old_data)[0][0]
-                                last_index = np.nonzero(t_new_arr == old_data)[0][0]
-                            else:
-                                last_index = np.nonzero(t_new_arr == old_data)[0][0]
+    @classmethod
+    def _persist_watermark(cls, config, new_nd_check):
+        """
+        Writes the new data watermark to the update_description of the ExternalDataset in the resource registry,
+        so the next acquisition cycle (or a restarted agent) starts from it
+        @param config Dict of configuration parameters - uses 'rr_client' and 'external_dataset_res_id'
+        @param new_nd_check The watermark
+        """
+        rr_cli = get_safe(config, 'rr_client')
+        ext_dset_id = get_safe(config, 'external_dataset_res_id')
+        if not rr_cli or not ext_dset_id:
+            return
 
-                    t_slice = slice(first_index, last_index)
+        try:
+            ext_dset_res = rr_cli.read(ext_dset_id)
+            ext_dset_res.update_description.parameters['new_data_check'] = new_nd_check
+            rr_cli.update(ext_dset_res)
+        except Exception as ex:
+            log.warn('Could not persist the new data check of ExternalDataset \'{0}\': {1}'.format(ext_dset_id, ex))
 
+    # Number of trailing time steps hashed into the new data watermark
+    WATERMARK_TAIL = 10
 
-                #TG: Get new temporal data and encode it
-                #TG: Compare the old with the new, if different, decode old and sort out what's different
-                #TG: Build appropriate temproral_slice
+    @classmethod
+    def _calc_watermark(cls, t_var):
+        """
+        Calculates the new data watermark for a time variable
+        @param t_var The time variable (or array)
+        @retval dict with the 'last' time value, the 'count' of time steps and the 'tail' sha1
+        """
+        count = len(t_var)
+        if count == 0:
+            return {'last':None, 'count':0, 'tail':None}
 
-            return {
-                'temporal_slice':t_slice
-            }
+        tail = np.asarray(t_var[max(count-cls.WATERMARK_TAIL, 0):count])
+        return {
+            'last':float(tail[-1]),
+            'count':count,
+            'tail':cls._tail_sha(tail),
+        }
 
-        return None
+    @classmethod
+    def _decode_watermark(cls, nd_check):
+        """
+        Normalizes a stored new data check into a watermark
+        @param nd_check A watermark dict, a msgpack encoded time array (the previous format) or None
+        @retval watermark dict or None
+        """
+        if not nd_check:
+            return None
+
+        if isinstance(nd_check, basestring):
+            t_old_arr = msgpack.unpackb(nd_check, object_hook=decode_ion)
+            return cls._calc_watermark(np.asarray(t_old_arr))
+
+        return nd_check
+
+    @classmethod
+    def _new_temporal_slice(cls, t_var, watermark):
+        """
+        Determines the slice of the time variable that is new since the watermark was taken
+        @param t_var The time variable (or array), assumed to be monotonically increasing
+        @param watermark dict from _calc_watermark or None
+        @retval slice of the new time steps
+        """
+        count = len(t_var)
+        if not watermark or not watermark.get('count'):
+            return slice(None)
+
+        old_count = watermark['count']
+        if count >= old_count:
+            tail = np.asarray(t_var[max(old_count-cls.WATERMARK_TAIL, 0):old_count])
+            if cls._tail_sha(tail) == watermark['tail']:
+                # The old data is untouched, everything after it is new
+                return slice(old_count, count)
+
+        # The old data changed - anything after the last time value seen is new
+        first_index = int(np.searchsorted(np.asarray(t_var[:]), watermark['last'], side='right'))
+        return slice(first_index, count)
+
+    @classmethod
+    def _tail_sha(cls, tail):
+        return hashlib.sha1(np.ascontiguousarray(tail, dtype=np.float64).tostring()).hexdigest()
 
     @classmethod
     def _get_data(cls, config):
@@ -70,23 +70,29 @@ class SlocumParser(object):
     # John K's documentation says there are 16 header lines, but I believe there are actually 17
     # The 17th indicating the 'dtype' of the data for that column
     header_size = 17
-    header_map = {}
-    sensor_map = {}
-    data_map = {}
+
+    # Byte size in the dtype header row -> numpy dtype
+    dtype_map = {
+        '1':'byte',
+        '2':'short',
+        '4':'float',
+        '8':'double',
+    }
 
     def __init__(self, url=None):
         if not url:
             raise SystemError('Must provide a filename')
 
+        self.header_map = {}
+        self.sensor_map = {}
+        self.data_map = {}
+
         if url.startswith('http'):
             open_op = urllib2.urlopen
         else:
             open_op = open
 
         with open_op(url) as f:
-            # Get a byte-string generator for use in the data-retrieval loop (to avoid opening the file every time)
-            fstr=f.read()
-            f.seek(0)
             for x in xrange(self.header_size-3):
                 line = f.readline()
                 key,value=line.split(':',1)
@@ -96,20 +102,40 @@ class SlocumParser(object):
             sensor_names = f.readline().split()
             units = f.readline().split()
             # Keep track of the intended data type for each sensor
-            dtypes=[]
-            for d in f.readline().split():
-                if d is '1':
-                    dtypes.append('byte')
-                elif d is '2':
-                    dtypes.append('short')
-                elif d is '4':
-                    dtypes.append('float')
-                elif d is '8':
-                    dtypes.append('double')
+            dtypes=[self.dtype_map[d] for d in f.readline().split() if d in self.dtype_map]
+
+            # Everything after the header is data
+            dstr=f.read()
 
         assert len(sensor_names) == len(units) == len(dtypes)
 
         for i in xrange(len(sensor_names)):
             self.sensor_map[sensor_names[i]]=(units[i],dtypes[i])
-            dat = np.genfromtxt(fname=StringIO(fstr),skip_header=self.header_size,usecols=i,dtype=dtypes[i],missing_values='NaN')#,usemask=True)
-            self.data_map[sensor_names[i]]=dat
+
+        self.data = self._parse_data(dstr, sensor_names, dtypes)
+        for name in sensor_names:
+            self.data_map[name]=self.data[name]
+
+    @staticmethod
+    def _parse_data(dstr, sensor_names, dtypes):
+        """
+        Tokenizes the data section once into a structured array with one typed field per sensor.
+        Missing (NaN) values in integer fields are filled with -1, as genfromtxt does.
+        """
+        dtype = np.dtype(zip(sensor_names, dtypes))
+        cols = len(sensor_names)
+        # fromstring parses the whole section in C, including 'NaN' tokens
+        flat = np.fromstring(dstr, dtype=np.float64, sep=' ')
+        if cols == 0 or flat.size % cols != 0:
+            # Ragged rows (i.e. a truncated last line) - let genfromtxt sort it out
+            return np.atleast_1d(np.genfromtxt(fname=StringIO(dstr),dtype=dtype,missing_values='NaN'))
+
+        flat = flat.reshape(-1, cols)
+        data = np.empty(flat.shape[0], dtype=dtype)
+        for i in xrange(cols):
+            col = flat[:,i]
+            if data.dtype[i].kind in 'iu':
+                col = np.where(np.isnan(col), -1, col)
+            data[sensor_names[i]] = col
+
+        return data
@@ -16,6 +16,9 @@ import unittest
 from ion.agents.data.handlers.netcdf_data_handler import NetcdfDataHandler
 from interface.objects import ExternalDatasetAgent, ExternalDatasetAgentInstance, ExternalDataProvider, DataProduct, DataSourceModel, ContactInformation, UpdateDescription, DatasetDescription, ExternalDataset, Institution, DataSource
 from netCDF4 import Dataset
+from pyon.core.interceptor.encode import encode_ion
+import numpy as np
+import msgpack
 
 @attr('UNIT', group='eoi')
 class TestNetcdfDataHandlerUnit(PyonTestCase):
@@ -37,8 +40,93 @@ class TestNetcdfDataHandlerUnit(PyonTestCase):
         self.assertIn('dataset_object', config)
         self.assertTrue(isinstance(config['dataset_object'], Dataset))
 
+    def _make_ext_ds(self):
+        edres = ExternalDataset(name='test_ed_res', dataset_description=DatasetDescription(), update_description=UpdateDescription(), contact=ContactInformation())
+        edres.dataset_description.parameters['temporal_dimension'] = 'time'
+        return edres
+
+    def test__new_data_constraints_no_ext_ds_res(self):
+        ret = NetcdfDataHandler._new_data_constraints({})
+        self.assertIsNone(ret)
+
     def test__new_data_constraints(self):
-        pass
+        edres = self._make_ext_ds()
+        ds = Mock()
+        ds.variables = {'time':np.arange(100, dtype=np.float64)}
+        config = {'external_dataset_res':edres, 'dataset_object':ds}
+
+        # No watermark - everything is new
+        ret = NetcdfDataHandler._new_data_constraints(config)
+        self.assertEqual(ret['temporal_slice'], slice(None))
+        self.assertEqual(ret['new_data_check']['count'], 100)
+        self.assertEqual(ret['new_data_check']['last'], 99.0)
+        self.assertEqual(edres.update_description.parameters['new_data_check'], ret['new_data_check'])
+
+        # Appended time steps
+        ds.variables = {'time':np.arange(150, dtype=np.float64)}
+        ret = NetcdfDataHandler._new_data_constraints(config)
+        self.assertEqual(ret['temporal_slice'], slice(100,150))
+
+        # Nothing new
+        ret = NetcdfDataHandler._new_data_constraints(config)
+        self.assertEqual(ret['temporal_slice'], slice(150,150))
+
+    def test__new_data_constraints_rewritten(self):
+        edres = self._make_ext_ds()
+        ds = Mock()
+        ds.variables = {'time':np.arange(100, dtype=np.float64)}
+        config = {'external_dataset_res':edres, 'dataset_object':ds}
+        NetcdfDataHandler._new_data_constraints(config)
+
+        # The file was rolled - the oldest steps dropped and new ones appended
+        ds.variables = {'time':np.arange(50, 120, dtype=np.float64)}
+        ret = NetcdfDataHandler._new_data_constraints(config)
+        self.assertEqual(ret['temporal_slice'], slice(50,70))
+
+    def test__new_data_constraints_legacy_check(self):
+        edres = self._make_ext_ds()
+        ds = Mock()
+        ds.variables = {'time':np.arange(120, dtype=np.float64)}
+        nd_check = msgpack.packb(np.arange(100, dtype=np.float64), default=encode_ion)
+        config = {'external_dataset_res':edres, 'dataset_object':ds, 'new_data_check':nd_check}
+
+        ret = NetcdfDataHandler._new_data_constraints(config)
+        self.assertEqual(ret['temporal_slice'], slice(100,120))
+
+    def test__new_data_constraints_watermark_precedence(self):
+        edres = self._make_ext_ds()
+        ds = Mock()
+        ds.variables = {'time':np.arange(100, dtype=np.float64)}
+        stale_check = msgpack.packb(np.arange(10, dtype=np.float64), default=encode_ion)
+        config = {'external_dataset_res':edres, 'dataset_object':ds, 'new_data_check':stale_check}
+        NetcdfDataHandler._new_data_constraints(config)
+
+        # The stale NewDataCheck attachment is loaded into the config on every cycle, the watermark wins
+        ds.variables = {'time':np.arange(110, dtype=np.float64)}
+        ret = NetcdfDataHandler._new_data_constraints(config)
+        self.assertEqual(ret['temporal_slice'], slice(100,110))
+
+        ret = NetcdfDataHandler._new_data_constraints(config)
+        self.assertEqual(ret['temporal_slice'], slice(110,110))
+
+    def test__new_data_constraints_persists_watermark(self):
+        edres = self._make_ext_ds()
+        stored = self._make_ext_ds()
+        rr_cli = Mock()
+        rr_cli.read.return_value = stored
+        ds = Mock()
+        ds.variables = {'time':np.arange(100, dtype=np.float64)}
+        config = {'external_dataset_res':edres, 'dataset_object':ds, 'rr_client':rr_cli, 'external_dataset_res_id':'ext_ds_id'}
+
+        ret = NetcdfDataHandler._new_data_constraints(config)
+        rr_cli.read.assert_called_once_with('ext_ds_id')
+        rr_cli.update.assert_called_once_with(stored)
+        self.assertEqual(stored.update_description.parameters['new_data_check'], ret['new_data_check'])
+
+        # A failed update does not fail the acquisition cycle
+        rr_cli.update.side_effect = Exception('Conflict')
+        ret = NetcdfDataHandler._new_data_constraints(config)
+        self.assertEqual(ret['temporal_slice'], slice(100,100))
 
     def test__get_data(self):
         pass
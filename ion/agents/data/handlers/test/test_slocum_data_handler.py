@@ -46,3 +46,35 @@ class TestSlocumDataHandlerUnit(PyonTestCase):
     def test__get_data(self):
         pass
 
+
+@attr('UNIT', group='eoi')
+class TestSlocumParserUnit(PyonTestCase):
+
+    def test_parser(self):
+        parser = SlocumParser('test_data/ru05-2012-021-0-0-sbd.dat')
+
+        self.assertEqual(parser.header_map['filename'], 'ru05-2012-021-0-0')
+        self.assertEqual(len(parser.sensor_map), int(parser.header_map['sensors_per_cycle']))
+        self.assertEqual(parser.sensor_map['m_present_time'], ('timestamp','double'))
+        self.assertEqual(parser.sensor_map['m_gps_status'], ('enum','byte'))
+
+        # One tokenization gives the same columns as parsing each column separately
+        import numpy as np
+        from StringIO import StringIO
+        fstr = open('test_data/ru05-2012-021-0-0-sbd.dat').read()
+        for name in ['m_present_time', 'm_gps_status', 'm_lat']:
+            i = parser.data.dtype.names.index(name)
+            expected = np.genfromtxt(fname=StringIO(fstr),skip_header=SlocumParser.header_size,usecols=i,dtype=parser.sensor_map[name][1],missing_values='NaN')
+            self.assertEqual(parser.data_map[name].dtype, expected.dtype)
+            np.testing.assert_array_equal(parser.data_map[name], expected)
+
+    def test_parser_instance_state(self):
+        parser1 = SlocumParser('test_data/ru05-2012-021-0-0-sbd.dat')
+        parser2 = SlocumParser('test_data/ru05-2012-021-0-0-sbd.dat')
+
+        self.assertIsNot(parser1.data_map, parser2.data_map)
+        parser1.header_map['filename'] = 'changed'
+        self.assertEqual(parser2.header_map['filename'], 'ru05-2012-021-0-0')
+
+    def test_parser_no_url(self):
+        self.assertRaises(SystemError, SlocumParser)
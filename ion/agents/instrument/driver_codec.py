@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+"""
+@package ion.agents.instrument.driver_codec
+@file ion/agents.instrument/driver_codec.py
+@author Edward Hunter
+@brief Wire codecs for driver process commands, replies and events.
+"""
+
+__author__ = 'Edward Hunter'
+__license__ = 'Apache 2.0'
+
+import cPickle as pickle
+import logging
+
+try:
+    import msgpack
+    from pyon.core.interceptor.encode import encode_ion, decode_ion
+except ImportError:
+    msgpack = None
+
+from ion.agents.instrument.exceptions import InstrumentException
+
+mi_logger = logging.getLogger('mi_logger')
+
+class PickleCodec(object):
+    """
+    Python pickle encoding. Encodes any picklable object, the fallback for
+    messages other codecs cannot encode.
+    """
+    name = 'pickle'
+
+    def encode(self, obj):
+        return pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+
+    def decode(self, data):
+        return pickle.loads(data)
+
+class MsgpackCodec(object):
+    """
+    Compact binary encoding of messages using msgpack, with the ion
+    extension types for numpy arrays and values. Exceptions are encoded by
+    class, arguments and attributes. Tuples decode as lists.
+    """
+    name = 'msgpack'
+
+    def encode(self, obj):
+        return msgpack.packb(obj, default=self._default)
+
+    def decode(self, data):
+        return msgpack.unpackb(data, object_hook=self._object_hook)
+
+    @staticmethod
+    def _default(obj):
+        """
+        Encode types msgpack does not know.
+        """
+        if isinstance(obj, Exception):
+            return {
+                '__exception__' : obj.__class__.__name__,
+                'module' : obj.__class__.__module__,
+                'args' : list(obj.args),
+                'attrs' : obj.__dict__
+            }
+        return encode_ion(obj)
+
+    @staticmethod
+    def _object_hook(obj):
+        """
+        Decode the types encoded by _default.
+        """
+        if '__exception__' in obj:
+            try:
+                module = __import__(obj['module'], fromlist=[obj['__exception__']])
+                cls = getattr(module, obj['__exception__'])
+                exc = cls.__new__(cls)
+                exc.args = tuple(obj['args'])
+                exc.__dict__.update(obj['attrs'])
+                return exc
+            except Exception:
+                return InstrumentException('%s%s' % (obj['__exception__'], tuple(obj['args'])))
+        return decode_ion(obj)
+
+# Codecs by name. Pickle is always available and understood.
+CODECS = {
+    PickleCodec.name : PickleCodec()
+}
+if msgpack:
+    CODECS[MsgpackCodec.name] = MsgpackCodec()
+
+# Codec preference of driver clients, most preferred first.
+DEFAULT_CODECS = [MsgpackCodec.name, PickleCodec.name]
+
+def select_codec(names):
+    """
+    Select the first available codec of a preference list.
+    @param names List of codec names, most preferred first.
+    @retval The codec name, pickle if none of names is available.
+    """
+    for name in names or []:
+        if name in CODECS:
+            return name
+    return PickleCodec.name
+
+def encode(obj, name):
+    """
+    Encode a message, falling back to pickle if the codec cannot encode it.
+    @param obj The message.
+    @param name The codec name.
+    @retval List of frames, the codec name and the encoded message.
+    """
+    if name != PickleCodec.name:
+        try:
+            return [name, CODECS[name].encode(obj)]
+        except (TypeError, ValueError, OverflowError) as e:
+            mi_logger.debug('Codec %s could not encode message, using pickle: %s', name, str(e))
+    return [PickleCodec.name, CODECS[PickleCodec.name].encode(obj)]
+
+def decode(frames):
+    """
+    Decode a message with the codec named in its first frame.
+    @param frames List of frames, the codec name and the encoded message.
+    @retval The message.
+    @raises KeyError if the codec is not available.
+    """
+    (name, data) = frames
+    return CODECS[name].decode(data)
@@ -18,6 +18,7 @@ import signal
 import os
 import sys
 import time
+import Queue
 from ion.agents.instrument.exceptions import InstrumentCommandException
 from ion.agents.instrument.instrument_driver import DriverAsyncEvent
 
@@ -55,7 +56,7 @@ class DriverProcess(object):
         self.driver_class = driver_class
         self.ppid = ppid
         self.driver = None
-        self.events = []
+        self.events = Queue.Queue()
         self.messaging_started = False
         
     def construct_driver(self):
@@ -144,7 +145,8 @@ class DriverProcess(object):
             return'stop_driver_process'
         elif cmd == 'test_events':
             events = kwargs['events']
-            self.events += events
+            for evt in events:
+                self.send_event(evt)
             reply = 'test_events'
         elif cmd == 'process_echo':
             reply = 'process_echo: %s' % str(args[0])
@@ -175,9 +177,9 @@ class DriverProcess(object):
             
     def send_event(self, evt):
         """
-        Append an event to the list to be sent by the event threaed.
+        Queue an event to be sent by the event thread, waking it if idle.
         """
-        self.events.append(evt)
+        self.events.put(evt)
             
     def run(self):
         """
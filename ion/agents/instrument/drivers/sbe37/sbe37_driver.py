@@ -760,16 +760,14 @@ class SBE37Protocol(CommandResponseInstrumentProtocol):
         
         if len(data)>0:
             # Call the superclass to update line and prompt buffers.
-            CommandResponseInstrumentProtocol.got_data(self, data)
+            lines = CommandResponseInstrumentProtocol.got_data(self, data)
     
-            # If in streaming mode, process the buffer for samples to publish.
+            # If in streaming mode, process the completed lines for samples
+            # to publish.
             cur_state = self.get_current_state()
             if cur_state == SBE37ProtocolState.AUTOSAMPLE:
-                if SBE37_NEWLINE in self._linebuf:
-                    lines = self._linebuf.split(SBE37_NEWLINE)
-                    self._linebuf = lines[-1]
-                    for line in lines:
-                        self._extract_sample(line)                    
+                for line in lines:
+                    self._extract_sample(line)                    
                 
     def _extract_sample(self, line, publish=True):
         """
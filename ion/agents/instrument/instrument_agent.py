@@ -43,6 +43,8 @@ import time
 import socket
 import os
 import traceback
+import threading
+import gevent
 
 # ION service imports.
 from ion.agents.instrument.instrument_fsm import InstrumentFSM
@@ -245,6 +247,21 @@ class InstrumentAgent(ResourceAgent):
         # Factories for stream packets. Constructed by driver
         # configuration information on transition to inactive.
         self._packet_factories = {}
+
+        # Sample coalescing limits by stream name. Constructed by
+        # buffer_config agent config member during process on_init.
+        # Streams without a config publish every sample.
+        self._buffer_config = {}
+
+        # Sample coalescing buffers by stream name. Each holds the
+        # accumulated sample lists, the record count, the arrival
+        # time of the oldest buffered sample and the timer greenlet
+        # flushing the buffer once that sample is max_latency old.
+        self._sample_buffers = {}
+
+        # Guards the sample buffers, which are filled from the driver
+        # event thread and flushed on agent state transitions.
+        self._sample_buffer_lock = threading.RLock()
         
         # Stream registrar to create publishers. Used to create
         # stream publishers, set during process on_init.
@@ -290,6 +307,9 @@ class InstrumentAgent(ResourceAgent):
         
         # Set the test mode.
         self._test_mode = self.CFG.get('test_mode', False)
+
+        # Set the sample coalescing limits.
+        self._buffer_config = self.CFG.get('buffer_config', None) or {}
         
         # Construct stream publishers.
         self._construct_data_publishers()
@@ -340,12 +360,7 @@ class InstrumentAgent(ResourceAgent):
             value = evt.get('value', None)
             if type == DriverAsyncEvent.SAMPLE:
                 stream_name = value.pop('stream_name')
-                value['lat'] = [self._lat]
-                value['lon'] = [self._lon]
-                value['stream_id'] = self._data_streams[stream_name]
-                packet = self._packet_factories[stream_name](**value)
-                self._data_publishers[stream_name].publish(packet)
-                log.info('Instrument agent %s published data packet.', self._proc_name)
+                self._buffer_sample(stream_name, value)
 
             elif type == DriverAsyncEvent.CONFIG_CHANGE:
                 # Needs a specific event type.
@@ -891,6 +906,15 @@ class InstrumentAgent(ResourceAgent):
         
         except InstrumentParameterException:
             raise InstParameterError('The driver comms configuration is invalid.')
+
+        # Set the driver sample batching limits if configured.
+        dvr_batching = self._dvr_config.get('sample_batching', None)
+        if dvr_batching:
+            try:
+                self._dvr_client.cmd_dvr('set_sample_batching', **dvr_batching)
+
+            except InstrumentParameterException:
+                raise InstParameterError('The driver sample batching configuration is invalid.')
         
         # Connect to the device, propagating connection errors.
         try:
@@ -1275,9 +1299,10 @@ class InstrumentAgent(ResourceAgent):
     
     def _handler_streaming_exit(self,  *args, **kwargs):
         """
-        Handler upon exit from streaming state.
+        Handler upon exit from streaming state. Publish any samples
+        still held in the coalescing buffers.
         """
-        pass
+        self._flush_sample_buffers()
 
     def _handler_streaming_go_inactive(self,  *args, **kwargs):
         """
@@ -1452,6 +1477,7 @@ class InstrumentAgent(ResourceAgent):
         if self._dvr_proc:
             if self._dvr_client:
                 self._dvr_client.done()
+                self._flush_sample_buffers()
                 self._dvr_proc.wait()
                 self._dvr_proc = None
                 self._dvr_client = None
@@ -1534,6 +1560,106 @@ class InstrumentAgent(ResourceAgent):
             log.error('Instrument agent %s had error creating packet factories.',
                       self._proc_name)
                                 
+    def _buffer_sample(self, stream_name, value):
+        """
+        Add a driver sample to the coalescing buffer of its stream and
+        publish the buffer as one multi-record packet once it holds
+        max_records records or its oldest sample is max_latency seconds old.
+        A timer flushes the buffer on expiry of max_latency even if no
+        further sample arrives. Without max_latency a buffer is only
+        published once full, and streams without a buffer_config entry
+        publish every sample.
+        @param stream_name The stream the sample is published on.
+        @param value The sample dict of value lists.
+        @retval None
+        """
+        config = self._buffer_config.get(stream_name, None) or {}
+        max_records = config.get('max_records', 1)
+        max_latency = config.get('max_latency', None)
+        now = time.time()
+
+        with self._sample_buffer_lock:
+            buf = self._sample_buffers.get(stream_name, None)
+            if buf is None:
+                buf = {'values' : {}, 'count' : 0, 'time' : now}
+                self._sample_buffers[stream_name] = buf
+
+            count = 1
+            for (key, val) in value.iteritems():
+                if not isinstance(val, (list, tuple)):
+                    val = [val]
+                buf['values'].setdefault(key, []).extend(val)
+                count = len(val)
+            buf['values'].setdefault('lat', []).extend([self._lat] * count)
+            buf['values'].setdefault('lon', []).extend([self._lon] * count)
+            buf['count'] += count
+
+            if buf['count'] >= max_records or \
+                (max_latency is not None and now - buf['time'] >= max_latency):
+                self._flush_sample_buffer(stream_name)
+
+            elif max_latency is not None and buf.get('timer', None) is None:
+                buf['timer'] = gevent.spawn_later(max_latency - (now - buf['time']),
+                                    self._flush_expired_sample_buffer, stream_name, buf)
+
+    def _flush_sample_buffer(self, stream_name):
+        """
+        Publish the buffered samples of a stream as one packet.
+        @param stream_name The stream to flush.
+        @retval None
+        """
+        with self._sample_buffer_lock:
+            buf = self._sample_buffers.pop(stream_name, None)
+            if not buf:
+                return
+
+            timer = buf.get('timer', None)
+            if timer is not None and timer is not gevent.getcurrent():
+                timer.kill(block=False)
+
+            if buf['count'] == 0:
+                return
+
+            value = buf['values']
+            value['stream_id'] = self._data_streams[stream_name]
+            packet = self._packet_factories[stream_name](**value)
+            self._data_publishers[stream_name].publish(packet)
+            log.info('Instrument agent %s published data packet of %d records.',
+                     self._proc_name, buf['count'])
+
+    def _flush_expired_sample_buffer(self, stream_name, buf):
+        """
+        Publish the buffered samples of a stream on expiry of its
+        max_latency, unless the buffer was flushed in the meantime.
+        @param stream_name The stream to flush.
+        @param buf The buffer the timer was armed for.
+        @retval None
+        """
+        with self._sample_buffer_lock:
+            if self._sample_buffers.get(stream_name, None) is not buf:
+                return
+
+            try:
+                self._flush_sample_buffer(stream_name)
+
+            except Exception as e:
+                log.error('Instrument agent %s error %s flushing samples for stream %s',
+                          self._proc_name, str(e), stream_name)
+
+    def _flush_sample_buffers(self):
+        """
+        Publish the buffered samples of every stream.
+        @retval None
+        """
+        with self._sample_buffer_lock:
+            for stream_name in self._sample_buffers.keys():
+                try:
+                    self._flush_sample_buffer(stream_name)
+
+                except Exception as e:
+                    log.error('Instrument agent %s error %s flushing samples for stream %s',
+                              self._proc_name, str(e), stream_name)
+
     def _clear_packet_factories(self):
         """
         Delete packet factories.
@@ -13,6 +13,7 @@ __license__ = 'Apache 2.0'
 
 import time
 import logging
+import threading
 
 from ion.agents.instrument.common import BaseEnum
 from ion.agents.instrument.exceptions import NotImplementedException 
@@ -121,6 +122,25 @@ class InstrumentDriver(object):
         """
         self._send_event = event_callback
 
+        # Sample batching limits. A batch is sent once it holds
+        # max_samples samples or its oldest sample is max_latency seconds
+        # old. The defaults send every sample as its own event.
+        self._batch_max_samples = 1
+        self._batch_max_latency = 0
+
+        # Sample batches by stream name, each a dict of value lists.
+        self._sample_batches = {}
+
+        # Sample counts of the batches by stream name.
+        self._sample_counts = {}
+
+        # Timer sending the batches when the latency expires.
+        self._batch_timer = None
+
+        # Guards the batches, which are filled from the connection thread
+        # and sent from the timer and command threads.
+        self._batch_lock = threading.RLock()
+
     #############################################################
     # Device connection interface.
     #############################################################
@@ -330,6 +350,8 @@ class InstrumentDriver(object):
             'time' : time.time()
         }
         if type == DriverAsyncEvent.STATE_CHANGE:
+            # Samples taken in the old state are sent ahead of the change.
+            self.flush_samples()
             state = self.get_current_state()
             event['value'] = state
             self._send_event(event)
@@ -340,8 +362,7 @@ class InstrumentDriver(object):
             self._send_event(event)
         
         elif type == DriverAsyncEvent.SAMPLE:
-            event['value'] = val
-            self._send_event(event)
+            self._batch_sample(val)
             
         elif type == DriverAsyncEvent.ERROR:
             # Error caught at driver process level.
@@ -355,6 +376,95 @@ class InstrumentDriver(object):
             event['value'] = val
             self._send_event(event)
 
+    ########################################################################
+    # Sample batching.
+    ########################################################################
+
+    def set_sample_batching(self, max_samples=1, max_latency=0):
+        """
+        Set the limits for batching samples into one event per stream.
+        Batched samples are sent as a single sample dict with each value
+        list holding the values of all samples in arrival order.
+        @param max_samples Number of samples that sends a batch.
+        @param max_latency Seconds the oldest sample of a batch may wait.
+        @raises InstrumentParameterException if the limits are invalid.
+        """
+        if not isinstance(max_samples, int) or max_samples < 1:
+            raise InstrumentParameterException('Invalid sample batch size %s.' % str(max_samples))
+        if not isinstance(max_latency, (int, float)) or max_latency < 0:
+            raise InstrumentParameterException('Invalid sample batch latency %s.' % str(max_latency))
+
+        self.flush_samples()
+        self._batch_max_samples = max_samples
+        self._batch_max_latency = max_latency
+
+    def flush_samples(self):
+        """
+        Send the batched samples of every stream.
+        """
+        self._batch_lock.acquire()
+        try:
+            if self._batch_timer:
+                self._batch_timer.cancel()
+                self._batch_timer = None
+            for sample in self._sample_batches.values():
+                event = {
+                    'type' : DriverAsyncEvent.SAMPLE,
+                    'value' : sample,
+                    'time' : time.time()
+                }
+                self._send_event(event)
+            self._sample_batches = {}
+            self._sample_counts = {}
+        finally:
+            self._batch_lock.release()
+
+    def _batch_sample(self, sample):
+        """
+        Add a sample to the batch of its stream, sending all batches if
+        the stream batch is full. The first sample of a batch starts the
+        latency timer.
+        @param sample Sample dict of value lists and the stream name.
+        """
+        if self._batch_max_samples == 1:
+            event = {
+                'type' : DriverAsyncEvent.SAMPLE,
+                'value' : sample,
+                'time' : time.time()
+            }
+            self._send_event(event)
+            return
+
+        stream_name = sample.get('stream_name', None)
+        self._batch_lock.acquire()
+        try:
+            batch = self._sample_batches.get(stream_name, None)
+            if batch is None:
+                batch = {'stream_name' : stream_name}
+                self._sample_batches[stream_name] = batch
+                self._sample_counts[stream_name] = 0
+
+            count = 1
+            for (key, val) in sample.iteritems():
+                if key == 'stream_name':
+                    continue
+                if not isinstance(val, (list, tuple)):
+                    val = [val]
+                batch.setdefault(key, []).extend(val)
+                count = len(val)
+            self._sample_counts[stream_name] += count
+
+            if self._sample_counts[stream_name] >= self._batch_max_samples:
+                self.flush_samples()
+
+            elif not self._batch_timer:
+                self._batch_timer = threading.Timer(self._batch_max_latency,
+                                                    self.flush_samples)
+                self._batch_timer.daemon = True
+                self._batch_timer.start()
+        finally:
+            self._batch_lock.release()
+
     ########################################################################
     # Test interface.
     ########################################################################
@@ -20,6 +20,7 @@ import re
 
 from ion.agents.instrument.common import BaseEnum
 from ion.agents.instrument.protocol_param_dict import ProtocolParameterDict
+from ion.agents.instrument.line_framer import LineFramer
 from ion.agents.instrument.exceptions import InstrumentTimeoutException
 from ion.agents.instrument.exceptions import InstrumentProtocolException
 
@@ -90,12 +91,9 @@ class CommandResponseInstrumentProtocol(InstrumentProtocol):
         # Class of prompts used by device.
         self._prompts = prompts
     
-        # Linebuffer for input from device.
-        self._linebuf = ''
-        
-        # Short buffer to look for prompts from device in command-response
-        # mode.
-        self._promptbuf = ''
+        # Frames input from the device into the bounded response buffer,
+        # complete lines and the current prompt.
+        self._framer = LineFramer(newline, prompts.list())
         
         # Lines of data awaiting further processing.
         self._datalines = []
@@ -108,6 +106,28 @@ class CommandResponseInstrumentProtocol(InstrumentProtocol):
 
         self._last_data_receive_timestamp = None
 
+    def _get_linebuf(self):
+        return self._framer.get_response()
+
+    def _set_linebuf(self, value):
+        if value:
+            raise InstrumentProtocolException('The line buffer can only be cleared.')
+        self._framer.clear()
+
+    # Response text since the last command, kept for subclasses.
+    _linebuf = property(_get_linebuf, _set_linebuf)
+
+    def _get_promptbuf(self):
+        return self._framer.get_tail()
+
+    def _set_promptbuf(self, value):
+        if value:
+            raise InstrumentProtocolException('The prompt buffer can only be cleared.')
+        self._framer.clear_prompt()
+
+    # Tail of the data received, long enough to end with any prompt.
+    _promptbuf = property(_get_promptbuf, _set_promptbuf)
+
     ########################################################################
     # Command build and response parse handlers.
     ########################################################################            
@@ -144,22 +164,17 @@ class CommandResponseInstrumentProtocol(InstrumentProtocol):
         presented by this string
         @throw InstrumentProtocolExecption on timeout
         """
-        # Grab time for timeout and wait for prompt.
-        starttime = time.time()
-                
         if expected_prompt == None:
             prompt_list = self._prompts.list()
         else:
             assert isinstance(expected_prompt, str)
             prompt_list = [expected_prompt]            
-        while True:
-            for item in prompt_list:
-                if self._promptbuf.endswith(item):
-                    return (item, self._linebuf)
-                else:
-                    time.sleep(.1)
-            if time.time() > starttime + timeout:
-                raise InstrumentTimeoutException()
+
+        # Woken by got_data as soon as a prompt arrives.
+        prompt = self._framer.wait_prompt(timeout, prompt_list)
+        if prompt is None:
+            raise InstrumentTimeoutException()
+        return (prompt, self._framer.get_response())
                
     def _do_cmd_resp(self, cmd, *args, **kwargs):
         """
@@ -190,8 +205,7 @@ class CommandResponseInstrumentProtocol(InstrumentProtocol):
         prompt = self._wakeup(timeout)
                     
         # Clear line and prompt buffers for result.
-        self._linebuf = ''
-        self._promptbuf = ''
+        self._framer.clear()
 
         # Send command.
         mi_logger.debug('_do_cmd_resp: %s, timeout=%s, write_delay=%s, expected_prompt=%s,',
@@ -238,8 +252,7 @@ class CommandResponseInstrumentProtocol(InstrumentProtocol):
         prompt = self._wakeup(timeout)
 
         # Clear line and prompt buffers for result.
-        self._linebuf = ''
-        self._promptbuf = ''
+        self._framer.clear()
 
         # Send command.
         mi_logger.debug('_do_cmd_no_resp: %s, timeout=%s', repr(cmd_line), timeout)
@@ -271,11 +284,12 @@ class CommandResponseInstrumentProtocol(InstrumentProtocol):
        Called by the instrument connection when data is available.
        Append line and prompt buffers. Extended by device specific
        subclasses.
+       @retval List of lines completed by the data.
         """
-        # Update the line and prompt buffers.
-        self._linebuf += data        
-        self._promptbuf += data
+        # Update the line and prompt buffers, waking waiting commands.
+        lines = self._framer.add(data)
         self._last_data_received_timestamp = time.time()
+        return lines
 
     ########################################################################
     # Wakeup helpers.
@@ -296,21 +310,19 @@ class CommandResponseInstrumentProtocol(InstrumentProtocol):
         @throw InstrumentTimeoutException if the device could not be woken.
         """
         # Clear the prompt buffer.
-        self._promptbuf = ''
+        self._framer.clear_prompt()
         
         # Grab time for timeout.
         starttime = time.time()
         
         while True:
-            # Send a line return and wait a sec.
+            # Send a line return and wait up to a sec for the prompt.
             mi_logger.debug('Sending wakeup.')
             self._send_wakeup()
-            time.sleep(delay)
-            
-            for item in self._prompts.list():
-                if self._promptbuf.endswith(item):
-                    mi_logger.debug('wakeup got prompt: %s', repr(item))
-                    return item
+            item = self._framer.wait_prompt(delay)
+            if item:
+                mi_logger.debug('wakeup got prompt: %s', repr(item))
+                return item
 
             if time.time() > starttime + timeout:
                 raise InstrumentTimeoutException()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+"""
+@package ion.agents.instrument.line_framer
+@file ion/agents.instrument/line_framer.py
+@author Edward Hunter
+@brief Incremental framing of device output into lines and prompts for
+text-based protocols.
+"""
+
+__author__ = 'Edward Hunter'
+__license__ = 'Apache 2.0'
+
+import threading
+import time
+import logging
+
+mi_logger = logging.getLogger('mi_logger')
+
+class LineFramer(object):
+    """
+    Frames the byte stream from a device. Each chunk of data is examined
+    once: complete lines are split off the chunk and the partial line
+    carried over, and the prompt (if any) the data currently ends with is
+    tracked from a short tail. The response text since the last clear is
+    kept in a buffer bounded to max_size bytes, dropping the oldest data.
+    Threads waiting for a prompt are woken by a condition variable as soon
+    as it arrives.
+    """
+
+    def __init__(self, newline, prompts, max_size=65536):
+        """
+        Constructor.
+        @param newline The device newline.
+        @param prompts List of device prompt strings.
+        @param max_size Maximum bytes of response and partial line held.
+        """
+        self._newline = newline
+        self._prompts = list(prompts)
+        self._max_size = max_size
+        self._tail_size = max([len(p) for p in self._prompts] + [len(newline)])
+
+        self._cond = threading.Condition()
+
+        # Response chunks since the last clear and their total size.
+        self._chunks = []
+        self._size = 0
+
+        # Incomplete last line.
+        self._partial = ''
+
+        # Last bytes received since the last prompt clear, and the prompt
+        # they end with.
+        self._tail = ''
+        self._prompt = None
+
+        self.last_data_timestamp = None
+
+    def add(self, data):
+        """
+        Add data received from the device, wake waiting threads.
+        @param data The data string received.
+        @retval List of lines completed by the data, without newlines.
+        """
+        self._cond.acquire()
+        try:
+            self._chunks.append(data)
+            self._size += len(data)
+            if self._size > 2 * self._max_size:
+                self._trim()
+
+            lines = (self._partial + data).split(self._newline)
+            self._partial = lines.pop()
+            if len(self._partial) > self._max_size:
+                mi_logger.warn('LineFramer: dropping %i bytes without a newline.',
+                               len(self._partial) - self._max_size)
+                self._partial = self._partial[-self._max_size:]
+
+            self._tail = (self._tail + data)[-self._tail_size:]
+            self._prompt = self._match(self._prompts)
+
+            self.last_data_timestamp = time.time()
+            self._cond.notify_all()
+            return lines
+
+        finally:
+            self._cond.release()
+
+    def _match(self, prompts):
+        """
+        @retval The first of prompts the data received ends with, or None.
+        """
+        for prompt in prompts:
+            if self._tail.endswith(prompt):
+                return prompt
+        return None
+
+    def _trim(self):
+        """
+        Drop the oldest response data beyond max_size.
+        """
+        buf = ''.join(self._chunks)[-self._max_size:]
+        self._chunks = [buf]
+        self._size = len(buf)
+
+    def clear(self):
+        """
+        Clear the response buffer and prompt, as before sending a command.
+        """
+        self._cond.acquire()
+        try:
+            self._chunks = []
+            self._size = 0
+            self._tail = ''
+            self._prompt = None
+        finally:
+            self._cond.release()
+
+    def clear_prompt(self):
+        """
+        Forget the prompt seen, as before sending a wakeup.
+        """
+        self._cond.acquire()
+        try:
+            self._tail = ''
+            self._prompt = None
+        finally:
+            self._cond.release()
+
+    def clear_lines(self):
+        """
+        Drop the partial line, as when leaving a mode that consumes lines.
+        """
+        self._cond.acquire()
+        try:
+            self._partial = ''
+        finally:
+            self._cond.release()
+
+    def get_response(self):
+        """
+        @retval The response text received since the last clear, at most
+        max_size bytes.
+        """
+        self._cond.acquire()
+        try:
+            if self._size > self._max_size:
+                self._trim()
+            return ''.join(self._chunks)
+        finally:
+            self._cond.release()
+
+    def get_prompt(self):
+        """
+        @retval The prompt the data received ends with, or None.
+        """
+        return self._prompt
+
+    def get_tail(self):
+        """
+        @retval The last bytes received since the last prompt clear.
+        """
+        return self._tail
+
+    def wait_prompt(self, timeout, prompts=None):
+        """
+        Block until the data received ends with a prompt.
+        @param timeout Maximum seconds to wait.
+        @param prompts List of acceptable prompts, all prompts if None.
+        @retval The prompt, or None if none was seen in time.
+        """
+        prompts = prompts or self._prompts
+        endtime = time.time() + timeout
+        self._cond.acquire()
+        try:
+            self._tail_size = max([self._tail_size] + [len(p) for p in prompts])
+            prompt = self._match(prompts)
+            while prompt is None:
+                remaining = endtime - time.time()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+                prompt = self._match(prompts)
+            return prompt
+        finally:
+            self._cond.release()
@@ -15,6 +15,13 @@ import logging
 
 mi_logger = logging.getLogger('mi_logger')
 
+# Most groups a compiled regex may hold, the limit of the re module.
+MAX_REGEX_GROUPS = 99
+
+# Patterns that cannot be embedded in an alternation: named groups and
+# backreferences would be renumbered, inline flags apply to the whole regex.
+UNCOMBINABLE = re.compile(r'\(\?P|\(\?[a-zA-Z]|\\[1-9]')
+
 class ParameterDictVal(object):
     """
     A parameter dictionary value.
@@ -61,6 +68,12 @@ class ProtocolParameterDict(object):
         Constructor.        
         """
         self._param_dict= {}
+
+        # Parameter names in the order added, the order lines are matched.
+        self._names = []
+
+        # Compiled dispatch regexes, built on the first update after an add.
+        self._dispatch = None
         
     def add(self, name, pattern, f_getval, f_format, value=None):
         """
@@ -72,7 +85,10 @@ class ProtocolParameterDict(object):
         @param value The parameter value (initializes to None).        
         """
         val = ParameterDictVal(name, pattern, f_getval, f_format, value)
+        if name not in self._param_dict:
+            self._names.append(name)
         self._param_dict[name] = val
+        self._dispatch = None
         
     def get(self, name):
         """
@@ -89,19 +105,75 @@ class ProtocolParameterDict(object):
         @param value The parameter value.
         @raises KeyError if the name is invalid.
         """
-        self._param_dict[name] = value
+        self._param_dict[name].value = value
         
     def update(self, input):
         """
-        Update the dictionaray with a line input. Iterate through all objects
-        and attempt to match and update a parameter.
+        Update the dictionaray with a line input. The line is matched once
+        against the combined parameter patterns and the first parameter
+        matching, in the order added, is updated.
         @param input A string to match to a dictionary object.
-        @retval The name that was successfully updated, None if not updated
+        @retval The name that was successfully updated, False if not updated
         """
-        for (name, val) in self._param_dict.iteritems():
-            if val.update(input):
+        if self._dispatch is None:
+            self._dispatch = self._build_dispatch()
+
+        for (regex, names) in self._dispatch:
+            match = regex.match(input)
+            if match:
+                if len(names) > 1:
+                    name = names[int(match.lastgroup[1:])]
+                else:
+                    name = names[0]
+                self._param_dict[name].update(input)
                 return name
         return False
+
+    def _build_dispatch(self):
+        """
+        Compile the parameter patterns into as few alternation regexes as
+        the group limit allows, preserving the order parameters were added.
+        Each alternative is a named group so the match identifies the
+        parameter. Patterns that cannot be combined get a regex of their own.
+        @retval List of (regex, names) tuples, names the parameters the
+        regex alternates between.
+        """
+        dispatch = []
+        block = []
+        groups = 0
+        for name in self._names:
+            val = self._param_dict[name]
+            if UNCOMBINABLE.search(val.pattern):
+                if block:
+                    dispatch.append(self._combine(block))
+                    block = []
+                    groups = 0
+                dispatch.append((val.regex, [name]))
+                continue
+
+            if block and groups + val.regex.groups + 1 > MAX_REGEX_GROUPS:
+                dispatch.append(self._combine(block))
+                block = []
+                groups = 0
+            block.append(name)
+            groups += val.regex.groups + 1
+
+        if block:
+            dispatch.append(self._combine(block))
+        return dispatch
+
+    def _combine(self, names):
+        """
+        Compile an alternation of the parameter patterns, each in a group
+        named by its index in names.
+        @param names The parameter names, in match order.
+        @retval (regex, names) tuple.
+        """
+        if len(names) == 1:
+            return (self._param_dict[names[0]].regex, names)
+        pattern = '|'.join(['(?P<_%i>%s)' % (i, self._param_dict[name].pattern)
+                            for (i, name) in enumerate(names)])
+        return (re.compile(pattern), names)
     
     def get_config(self):
         """
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+"""
+@package ion.agents.instrument.test.test_driver_codec
+@file ion/agents.instrument/test/test_driver_codec.py
+@author Edward Hunter
+@brief Unit tests and benchmark for the driver process wire codecs.
+"""
+
+__author__ = 'Edward Hunter'
+__license__ = 'Apache 2.0'
+
+import time
+import unittest
+import logging
+
+import numpy as np
+from nose.plugins.attrib import attr
+
+from pyon.util.unit_test import PyonTestCase
+import ion.agents.instrument.driver_codec as driver_codec
+from ion.agents.instrument.exceptions import InstrumentProtocolException
+
+import ion.agents.instrument.mi_logger
+mi_logger = logging.getLogger('mi_logger')
+
+# bin/nosetests -s -v ion/agents/instrument/test/test_driver_codec.py
+
+def make_sample_event(count):
+    """
+    A driver sample event of count batched CTD samples.
+    """
+    return {
+        'type' : 'DRIVER_ASYNC_EVENT_SAMPLE',
+        'value' : {
+            't' : [20.0 + i * 0.0001 for i in xrange(count)],
+            'c' : [0.08707 + i * 0.00001 for i in xrange(count)],
+            'p' : [-6.945 + i * 0.001 for i in xrange(count)],
+            'time' : [1331000000.0 + i for i in xrange(count)],
+            'stream_name' : 'ctd_parsed'
+        },
+        'time' : 1331000000.0
+    }
+
+class Unencodable(object):
+    """
+    A type only pickle can encode.
+    """
+    def __eq__(self, other):
+        return isinstance(other, Unencodable)
+
+@attr('UNIT', group='mi')
+class TestDriverCodec(PyonTestCase):
+
+    def test_select(self):
+        """
+        The first available codec is selected, pickle if none is.
+        """
+        self.assertEqual(driver_codec.select_codec(['bogus', 'pickle']), 'pickle')
+        self.assertEqual(driver_codec.select_codec(['bogus']), 'pickle')
+        self.assertEqual(driver_codec.select_codec(None), 'pickle')
+
+    def test_pickle(self):
+        """
+        Pickle frames decode to the message.
+        """
+        msg = {'cmd' : 'set', 'args' : ({'NAVG' : 1},), 'kwargs' : {}}
+        frames = driver_codec.encode(msg, 'pickle')
+        self.assertEqual(frames[0], 'pickle')
+        self.assertEqual(driver_codec.decode(frames), msg)
+
+    @unittest.skipIf(driver_codec.msgpack is None, 'msgpack not installed.')
+    def test_msgpack(self):
+        """
+        Samples, exceptions and numpy arrays round trip through msgpack,
+        messages msgpack cannot encode fall back to pickle.
+        """
+        evt = make_sample_event(10)
+        frames = driver_codec.encode(evt, 'msgpack')
+        self.assertEqual(frames[0], 'msgpack')
+        self.assertEqual(driver_codec.decode(frames), evt)
+
+        reply = driver_codec.decode(driver_codec.encode(InstrumentProtocolException('bad'), 'msgpack'))
+        self.assertIsInstance(reply, InstrumentProtocolException)
+        self.assertEqual(reply.msg, 'bad')
+        self.assertEqual(reply.args, (None, 'bad'))
+
+        arr = np.arange(10, dtype=np.float64)
+        np.testing.assert_array_equal(driver_codec.decode(driver_codec.encode(arr, 'msgpack')), arr)
+
+        frames = driver_codec.encode({'value' : Unencodable()}, 'msgpack')
+        self.assertEqual(frames[0], 'pickle')
+        self.assertEqual(driver_codec.decode(frames), {'value' : Unencodable()})
+
+    @unittest.skipIf(driver_codec.msgpack is None, 'msgpack not installed.')
+    def test_msgpack_replies(self):
+        """
+        Driver replies round trip through msgpack. Tuples come back as
+        lists, so callers compare sequences as lists.
+        """
+        replies = [
+            None,
+            True,
+            'DRIVER_STATE_UNCONFIGURED',
+            ['acquire_sample', 'start_autosample', 'stop_autosample'],
+            {'NAVG' : 0, 'TA0' : -0.0002572242, 'OUTPUTSV' : False, 'SAMPLENUM' : 12},
+            {'DRIVER_PARAMETER_ALL' : {'INTERVAL' : 5}}
+        ]
+        for reply in replies:
+            self.assertEqual(driver_codec.decode(driver_codec.encode(reply, 'msgpack')), reply)
+
+        reply = driver_codec.decode(driver_codec.encode(('DRIVER_STATE_COMMAND', {'NAVG' : 1}), 'msgpack'))
+        self.assertEqual(reply, ['DRIVER_STATE_COMMAND', {'NAVG' : 1}])
+        (state, result) = reply
+        self.assertEqual(state, 'DRIVER_STATE_COMMAND')
+
+    def test_benchmark(self):
+        """
+        Measure events per second and bytes per sample of each codec for
+        single and batched samples.
+        """
+        count = 2000
+        for name in sorted(driver_codec.CODECS.keys()):
+            for batch in (1, 100):
+                evt = make_sample_event(batch)
+                start = time.time()
+                for i in xrange(count):
+                    frames = driver_codec.encode(evt, name)
+                    driver_codec.decode(frames)
+                elapsed = time.time() - start
+                self.assertEqual(frames[0], name)
+                mi_logger.info('Codec %s, %d samples per event: %f events/s, %f bytes/sample.',
+                               name, batch, count / elapsed, float(len(frames[1])) / batch)
+
+        if 'msgpack' in driver_codec.CODECS:
+            evt = make_sample_event(100)
+            self.assertLess(len(driver_codec.encode(evt, 'msgpack')[1]),
+                            len(driver_codec.encode(evt, 'pickle')[1]))
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+"""
+@package ion.agents.instrument.test.test_instrument_agent_buffer
+@file ion/agents.instrument/test/test_instrument_agent_buffer.py
+@author Edward Hunter
+@brief Unit tests for instrument agent sample coalescing.
+"""
+
+__author__ = 'Edward Hunter'
+__license__ = 'Apache 2.0'
+
+import threading
+
+import gevent
+from mock import Mock
+from nose.plugins.attrib import attr
+
+from pyon.util.unit_test import PyonTestCase
+from ion.agents.instrument.instrument_agent import InstrumentAgent
+
+# bin/nosetests -s -v ion/agents/instrument/test/test_instrument_agent_buffer.py
+
+def make_sample(i):
+    """
+    A sample dict as sent by the driver, less its stream name.
+    """
+    return {
+        't' : [float(i)],
+        'c' : [float(i) / 10],
+        'time' : [1000.0 + i]
+    }
+
+@attr('UNIT', group='mi')
+class TestSampleBuffer(PyonTestCase):
+
+    def setUp(self):
+        # An agent with the state used by sample coalescing only.
+        self.agent = InstrumentAgent.__new__(InstrumentAgent)
+        self.agent._proc_name = 'test_instrument_agent'
+        self.agent._buffer_config = {}
+        self.agent._sample_buffers = {}
+        self.agent._sample_buffer_lock = threading.RLock()
+        self.agent._lat = 0
+        self.agent._lon = 0
+        self.agent._data_streams = {'ctd_parsed' : 'stream_id'}
+        self.agent._packet_factories = {'ctd_parsed' : lambda **value : value}
+        self.publisher = Mock()
+        self.agent._data_publishers = {'ctd_parsed' : self.publisher}
+
+    def packets(self):
+        return [call[0][0] for call in self.publisher.publish.call_args_list]
+
+    def test_unbuffered(self):
+        """
+        Streams without a buffer config publish every sample.
+        """
+        for i in range(3):
+            self.agent._buffer_sample('ctd_parsed', make_sample(i))
+        self.assertEqual([packet['t'] for packet in self.packets()], [[0.0], [1.0], [2.0]])
+
+    def test_count_flush(self):
+        """
+        A buffer is published once it holds max_records records, and its
+        latency timer is cancelled.
+        """
+        self.agent._buffer_config = {'ctd_parsed' : {'max_records' : 3, 'max_latency' : 0.2}}
+        for i in range(4):
+            self.agent._buffer_sample('ctd_parsed', make_sample(i))
+
+        packets = self.packets()
+        self.assertEqual(len(packets), 1)
+        self.assertEqual(packets[0]['t'], [0.0, 1.0, 2.0])
+        self.assertEqual(packets[0]['lat'], [0, 0, 0])
+        self.assertEqual(packets[0]['stream_id'], 'stream_id')
+
+        # Only the remaining sample is published on expiry of its latency.
+        gevent.sleep(0.4)
+        packets = self.packets()
+        self.assertEqual(len(packets), 2)
+        self.assertEqual(packets[1]['t'], [3.0])
+
+    def test_latency_flush(self):
+        """
+        A buffer is published on expiry of max_latency though no further
+        sample arrives.
+        """
+        self.agent._buffer_config = {'ctd_parsed' : {'max_records' : 100, 'max_latency' : 0.2}}
+        self.agent._buffer_sample('ctd_parsed', make_sample(0))
+        self.agent._buffer_sample('ctd_parsed', make_sample(1))
+        self.assertEqual(self.packets(), [])
+
+        gevent.sleep(0.4)
+        packets = self.packets()
+        self.assertEqual(len(packets), 1)
+        self.assertEqual(packets[0]['t'], [0.0, 1.0])
+        self.assertEqual(self.agent._sample_buffers, {})
+
+        # A flush before expiry cancels the timer.
+        self.agent._buffer_sample('ctd_parsed', make_sample(2))
+        self.agent._flush_sample_buffers()
+        gevent.sleep(0.4)
+        self.assertEqual(len(self.packets()), 2)
+
+    def test_no_latency(self):
+        """
+        A buffer without max_latency is only published once full.
+        """
+        self.agent._buffer_config = {'ctd_parsed' : {'max_records' : 3}}
+        for i in range(5):
+            self.agent._buffer_sample('ctd_parsed', make_sample(i))
+        gevent.sleep(0.1)
+
+        packets = self.packets()
+        self.assertEqual(len(packets), 1)
+        self.assertEqual(packets[0]['t'], [0.0, 1.0, 2.0])
+        self.assertEqual(self.agent._sample_buffers['ctd_parsed']['count'], 2)
+        self.assertEqual(self.agent._sample_buffers['ctd_parsed'].get('timer', None), None)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+"""
+@package ion.agents.instrument.test.test_instrument_driver
+@file ion/agents.instrument/test/test_instrument_driver.py
+@author Edward Hunter
+@brief Unit tests for instrument driver sample batching.
+"""
+
+__author__ = 'Edward Hunter'
+__license__ = 'Apache 2.0'
+
+import time
+import logging
+
+from nose.plugins.attrib import attr
+
+from pyon.util.unit_test import PyonTestCase
+from ion.agents.instrument.instrument_driver import SingleConnectionInstrumentDriver
+from ion.agents.instrument.instrument_driver import DriverAsyncEvent
+from ion.agents.instrument.instrument_driver import DriverConnectionState
+from ion.agents.instrument.exceptions import InstrumentParameterException
+
+import ion.agents.instrument.mi_logger
+mi_logger = logging.getLogger('mi_logger')
+
+# bin/nosetests -s -v ion/agents/instrument/test/test_instrument_driver.py
+
+def make_sample(i, stream_name='ctd_parsed'):
+    """
+    A sample dict as built by a protocol from one device line.
+    """
+    return {
+        't' : [float(i)],
+        'c' : [float(i) / 10],
+        'p' : [float(i) / 100],
+        'time' : [1000.0 + i],
+        'stream_name' : stream_name
+    }
+
+@attr('UNIT', group='mi')
+class TestSampleBatching(PyonTestCase):
+
+    def setUp(self):
+        self.events = []
+        self.driver = SingleConnectionInstrumentDriver(self.events.append)
+        del self.events[:]
+
+    def samples(self):
+        return [evt['value'] for evt in self.events if evt['type'] == DriverAsyncEvent.SAMPLE]
+
+    def test_unbatched(self):
+        """
+        By default each sample is sent as its own event.
+        """
+        for i in range(3):
+            self.driver._driver_event(DriverAsyncEvent.SAMPLE, make_sample(i))
+        self.assertEqual(self.samples(), [make_sample(i) for i in range(3)])
+
+    def test_batch_size(self):
+        """
+        Samples are sent in columns once a batch is full, and the remainder
+        ahead of a state change.
+        """
+        self.driver.set_sample_batching(max_samples=3, max_latency=60)
+        for i in range(7):
+            self.driver._driver_event(DriverAsyncEvent.SAMPLE, make_sample(i))
+
+        samples = self.samples()
+        self.assertEqual(len(samples), 2)
+        self.assertEqual(samples[0]['t'], [0.0, 1.0, 2.0])
+        self.assertEqual(samples[1]['time'], [1003.0, 1004.0, 1005.0])
+        self.assertEqual(samples[1]['stream_name'], 'ctd_parsed')
+
+        self.driver._driver_event(DriverAsyncEvent.STATE_CHANGE)
+        self.assertEqual(self.events[-2]['value']['p'], [0.06])
+        self.assertEqual(self.events[-1]['type'], DriverAsyncEvent.STATE_CHANGE)
+        self.assertEqual(self.events[-1]['value'], DriverConnectionState.UNCONFIGURED)
+
+    def test_batch_latency(self):
+        """
+        A batch is sent when its oldest sample reaches the latency, each
+        stream in its own event.
+        """
+        self.driver.set_sample_batching(max_samples=100, max_latency=0.2)
+        self.driver._driver_event(DriverAsyncEvent.SAMPLE, make_sample(0))
+        self.driver._driver_event(DriverAsyncEvent.SAMPLE, make_sample(1, 'ctd_raw'))
+        self.driver._driver_event(DriverAsyncEvent.SAMPLE, make_sample(2))
+        self.assertEqual(self.samples(), [])
+
+        time.sleep(0.5)
+        samples = dict((sample['stream_name'], sample) for sample in self.samples())
+        self.assertEqual(len(self.samples()), 2)
+        self.assertEqual(samples['ctd_parsed']['t'], [0.0, 2.0])
+        self.assertEqual(samples['ctd_raw']['t'], [1.0])
+
+    def test_invalid(self):
+        """
+        Invalid batching limits are rejected.
+        """
+        self.assertRaises(InstrumentParameterException, self.driver.set_sample_batching, 0)
+        self.assertRaises(InstrumentParameterException, self.driver.set_sample_batching, 2, -1)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+"""
+@package ion.agents.instrument.test.test_line_framer
+@file ion/agents.instrument/test/test_line_framer.py
+@author Edward Hunter
+@brief Unit tests for the protocol line framer.
+"""
+
+__author__ = 'Edward Hunter'
+__license__ = 'Apache 2.0'
+
+import threading
+import time
+import logging
+
+from nose.plugins.attrib import attr
+
+from pyon.util.unit_test import PyonTestCase
+from ion.agents.instrument.line_framer import LineFramer
+
+import ion.agents.instrument.mi_logger
+mi_logger = logging.getLogger('mi_logger')
+
+# bin/nosetests -s -v ion/agents/instrument/test/test_line_framer.py
+
+NEWLINE = '\r\n'
+PROMPTS = ['S>', 'S>\r\n', '<Executed/>\r\n']
+SAMPLE = '#  20.0000,  0.08707, -6.945\r\n'
+
+@attr('UNIT', group='mi')
+class TestLineFramer(PyonTestCase):
+
+    def setUp(self):
+        self.framer = LineFramer(NEWLINE, PROMPTS, max_size=1024)
+
+    def test_lines(self):
+        """
+        Lines are completed across chunks and the partial line carried.
+        """
+        self.assertEqual(self.framer.add('abc'), [])
+        self.assertEqual(self.framer.add('def\r'), [])
+        self.assertEqual(self.framer.add('\nghi\r\njk'), ['abcdef', 'ghi'])
+        self.assertEqual(self.framer.add('l\r\n'), ['jkl'])
+        self.assertEqual(self.framer.get_response(), 'abcdef\r\nghi\r\njkl\r\n')
+
+    def test_prompt(self):
+        """
+        The prompt the data currently ends with is tracked.
+        """
+        self.framer.add('DS\r\nS')
+        self.assertEqual(self.framer.get_prompt(), None)
+        self.framer.add('>')
+        self.assertEqual(self.framer.get_prompt(), 'S>')
+        self.framer.add('more')
+        self.assertEqual(self.framer.get_prompt(), None)
+        self.assertEqual(self.framer.wait_prompt(0, ['more']), 'more')
+        self.framer.clear()
+        self.assertEqual(self.framer.get_prompt(), None)
+        self.assertEqual(self.framer.get_response(), '')
+
+    def test_bounded(self):
+        """
+        Continuous output keeps at most max_size bytes.
+        """
+        for i in range(1000):
+            lines = self.framer.add(SAMPLE)
+            self.assertEqual(lines, [SAMPLE[:-2]])
+        response = self.framer.get_response()
+        self.assertEqual(len(response), 1024)
+        self.assertTrue(response.endswith(SAMPLE))
+
+        self.framer.add('x' * 5000)
+        self.assertEqual(self.framer.add('\r\n'), ['x' * 1024])
+
+    def test_wait_prompt(self):
+        """
+        A waiting command is woken as soon as the prompt arrives.
+        """
+        def respond():
+            time.sleep(.2)
+            self.framer.add('response\r\n')
+            self.framer.add('S>')
+        thread = threading.Thread(target=respond)
+        start = time.time()
+        thread.start()
+        prompt = self.framer.wait_prompt(5)
+        elapsed = time.time() - start
+        thread.join()
+        self.assertEqual(prompt, 'S>')
+        self.assertTrue(elapsed < 1)
+        self.assertEqual(self.framer.get_response(), 'response\r\nS>')
+
+    def test_wait_prompt_timeout(self):
+        """
+        Waiting for a prompt that does not come times out.
+        """
+        self.framer.add('no prompt')
+        start = time.time()
+        self.assertEqual(self.framer.wait_prompt(.2), None)
+        self.assertTrue(time.time() - start >= .2)
+
+    def test_throughput(self):
+        """
+        Per sample cost does not grow with the amount of output.
+        """
+        def run(n):
+            start = time.time()
+            for i in xrange(n):
+                self.framer.add(SAMPLE)
+            return (time.time() - start) / n
+
+        first = run(5000)
+        second = run(50000)
+        mi_logger.info('LineFramer: %f us per sample.', second * 1e6)
+        self.assertTrue(second < first * 3)
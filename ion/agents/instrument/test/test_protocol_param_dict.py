@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+"""
+@package ion.agents.instrument.test.test_protocol_param_dict
+@file ion/agents.instrument/test/test_protocol_param_dict.py
+@author Edward Hunter
+@brief Unit tests and benchmark for the protocol parameter dictionary.
+"""
+
+__author__ = 'Edward Hunter'
+__license__ = 'Apache 2.0'
+
+import time
+import logging
+
+from nose.plugins.attrib import attr
+
+from pyon.util.unit_test import PyonTestCase
+from ion.agents.instrument.protocol_param_dict import ProtocolParameterDict
+from ion.agents.instrument.protocol_param_dict import MAX_REGEX_GROUPS
+from ion.agents.instrument.drivers.sbe37.sbe37_driver import SBE37Protocol
+from ion.agents.instrument.drivers.sbe37.sbe37_driver import SBE37Prompt
+from ion.agents.instrument.drivers.sbe37.sbe37_driver import SBE37Parameter
+from ion.agents.instrument.drivers.sbe37.sbe37_driver import SBE37_NEWLINE
+
+import ion.agents.instrument.mi_logger
+mi_logger = logging.getLogger('mi_logger')
+
+# bin/nosetests -s -v ion/agents/instrument/test/test_protocol_param_dict.py
+
+# DS and DC output captured from the SBE37 simulator.
+DSDC_RESPONSE = SBE37_NEWLINE.join([
+    'SBE37-SMP V 2.6 SERIAL NO. 2165   05 Feb 2012  01:27:17',
+    'not logging: received stop command',
+    'sample interval = 20208 seconds',
+    'samplenumber = 0, free = 200000',
+    'do not transmit real-time data',
+    'do not output salinity with each sample',
+    'do not output sound velocity with each sample',
+    'do not store time with each sample',
+    'number of samples to average = 0',
+    'reference pressure = 0.0 db',
+    'serial sync mode disabled',
+    'wait time after serial sync sampling = 0 seconds',
+    'SBE37-SM V 2.6b  3464',
+    'temperature:  08-nov-05',
+    '    TA0 = -2.572242e-04',
+    '    TA1 = 3.138936e-04',
+    '    TA2 = -9.717158e-06',
+    '    TA3 = 2.138735e-07',
+    'conductivity:  09-nov-05',
+    '    G = -9.870930e-01',
+    '    H = 1.417895e-01',
+    '    I = 1.334915e-04',
+    '    J = 3.339261e-05',
+    '    CPCOR = 9.570000e-08',
+    '    CTCOR = 3.250000e-06',
+    '    WBOTC = 1.202400e-05',
+    'pressure S/N 4955, range = 10847.1964958 psia:  12-aug-05',
+    '    PA0 = 5.916199e+00',
+    '    PA1 = 4.851819e-01',
+    '    PA2 = 4.596432e-07',
+    '    PTCA0 = 2.762492e+02',
+    '    PTCA1 = 6.603433e-01',
+    '    PTCA2 = 5.756490e-03',
+    '    PTCSB0 = 2.461450e+01',
+    '    PTCSB1 = -9.000000e-04',
+    '    PTCSB2 = 0.000000e+00',
+    '    POFFSET = 0.000000e+00',
+    'rtc:  08-nov-05',
+    '    RTCA0 = 9.999862e-01',
+    '    RTCA1 = 1.686132e-06',
+    '    RTCA2 = -3.022745e-08',
+    ''
+])
+
+def sbe37_param_dict():
+    """
+    The parameter dictionary of an SBE37 protocol.
+    """
+    return SBE37Protocol(SBE37Prompt, SBE37_NEWLINE, lambda *args : None)._param_dict
+
+def naive_update(param_dict, line):
+    """
+    Match a line against each parameter in turn, as the dictionary did
+    before dispatch was compiled.
+    """
+    for name in param_dict._names:
+        if param_dict._param_dict[name].update(line):
+            return name
+    return False
+
+@attr('UNIT', group='mi')
+class TestProtocolParameterDict(PyonTestCase):
+
+    def setUp(self):
+        self.param_dict = sbe37_param_dict()
+        self.lines = DSDC_RESPONSE.split(SBE37_NEWLINE)
+
+    def test_update(self):
+        """
+        Each line updates the same parameter it did when matched one
+        parameter at a time.
+        """
+        expected = sbe37_param_dict()
+        for line in self.lines:
+            self.assertEqual(self.param_dict.update(line), naive_update(expected, line))
+        self.assertEqual(self.param_dict.get_config(), expected.get_config())
+
+        self.assertEqual(self.param_dict.get(SBE37Parameter.INTERVAL), 20208)
+        self.assertEqual(self.param_dict.get(SBE37Parameter.OUTPUTSAL), False)
+        self.assertEqual(self.param_dict.get(SBE37Parameter.SYNCMODE), False)
+        self.assertAlmostEqual(self.param_dict.get(SBE37Parameter.TA0), -2.572242e-04)
+        self.assertAlmostEqual(self.param_dict.get(SBE37Parameter.PTCB0), 2.461450e+01)
+        self.assertEqual(self.param_dict.get(SBE37Parameter.PCALDATE), (12, 8, 2005))
+        self.assertEqual(self.param_dict.update('S>'), False)
+
+    def test_order(self):
+        """
+        The first parameter added wins when several match, and parameters
+        added or replaced after an update take effect.
+        """
+        param_dict = ProtocolParameterDict()
+        param_dict.add('a', r'x = (\d+)', lambda match : int(match.group(1)), str)
+        param_dict.add('b', r'x = (\d+) y', lambda match : int(match.group(1)), str)
+        self.assertEqual(param_dict.update('x = 1 y'), 'a')
+        self.assertEqual(param_dict.get('a'), 1)
+
+        param_dict.add('a', r'z = (\d+)', lambda match : int(match.group(1)), str)
+        self.assertEqual(param_dict.update('x = 2 y'), 'b')
+        self.assertEqual(param_dict.get('b'), 2)
+        self.assertEqual(param_dict.update('z = 3'), 'a')
+        self.assertEqual(param_dict.get('a'), 3)
+
+        param_dict.set('a', 4)
+        self.assertEqual(param_dict.get('a'), 4)
+
+    def test_uncombinable(self):
+        """
+        Patterns with named groups, backreferences or inline flags, and
+        parameter sets exceeding the regex group limit, are matched.
+        """
+        param_dict = ProtocolParameterDict()
+        param_dict.add('named', r'n = (?P<val>\d+)', lambda match : int(match.group('val')), str)
+        param_dict.add('backref', r'(\w)=\1', lambda match : match.group(1), str)
+        param_dict.add('flags', r'(?i)flag (\w+)', lambda match : match.group(1), str)
+        for i in range(MAX_REGEX_GROUPS):
+            param_dict.add('p%i' % i, r'p%i = (\d+)' % i, lambda match : int(match.group(1)), str)
+
+        self.assertEqual(param_dict.update('n = 5'), 'named')
+        self.assertEqual(param_dict.get('named'), 5)
+        self.assertEqual(param_dict.update('q=q'), 'backref')
+        self.assertEqual(param_dict.update('FLAG on'), 'flags')
+        self.assertEqual(param_dict.get('flags'), 'on')
+        self.assertEqual(param_dict.update('p0 = 7'), 'p0')
+        self.assertEqual(param_dict.update('p%i = 8' % (MAX_REGEX_GROUPS - 1)), 'p%i' % (MAX_REGEX_GROUPS - 1))
+        self.assertEqual(param_dict.get('p%i' % (MAX_REGEX_GROUPS - 1)), 8)
+        self.assertEqual(param_dict.update('p = 9'), False)
+
+    def test_benchmark(self):
+        """
+        Parse DS and DC output with compiled dispatch and one parameter at a
+        time.
+        """
+        count = 200
+        naive_dict = sbe37_param_dict()
+        mi_logger_level = mi_logger.level
+        mi_logger.setLevel(logging.INFO)
+        try:
+            start = time.time()
+            for i in xrange(count):
+                for line in self.lines:
+                    naive_update(naive_dict, line)
+            naive_time = time.time() - start
+
+            start = time.time()
+            for i in xrange(count):
+                for line in self.lines:
+                    self.param_dict.update(line)
+            dispatch_time = time.time() - start
+        finally:
+            mi_logger.setLevel(mi_logger_level)
+
+        mi_logger.info('Parsed %i DS/DC responses: %f s one parameter at a time, %f s dispatched.',
+                       count, naive_time, dispatch_time)
+        self.assertLess(dispatch_time, naive_time)
@@ -15,6 +15,7 @@ from gevent import monkey; monkey.patch_all()
 import time
 import unittest
 import logging
+import os
 
 from nose.plugins.attrib import attr
 
@@ -22,6 +23,10 @@ from pyon.util.unit_test import PyonTestCase
 
 from ion.agents.instrument.zmq_driver_client import ZmqDriverClient
 from ion.agents.instrument.zmq_driver_process import ZmqDriverProcess
+from ion.agents.instrument.instrument_driver import DriverAsyncEvent
+from ion.agents.instrument.instrument_driver import DriverConnectionState
+from ion.agents.instrument.exceptions import InstrumentCommandException
+import ion.agents.instrument.driver_codec as driver_codec
 import ion.agents.instrument.mi_logger
 
 mi_logger = logging.getLogger('mi_logger')
@@ -104,4 +109,128 @@ class TestZmqDriverProcess(PyonTestCase):
         """
         """
         
-        pass 
\ No newline at end of file
+        pass
+
+
+@attr('INT', group='mi')
+class TestZmqDriverProcessLatency(PyonTestCase):
+    """
+    Benchmarks of command round trip latency and event throughput through
+    a ZMQ driver process.
+    """
+
+    def setUp(self):
+        """
+        Launch a driver process and connect a client to it.
+        """
+        self.dvr_mod = 'ion.agents.instrument.drivers.sbe37.sbe37_driver'
+        self.dvr_cls = 'SBE37Driver'
+        self.events = []
+
+        (self.dvr_proc, cmd_port, evt_port) = ZmqDriverProcess.launch_process(
+            self.dvr_mod, self.dvr_cls, '/tmp/', os.getpid())
+        self.dvr_client = ZmqDriverClient('localhost', cmd_port, evt_port)
+        self.dvr_client.start_messaging(self.events.append)
+        self.addCleanup(self.dvr_client.done)
+
+    def test_cmd_round_trip(self):
+        """
+        Measure process_echo round trip latency.
+        """
+        count = 500
+        reply = self.dvr_client.cmd_dvr('process_echo', 'warm up')
+        self.assertEqual(reply, 'process_echo: warm up')
+
+        start_time = time.time()
+        for i in xrange(count):
+            self.dvr_client.cmd_dvr('process_echo', i)
+        elapsed = time.time() - start_time
+
+        mi_logger.info('Driver command round trip: %f ms (%d commands).',
+                       1000.0*elapsed/count, count)
+        # Poll loops used to sleep up to 100ms per command.
+        self.assertTrue(elapsed/count < .05)
+
+    def test_event_throughput(self):
+        """
+        Measure events per second published by the driver process.
+        """
+        count = 5000
+        events = [{'type':'test', 'value':i} for i in xrange(count)]
+
+        # The SUB socket drops events until it is connected.
+        time.sleep(1)
+        start_time = time.time()
+        reply = self.dvr_client.cmd_dvr('test_events', events=events)
+        self.assertEqual(reply, 'test_events')
+        while len(self.events) < count and time.time() - start_time < 30:
+            time.sleep(.01)
+        elapsed = time.time() - start_time
+
+        mi_logger.info('Driver events: %d received in %f s, %f events/s.',
+                       len(self.events), elapsed, len(self.events)/elapsed)
+        self.assertEqual(len(self.events), count)
+
+    def test_reply_codecs(self):
+        """
+        Command replies and exceptions survive each codec, msgpack (the
+        default) included, which decodes tuples as lists.
+        """
+        self.assertEqual(self.dvr_client.codec,
+                         driver_codec.select_codec(driver_codec.DEFAULT_CODECS))
+
+        for name in sorted(driver_codec.CODECS.keys()):
+            self.dvr_client.codec = name
+
+            reply = self.dvr_client.cmd_dvr('process_echo', 'codec %s' % name)
+            self.assertEqual(reply, 'process_echo: codec %s' % name)
+
+            # Tuple arguments arrive as lists with msgpack.
+            reply = self.dvr_client.cmd_dvr('process_echo', (1, 2))
+            expected = (1, 2) if name == driver_codec.PickleCodec.name else [1, 2]
+            self.assertEqual(reply, 'process_echo: %s' % str(expected))
+
+            reply = self.dvr_client.cmd_dvr('get_current_state')
+            self.assertEqual(reply, DriverConnectionState.UNCONFIGURED)
+
+            reply = self.dvr_client.cmd_dvr('get_resource_commands')
+            self.assertIsInstance(reply, list)
+
+            with self.assertRaises(InstrumentCommandException):
+                self.dvr_client.cmd_dvr('bogus_command')
+
+    def test_event_codecs(self):
+        """
+        Measure sample events per second and bytes per sample published
+        by the driver process with each codec.
+        """
+        count = 2000
+        batch = 10
+        value = {
+            't' : [20.0 + i * 0.0001 for i in xrange(batch)],
+            'c' : [0.08707 + i * 0.00001 for i in xrange(batch)],
+            'p' : [-6.945 + i * 0.001 for i in xrange(batch)],
+            'time' : [1331000000.0 + i for i in xrange(batch)],
+            'stream_name' : 'ctd_parsed'
+        }
+        events = [{'type':DriverAsyncEvent.SAMPLE, 'value':value, 'time':time.time()}
+                  for i in xrange(count)]
+
+        # The SUB socket drops events until it is connected.
+        time.sleep(1)
+        for name in sorted(driver_codec.CODECS.keys()):
+            reply = self.dvr_client.cmd_dvr('select_codec', [name])
+            self.assertEqual(reply, name)
+            del self.events[:]
+
+            start_time = time.time()
+            self.dvr_client.cmd_dvr('test_events', events=events)
+            while len(self.events) < count and time.time() - start_time < 30:
+                time.sleep(.01)
+            elapsed = time.time() - start_time
+
+            size = len(driver_codec.encode(events[0], name)[1])
+            mi_logger.info('Driver events with codec %s: %f events/s, %f bytes/sample.',
+                           name, len(self.events)/elapsed, float(size)/batch)
+            self.assertEqual(len(self.events), count)
+            self.assertEqual(self.events[-1]['value'], value)
@@ -21,15 +21,43 @@ import thread
 import logging
 import time
 
-# We import "regular" zmq, not the patched version because
-# we handle the nonblocking sockets directly as they need to work
-# with unpatched threads as well.
+# We import "regular" zmq, not the patched version because the client
+# needs to work with unpatched threads as well. When the thread module
+# is patched by gevent the green module is selected at messaging start.
 import zmq
 
 from ion.agents.instrument.driver_client import DriverClient
+import ion.agents.instrument.driver_codec as driver_codec
 
 mi_logger = logging.getLogger('mi_logger')
 
+# Milliseconds the event loop waits before rechecking its stop flag.
+POLL_TIMEOUT = 100
+
+def _select_zmq():
+    """
+    Select the zmq module for the client sockets. Under gevent, threads
+    are greenlets and a blocking poll would stall the hub, so use the
+    green zmq module whose poller yields to other greenlets.
+    @retval Tuple of the zmq module and a flag that is True if blocking
+    polls are safe.
+    """
+    try:
+        import gevent.thread
+        patched = thread.start_new_thread is gevent.thread.start_new_thread
+    except (ImportError, AttributeError):
+        patched = False
+
+    if not patched:
+        return (zmq, True)
+
+    try:
+        import zmq.green as green_zmq
+        return (green_zmq, True)
+    except ImportError:
+        return (zmq, False)
+
+
  
 class ZmqDriverClient(DriverClient):
     """
@@ -54,48 +82,82 @@ class ZmqDriverClient(DriverClient):
         self.zmq_cmd_socket = None
         self.event_thread = None
         self.stop_event_thread = True
+        self.zmq = zmq
+        self.can_block = True
+        self.cmd_poller = None
+        self.codec = driver_codec.PickleCodec.name
         
-    def start_messaging(self, evt_callback=None):
+    def _poll(self, poller, timeout):
+        """
+        Poll for socket readiness, yielding instead of blocking when
+        blocking polls are not safe.
+        @param poller The zmq poller.
+        @param timeout Maximum milliseconds to wait, None to wait forever.
+        @retval dict of ready sockets to events.
+        """
+        if self.can_block:
+            return dict(poller.poll(timeout))
+        socks = dict(poller.poll(0))
+        if not socks:
+            time.sleep(.005)
+        return socks
+
+    def start_messaging(self, evt_callback=None, codecs=None):
         """
         Initialize and start messaging resources for the driver process client.
-        Initializes command socket for sending requests,
-        and starts event thread that listens for events from the driver
-        process independently of command request-reply.
+        Initializes command socket for sending requests, selects the message
+        codec with the driver process and starts event thread that listens
+        for events from the driver process independently of command
+        request-reply.
+        @param evt_callback Callback receiving driver events.
+        @param codecs List of codec names, most preferred first. Defaults
+        to driver_codec.DEFAULT_CODECS.
         """
+        (self.zmq, self.can_block) = _select_zmq()
+        zmq = self.zmq
         self.zmq_context = zmq.Context()
         self.zmq_cmd_socket = self.zmq_context.socket(zmq.REQ)
         self.zmq_cmd_socket.connect(self.cmd_host_string)
+        self.cmd_poller = zmq.Poller()
+        self.cmd_poller.register(self.zmq_cmd_socket, zmq.POLLIN)
         mi_logger.info('Driver client cmd socket connected to %s.',
                        self.cmd_host_string)        
         self.evt_callback = evt_callback
+
+        # Negotiate the codec in pickle, which both ends understand.
+        if codecs is None:
+            codecs = driver_codec.DEFAULT_CODECS
+        codecs = [name for name in codecs if name in driver_codec.CODECS]
+        self.codec = driver_codec.PickleCodec.name
+        self.codec = self.cmd_dvr('select_codec', codecs)
+        mi_logger.info('Driver client selected codec %s.', self.codec)
         
         def recv_evt_messages(driver_client):
             """
             A looping function that monitors a ZMQ SUB socket for asynchronous
-            driver events. Can be run as a thread or greenlet.
+            driver events. Can be run as a thread or greenlet. The poller
+            wakes on event arrival, its timeout only bounds how long a stop
+            request takes to be noticed.
             @param driver_client The client object that launches the thread.
             """
+            zmq = driver_client.zmq
             context = zmq.Context()
             sock = context.socket(zmq.SUB)
             sock.connect(driver_client.event_host_string)
             sock.setsockopt(zmq.SUBSCRIBE, '')
             mi_logger.info('Driver client event thread connected to %s.',
                   driver_client.event_host_string)
+            poller = zmq.Poller()
+            poller.register(sock, zmq.POLLIN)
 
             driver_client.stop_event_thread = False
-            #last_time = time.time()
             while not driver_client.stop_event_thread:
-                try:
-                    evt = sock.recv_pyobj(flags=zmq.NOBLOCK)
+                socks = driver_client._poll(poller, POLL_TIMEOUT)
+                if socks.get(sock) == zmq.POLLIN:
+                    evt = driver_codec.decode(sock.recv_multipart())
                     mi_logger.debug('got event: %s', str(evt))
                     if driver_client.evt_callback:
                         driver_client.evt_callback(evt)
-                except zmq.ZMQError:
-                    time.sleep(.5)
-                #cur_time = time.time()
-                #if cur_time - last_time > 5:
-                #    mi_logger.info('event thread listening')
-                #    last_time = cur_time
             sock.close()
             context.term()
             mi_logger.info('Client event socket closed.')
@@ -110,6 +172,7 @@ class ZmqDriverClient(DriverClient):
         Await event thread completion and return.
         """
         
+        self.cmd_poller = None
         self.zmq_cmd_socket.close()
         self.zmq_cmd_socket = None
         self.zmq_context.term()
@@ -134,32 +197,18 @@ class ZmqDriverClient(DriverClient):
         msg = {'cmd':cmd,'args':args,'kwargs':kwargs}
         
         mi_logger.debug('Sending command %s.', str(msg))
-        while True:
-            try:
-                # Attempt command send. Retry if necessary.
-                self.zmq_cmd_socket.send_pyobj(msg)
-                if msg == 'stop_driver_process':
-                    return 'driver stopping'
-
-                # Command sent, break out and wait for reply.
-                break    
-
-            except zmq.ZMQError:
-                # Socket not ready to accept send. Sleep and retry later.
-                time.sleep(.5)
+        # A REQ socket awaiting no reply can always send.
+        self.zmq_cmd_socket.send_multipart(driver_codec.encode(msg, self.codec))
+        if msg == 'stop_driver_process':
+            return 'driver stopping'
             
         mi_logger.debug('Awaiting reply.')
         while True:
-            try:
-                # Attempt reply recv. Retry if necessary.
-                reply = self.zmq_cmd_socket.recv_pyobj(flags=zmq.NOBLOCK)
-
-                # Reply recieved, break and return.
+            # Wait for the reply, waking as soon as it arrives.
+            socks = self._poll(self.cmd_poller, None)
+            if socks.get(self.zmq_cmd_socket) == self.zmq.POLLIN:
+                reply = driver_codec.decode(self.zmq_cmd_socket.recv_multipart())
                 break
-
-            except zmq.ZMQError:
-                # Socket not ready with the reply. Sleep and retry later.
-                time.sleep(.5)
                 
         mi_logger.debug('Reply: %s.', str(reply))
         
@@ -24,21 +24,30 @@ import time
 import logging
 import sys
 import uuid
+import Queue
 
 import zmq
 
 import ion.agents.instrument.mi_logger
 import ion.agents.instrument.driver_process as driver_process
+import ion.agents.instrument.driver_codec as driver_codec
 from ion.agents.instrument.instrument_driver import DriverAsyncEvent
 
 mi_logger = logging.getLogger('mi_logger')
 
+# Milliseconds the messaging loops wait before rechecking their stop flags.
+POLL_TIMEOUT = 100
+
 class ZmqDriverProcess(driver_process.DriverProcess):
     """
     A OS-level driver process that communicates with ZMQ sockets.
     Command-REP and event-PUB sockets monitor and react to comms
-    needs in separate threads, which can be signaled to end
+    needs in separate threads blocking on a zmq poller and the event
+    queue respectively, which can be signaled to end
     by setting boolean flags stop_cmd_thread and stop_evt_thread.
+    Messages are two frames, the codec name and the encoded message.
+    Replies use the codec of the request, events the codec selected by
+    the client.
     """
     
     @classmethod
@@ -112,20 +121,38 @@ class ZmqDriverProcess(driver_process.DriverProcess):
         self.stop_evt_thread = True
         self.cmd_thread = None
         self.stop_cmd_thread = True
+        self.codec = driver_codec.PickleCodec.name
+
+    def cmd_driver(self, msg):
+        """
+        Process a command message, selecting the event codec if the
+        message is 'select_codec' with the client codec preference list.
+        @param msg A driver command message.
+        @retval The driver command result, the codec name for
+        'select_codec'.
+        """
+        if msg.get('cmd', None) == 'select_codec':
+            self.codec = driver_codec.select_codec(msg['args'][0])
+            mi_logger.info('Driver process selected codec %s.', self.codec)
+            return self.codec
+
+        return driver_process.DriverProcess.cmd_driver(self, msg)
         
     def start_messaging(self):
         """
         Initialize and start messaging resources for the driver, blocking
         until messaging terminates. This ZMQ implementation starts and
-        joins command and event threads, managing nonblocking send/recv calls
-        on REP and PUB sockets, respectively. Terminate loops and close
+        joins command and event threads, managing poller driven send/recv
+        calls on REP and PUB sockets, respectively. Terminate loops and close
         sockets when stop flag is set in driver process.
         """
         
         def recv_cmd_msg(zmq_driver_process):
             """
             Await commands on a ZMQ REP socket, forwaring them to the
-            driver for processing and returning the result.
+            driver for processing and returning the result. The poller
+            wakes on command arrival, its timeout only bounds how long a
+            stop request takes to be noticed.
             """
             context = zmq.Context()
             sock = context.socket(zmq.REP)
@@ -134,22 +161,19 @@ class ZmqDriverProcess(driver_process.DriverProcess):
                            zmq_driver_process.cmd_port)
             file(zmq_driver_process.cmd_port_fname,'w+').write(str(zmq_driver_process.cmd_port)+'\n')
 
+            poller = zmq.Poller()
+            poller.register(sock, zmq.POLLIN)
+
             zmq_driver_process.stop_cmd_thread = False
             while not zmq_driver_process.stop_cmd_thread:
-                try:
-                    msg = sock.recv_pyobj(flags=zmq.NOBLOCK)
+                socks = dict(poller.poll(POLL_TIMEOUT))
+                if socks.get(sock) == zmq.POLLIN:
+                    frames = sock.recv_multipart()
+                    msg = driver_codec.decode(frames)
                     mi_logger.debug('Processing message %s', str(msg))
                     reply = zmq_driver_process.cmd_driver(msg)
-                    while True:
-                        try:
-                            sock.send_pyobj(reply, flags=zmq.NOBLOCK)
-                            break
-                        except zmq.ZMQError:
-                            time.sleep(.1)
-                            if zmq_driver_process.stop_cmd_thread:
-                                break
-                except zmq.ZMQError:
-                    time.sleep(.1)
+                    # A REP socket that has received a request can always send.
+                    sock.send_multipart(driver_codec.encode(reply, frames[0]))
                 
             sock.close()
             context.term()
@@ -158,7 +182,8 @@ class ZmqDriverProcess(driver_process.DriverProcess):
         def send_evt_msg(zmq_driver_process):
             """
             Await events on the driver process event queue and publish them
-            on a ZMQ PUB socket to the driver process client.
+            on a ZMQ PUB socket to the driver process client. Blocks on the
+            queue, so events are sent as soon as the driver queues them.
             """
             context = zmq.Context()
             sock = context.socket(zmq.PUB)
@@ -170,19 +195,14 @@ class ZmqDriverProcess(driver_process.DriverProcess):
             zmq_driver_process.stop_evt_thread = False
             while not zmq_driver_process.stop_evt_thread:
                 try:
-                    evt = zmq_driver_process.events.pop(0)
-                    mi_logger.debug('Event thread sending event %s', str(evt))
-                    while evt:
-                        try:
-                            sock.send_pyobj(evt, flags=zmq.NOBLOCK)
-                            evt = None
-                            mi_logger.debug('Event sent!')
-                        except zmq.ZMQError:
-                            time.sleep(.1)
-                            if zmq_driver_process.stop_evt_thread:
-                                break
-                except IndexError:
-                    time.sleep(.1)
+                    evt = zmq_driver_process.events.get(timeout=POLL_TIMEOUT/1000.0)
+                except Queue.Empty:
+                    continue
+                mi_logger.debug('Event thread sending event %s', str(evt))
+                # PUB sockets never block on send, events are dropped at the
+                # high water mark if the client is not keeping up.
+                sock.send_multipart(driver_codec.encode(evt, zmq_driver_process.codec))
+                mi_logger.debug('Event sent!')
 
             sock.close()
             context.term()
@@ -12,6 +12,8 @@ __author__ = 'Edward Hunter'
 __license__ = 'Apache 2.0'
 
 import socket
+import select
+import struct
 import threading
 import time
 import datetime
@@ -35,6 +37,70 @@ l = lp.EthernetDeviceLogger('137.110.112.119', 4001, 8888)
 c = lp.LoggerClient('localhost', 8888, '\r\n')
 """
 
+# Binary log format. The file starts with LOG_MAGIC and is followed by
+# records of a LOG_RECORD header (timestamp, source, length) and the
+# raw bytes relayed.
+LOG_MAGIC = 'IONPAL\x01\n'
+LOG_RECORD = struct.Struct('!dBI')
+LOG_FROM_DRIVER = 1
+LOG_FROM_DEVICE = 2
+
+# Buffered log records are written out once this many bytes are held or
+# LOG_FLUSH_INTERVAL seconds have passed.
+LOG_BUFFER_BYTES = 65536
+LOG_FLUSH_INTERVAL = 1.0
+
+# Bytes read from a socket per recv.
+READ_SIZE = 65536
+
+# Output waiting for a slow peer is held in memory up to this many bytes.
+# Beyond that the relay stops reading the driver until the device drains,
+# and drops the oldest output of a driver that stopped reading (the log
+# still has it).
+MAX_PENDING_BYTES = 1048576
+
+def read_log(fname):
+    """
+    Read a binary port agent log.
+    @param fname The log file name.
+    @retval Generator of (timestamp, source, data) tuples, where source is
+    LOG_FROM_DRIVER or LOG_FROM_DEVICE.
+    @throws ValueError if the file is not a port agent log.
+    """
+    f = file(fname, 'rb')
+    try:
+        if f.read(len(LOG_MAGIC)) != LOG_MAGIC:
+            raise ValueError('%s is not a port agent log.' % fname)
+        while True:
+            header = f.read(LOG_RECORD.size)
+            if len(header) < LOG_RECORD.size:
+                # End of file, or a record cut short by the logger dying.
+                break
+            (timestamp, source, length) = LOG_RECORD.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                break
+            yield (timestamp, source, data)
+    finally:
+        f.close()
+
+def format_log(fname, delim=None):
+    """
+    Render a binary port agent log as text, one record per line, with
+    driver traffic enclosed in delim as the text logs used to be.
+    @param fname The log file name.
+    @param delim 2-element delimiter for driver traffic, ['<<', '>>'] if None.
+    @retval The log text.
+    """
+    delim = delim or ['<<', '>>']
+    lines = []
+    for (timestamp, source, data) in read_log(fname):
+        if source == LOG_FROM_DRIVER:
+            lines.append('%f %s%s%s' % (timestamp, delim[0], repr(data), delim[1]))
+        else:
+            lines.append('%f %s' % (timestamp, repr(data)))
+    return '\n'.join(lines)
+
 class BaseLoggerProcess(DaemonProcess):
     """
     Base class for device loggers. Device loggers are communication
@@ -80,6 +146,11 @@ class BaseLoggerProcess(DaemonProcess):
         self.ppid = ppid
         self.last_parent_check = None
         self.portfname = workdir + portfname
+        self.log_buffer = []
+        self.log_buffer_size = 0
+        self.last_log_flush = None
+        self.driver_out = ''
+        self.device_out = ''
         
     def _init_driver_comms(self):
         """
@@ -145,6 +216,7 @@ class BaseLoggerProcess(DaemonProcess):
             
         if sock:        
             self.driver_sock = sock
+            self.driver_out = ''
             self.driver_sock.setblocking(0)            
             self.driver_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)                            
             self.driver_addr = addr
@@ -222,7 +294,15 @@ class BaseLoggerProcess(DaemonProcess):
         data = None
         if self.driver_sock:
             try:
-                data = self.driver_sock.recv(4096)
+                data = self.driver_sock.recv(READ_SIZE)
+                if not data:
+                    # The driver closed the connection, close socket.
+                    self.statusfile.write('read_driver: driver disconnected.\n')
+                    self.statusfile.flush()
+                    self.driver_sock.close()
+                    self.driver_sock = None
+                    self.driver_addr = None
+                    data = None
 
             except socket.error as e:                
                 # [Errno 35] Resource temporarily unavailable.
@@ -264,57 +344,114 @@ class BaseLoggerProcess(DaemonProcess):
     
     def write_driver(self, data):
         """
-        Write data to driver, retrying until all has been sent. Log errors
-        to status file. Handles resource unavailable, connection reset by peer,
-        broken pipe and unspecified socket errors.
+        Queue data for the driver and send as much of the pending output
+        as the socket accepts without blocking. The run loop sends the rest
+        once the socket is writable (see _write_socks). A driver that falls
+        more than MAX_PENDING_BYTES behind loses the oldest output.
         @param data The data string to write to the driver.
         """
         if self.driver_sock:
-            sent = 0
-            while len(data)>0:
-                try:
-                    sent = self.driver_sock.send(data)
-                    data = data[sent:]
+            self.driver_out += data
+            self._send_driver()
+            if len(self.driver_out) > MAX_PENDING_BYTES:
+                dropped = len(self.driver_out) - MAX_PENDING_BYTES
+                self.driver_out = self.driver_out[dropped:]
+                self.statusfile.write('write_driver: driver not reading, dropped %i bytes.\n' % dropped)
+                self.statusfile.flush()
 
-                except socket.error as e:                
-                    # [Errno 35] Resource temporarily unavailable.
-                    if e.errno == errno.EAGAIN:
-                        # Occurs when the network write buffer is full.
-                        # Sleep a short period of time and retry.
-                        time.sleep(.1)
-                    
-                    # [Errno 54] Connection reset by peer.
-                    elif e.errno == errno.ECONNRESET:
-                        # The client side has disconnected, report and close socket.
-                        self.statusfile.write('read_driver: raised errno %i, %s.\n'
-                                              % (e.errno, str(e)))
-                        self.statusfile.flush()
-                        self.driver_sock.close()
-                        self.driver_sock = None
-                        self.driver_addr = None
-                        break
-                    
-                    # [Errno 32] Broken pipe.
-                    elif e.errno == errno.EPIPE:
-                        # Broken pipe, report and close socket.
-                        self.statusfile.write('read_driver: raised errno %i, %s.\n'
-                                              % (e.errno, str(e)))
-                        self.statusfile.flush()
-                        self.driver_sock.close()
-                        self.driver_sock = None
-                        self.driver_addr = None
-                        break
-                    
-                    # Unspecified socket error, report and close socket.
-                    else:
-                        # TBD. Report and close socket.
-                        self.statusfile.write('read_driver: raised errno %i, %s.\n' % (e.errno, str(e)))
-                        self.statusfile.flush()
-                        self.driver_sock.close()
-                        self.driver_sock = None
-                        self.driver_addr = None
-                        break
+    def _send_driver(self):
+        """
+        Send pending driver output until the socket would block. Log errors
+        to status file. Handles resource unavailable, connection reset by
+        peer, broken pipe and unspecified socket errors.
+        """
+        while self.driver_sock and self.driver_out:
+            try:
+                sent = self.driver_sock.send(self.driver_out)
+                self.driver_out = self.driver_out[sent:]
+
+            except socket.error as e:                
+                # [Errno 35] Resource temporarily unavailable.
+                if e.errno == errno.EAGAIN:
+                    # Occurs when the network write buffer is full.
+                    # Keep the rest until the socket drains.
+                    break
+                
+                # [Errno 54] Connection reset by peer.
+                elif e.errno == errno.ECONNRESET:
+                    # The client side has disconnected, report and close socket.
+                    self.statusfile.write('write_driver: raised errno %i, %s.\n'
+                                          % (e.errno, str(e)))
+                    self.statusfile.flush()
+                    self.driver_sock.close()
+                    self.driver_sock = None
+                    self.driver_addr = None
+                
+                # [Errno 32] Broken pipe.
+                elif e.errno == errno.EPIPE:
+                    # Broken pipe, report and close socket.
+                    self.statusfile.write('write_driver: raised errno %i, %s.\n'
+                                          % (e.errno, str(e)))
+                    self.statusfile.flush()
+                    self.driver_sock.close()
+                    self.driver_sock = None
+                    self.driver_addr = None
+                
+                # Unspecified socket error, report and close socket.
+                else:
+                    # TBD. Report and close socket.
+                    self.statusfile.write('write_driver: raised errno %i, %s.\n' % (e.errno, str(e)))
+                    self.statusfile.flush()
+                    self.driver_sock.close()
+                    self.driver_sock = None
+                    self.driver_addr = None
+
+        if not self.driver_sock:
+            self.driver_out = ''
                     
+    def _device_socks(self):
+        """
+        Sockets (or objects with a fileno) that become readable when device
+        data arrives, waited on by the run loop. Overridden by hardware
+        specific subclasses.
+        @retval List of device sockets.
+        """
+        return []
+
+    def _log_data(self, source, data):
+        """
+        Append a timestamped binary record of relayed data to the log
+        buffer, writing the buffer out once it is large enough.
+        @param source LOG_FROM_DRIVER or LOG_FROM_DEVICE.
+        @param data The data string relayed.
+        """
+        self.log_buffer.append(LOG_RECORD.pack(time.time(), source, len(data)))
+        self.log_buffer.append(data)
+        self.log_buffer_size += LOG_RECORD.size + len(data)
+        if self.log_buffer_size >= LOG_BUFFER_BYTES:
+            self._flush_log()
+
+    def _flush_log(self):
+        """
+        Write buffered log records to the logfile in a single write.
+        """
+        if self.log_buffer and self.logfile:
+            self.logfile.write(''.join(self.log_buffer))
+            self.logfile.flush()
+        self.log_buffer = []
+        self.log_buffer_size = 0
+        self.last_log_flush = time.time()
+
+    def _select_timeout(self):
+        """
+        Time the run loop may wait for traffic before it has to flush the
+        log or check the parent process.
+        @retval Timeout in seconds.
+        """
+        if not self.log_buffer:
+            return LOG_FLUSH_INTERVAL
+        return max(0, self.last_log_flush + LOG_FLUSH_INTERVAL - time.time())
+
     def read_device(self):
         """
         Read from device, if available. Overridden by hardware
@@ -325,10 +462,20 @@ class BaseLoggerProcess(DaemonProcess):
     
     def write_device(self, data):
         """
-        Write to device, retrying until all has been sent. Overridden
-        by hardware specific subclass.
+        Queue data for the device and send as much of the pending output
+        as the device accepts without blocking. The run loop sends the rest
+        once the device is writable (see _write_socks).
         @param data The data string to write to the device.
         """
+        if self._device_connected():
+            self.device_out += data
+            self._send_device()
+
+    def _send_device(self):
+        """
+        Send pending device output until the device would block.
+        Overridden by hardware specific subclass.
+        """
         pass
 
     def _cleanup(self):
@@ -338,6 +485,7 @@ class BaseLoggerProcess(DaemonProcess):
         SIGTERM handler if termination occurs due to signal, or by
         atexit handler if the run loop concludes normally.
         """
+        self._flush_log()
         self._close_device_comms()
         self._close_driver_comms()
         if os.path.exists(self.portfname):
@@ -364,19 +512,12 @@ class BaseLoggerProcess(DaemonProcess):
         return pid            
         
      
-    def _run(self):
+    def _start_relay(self):
         """
-        Logger run loop. Create and initialize status file, initialize
-        device and driver comms and loop while device connected. Loop
-        accepts driver connections, reads driver, writes to device and
-        sniffer, reads device, writes to driver and sniffer and repeats.
-        Logger is stopped by calling DaemonProcess.stop() resulting in
-        SIGTERM signal sent to the logger, or if the device hardware connection
-        is lost, whereby the run loop and logger process will terminate.
+        Create and initialize status file, initialize device and driver
+        comms and write the log header. Cleans up on failure.
+        @retval True on success, False otherwise.
         """
-
-        atexit.register(self._cleanup)
-
         self.statusfile = file(self.statusfname, 'w+')
         self.statusfile.write('_run: logger starting.\n')
         self.statusfile.flush()
@@ -385,32 +526,109 @@ class BaseLoggerProcess(DaemonProcess):
             self.statusfile.write('_run: could not connect to device.\n')
             self.statusfile.flush()
             self._cleanup()
-            return
+            return False
         
         if not self._init_driver_comms():
             self.statusfile.write('_run: could not listen for drivers.\n')
             self.statusfile.flush()
             self._cleanup()
-            return
-        
-        #last_time = time.time()
-        while self._device_connected():
+            return False
+
+        self.logfile.write(LOG_MAGIC)
+        self._flush_log()
+        return True
+
+    def _relay_socks(self):
+        """
+        Sockets the relay waits on for connections and traffic.
+        @retval List of sockets.
+        """
+        socks = [self.driver_server_sock] + self._device_socks()
+        # Stop reading the driver while the device has too much pending.
+        if self.driver_sock and len(self.device_out) < MAX_PENDING_BYTES:
+            socks.append(self.driver_sock)
+        return socks
+
+    def _write_socks(self):
+        """
+        Sockets with output pending, the relay waits on them to drain.
+        @retval List of sockets.
+        """
+        socks = []
+        if self.driver_sock and self.driver_out:
+            socks.append(self.driver_sock)
+        if self.device_out:
+            socks.extend(self._device_socks())
+        return socks
+
+    def _relay(self, readable, writable=()):
+        """
+        Send pending output to the sockets select reported writable,
+        accept driver connections and relay and log traffic for the
+        sockets select reported readable, then flush the log if due and
+        check the parent process.
+        @param readable Readable sockets returned by select.
+        @param writable Writable sockets returned by select.
+        """
+        if self.driver_sock and self.driver_sock in writable:
+            self._send_driver()
+
+        for sock in self._device_socks():
+            if sock in writable:
+                self._send_device()
+
+        if self.driver_server_sock in readable:
             self._accept_driver_comms()
+
+        if self.driver_sock and self.driver_sock in readable:
             driver_data = self.read_driver()
             if driver_data:
                 self.write_device(driver_data)
-                self.logfile.write(self.delim[0]+repr(driver_data)+self.delim[1])
-                self.logfile.write('\n')
-                self.logfile.flush()
-            device_data = self.read_device()
-            if device_data:
-                self.write_driver(device_data)
-                self.logfile.write(repr(device_data))
-                self.logfile.write('\n')
-                self.logfile.flush()
-            self._check_parent()
-            if not driver_data and not device_data:
-                time.sleep(.1)
+                self._log_data(LOG_FROM_DRIVER, driver_data)
+
+        for sock in self._device_socks():
+            if sock in readable:
+                device_data = self.read_device()
+                if device_data:
+                    self.write_driver(device_data)
+                    self._log_data(LOG_FROM_DEVICE, device_data)
+
+        if self.log_buffer and \
+                time.time() - self.last_log_flush >= LOG_FLUSH_INTERVAL:
+            self._flush_log()
+        self._check_parent()
+
+    def _run(self):
+        """
+        Logger run loop. Create and initialize status file, initialize
+        device and driver comms and loop while device connected. Loop
+        waits in select for driver connections, driver data or device data
+        and relays it as soon as it arrives, logging it as buffered binary
+        records (see read_log). Output a peer cannot take yet is held and
+        sent when select reports the peer writable, so a slow peer never
+        stalls the loop. The loop wakes without traffic only to
+        flush the log and check the parent process.
+        Logger is stopped by calling DaemonProcess.stop() resulting in
+        SIGTERM signal sent to the logger, or if the device hardware connection
+        is lost, whereby the run loop and logger process will terminate.
+        """
+
+        atexit.register(self._cleanup)
+
+        if not self._start_relay():
+            return
+
+        while self._device_connected():
+            try:
+                readable, writable, _ = select.select(self._relay_socks(),
+                    self._write_socks(), [], self._select_timeout())
+            except select.error as e:
+                # [Errno 4] Interrupted system call.
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+
+            self._relay(readable, writable)
 
 class EthernetDeviceLogger(BaseLoggerProcess):
     """
@@ -513,7 +731,6 @@ class EthernetDeviceLogger(BaseLoggerProcess):
             #-self.device_sock.shutdown(socket.SHUT_RDWR)
             self.device_sock.close()
             self.device_sock = None
-            time.wait(1)
             self.statusfile.write('_close_device_comms: device connection closed.\n')
             self.statusfile.flush()                            
 
@@ -523,6 +740,15 @@ class EthernetDeviceLogger(BaseLoggerProcess):
         @retval True on success, False otherwise.
         """
         return self.device_sock != None
+
+    def _device_socks(self):
+        """
+        The device socket, if connected.
+        @retval List of device sockets.
+        """
+        if self.device_sock:
+            return [self.device_sock]
+        return []
                             
     def read_device(self):
         """
@@ -535,7 +761,15 @@ class EthernetDeviceLogger(BaseLoggerProcess):
         data = None
         if self.device_sock:
             try:
-                data = self.device_sock.recv(4096)
+                data = self.device_sock.recv(READ_SIZE)
+                if not data:
+                    # The device closed the connection, close socket
+                    # (end logger).
+                    self.statusfile.write('read_device: device disconnected.\n')
+                    self.statusfile.flush()
+                    self.device_sock.close()
+                    self.device_sock = None
+                    data = None
 
             except socket.error as e:                
                 # [Errno 35] Resource temporarily unavailable.
@@ -570,56 +804,276 @@ class EthernetDeviceLogger(BaseLoggerProcess):
             
         return data
     
-    def write_device(self, data):
+    def _send_device(self):
         """
-        Write to an ethernet device, retrying until all sent. Log errors (except
-        resource temporarily unavailable, if they occur.) Handles resource
-        temporarily unavailable, connection reset by peer, broken pipe,
-        and unspecified socket errors.
-        @param data The data string to write to the device.
+        Send pending output to an ethernet device until it would block. Log
+        errors (except resource temporarily unavailable, if they occur.)
+        Handles resource temporarily unavailable, connection reset by peer,
+        broken pipe, and unspecified socket errors.
         """
-        if self.device_sock:
-            sent = 0
-            while len(data)>0:
-                try:
-                    sent = self.device_sock.send(data)
-                    data = data[sent:]                    
+        while self.device_sock and self.device_out:
+            try:
+                sent = self.device_sock.send(self.device_out)
+                self.device_out = self.device_out[sent:]
+            
+            except socket.error as e:                
+                # [Errno 35] Resource temporarily unavailable.
+                if e.errno == errno.EAGAIN:
+                    # Occurs when the network write buffer is full.
+                    # Keep the rest until the socket drains.
+                    break
                 
-                except socket.error as e:                
-                    # [Errno 35] Resource temporarily unavailable.
-                    if e.errno == errno.EAGAIN:
-                        # Occurs when the network write buffer is full.
-                        # Sleep a short period of time and retry.
-                        time.sleep(.1)
-                    
-                    # [Errno 54] Connection reset by peer.
-                    elif e.errno == errno.ECONNRESET:
-                        # TBD. Report and close socket (end logger). 
-                        self.statusfile.write('write_device: raised errno %i, %s.\n' % (e.errno, str(e)))
-                        self.statusfile.flush()
-                        self.device_sock.close()
-                        self.device_sock = None
-                        break
-                    
-                    # [Errno 32] Broken pipe.
-                    elif e.errno == errno.EPIPE:
-                        # TBD. Report and close socket (end logger). 
-                        self.statusfile.write('write_device: raised errno %i, %s.\n' % (e.errno, str(e)))
-                        self.statusfile.flush() 
-                        self.device_sock.close()
-                        self.device_sock = None
-                        break
-                    
-                    # Unspecified socket error, report and close socket.
-                    else:
-                        # TBD. Report and close socket (end logger).
-                        self.statusfile.write('write_device: raised errno %i, %s.\n' % (e.errno, str(e)))
-                        self.statusfile.flush()
-                        self.device_sock.close()
-                        self.device_sock = None
-                        break
+                # [Errno 54] Connection reset by peer.
+                elif e.errno == errno.ECONNRESET:
+                    # TBD. Report and close socket (end logger). 
+                    self.statusfile.write('write_device: raised errno %i, %s.\n' % (e.errno, str(e)))
+                    self.statusfile.flush()
+                    self.device_sock.close()
+                    self.device_sock = None
+                
+                # [Errno 32] Broken pipe.
+                elif e.errno == errno.EPIPE:
+                    # TBD. Report and close socket (end logger). 
+                    self.statusfile.write('write_device: raised errno %i, %s.\n' % (e.errno, str(e)))
+                    self.statusfile.flush() 
+                    self.device_sock.close()
+                    self.device_sock = None
+                
+                # Unspecified socket error, report and close socket.
+                else:
+                    # TBD. Report and close socket (end logger).
+                    self.statusfile.write('write_device: raised errno %i, %s.\n' % (e.errno, str(e)))
+                    self.statusfile.flush()
+                    self.device_sock.close()
+                    self.device_sock = None
+
+        if not self.device_sock:
+            self.device_out = ''
 
                     
+class MultiEthernetDeviceLogger(DaemonProcess):
+    """
+    A single logger process relaying many TCP/IP devices from one select
+    loop. Each device gets its own driver server port, log file and status
+    file, exactly as if it had its own EthernetDeviceLogger, but all
+    devices share one python process. The driver server ports are
+    published together in one ports file once every device is listening.
+    """
+    @classmethod
+    def launch_process(cls, devices, workdir='/tmp/', delim=None, ppid=None):
+        """
+        Class method to be used in place of a constructor to launch a
+        multiplexed logger in a fully seperate python interpreter process.
+        @param devices List of (device_host, device_port) tuples.
+        @param workdir The work directory, by default '/tmp/'.
+        @param delim 2-element delimiter to indicate traffic from the driver
+        in the logfiles. If not given or if None, ['<<', '>>'] is used.
+        @param ppid Parent process ID, used to self destruct when parents
+        die in test cases.
+        @retval A MultiEthernetDeviceLogger object to control the remote
+        process.
+        """
+        delim = delim or ['<<', '>>']
+        devices = [(str(host), int(port)) for (host, port) in devices]
+        start_time = datetime.datetime.now()
+        dt_string = '%i_%i_%i_%i_%i_%i' % \
+                (start_time.year, start_time.month,
+                start_time.day, start_time.hour, start_time.minute,
+                start_time.second)
+        tag = str(uuid.uuid4())
+        cmd_str = 'from %s import %s; l = %s(%s, "%s", "%s", "%s", %s, %s); l.start()' \
+                % (__name__, cls.__name__, cls.__name__, repr(devices), tag,
+                   dt_string, workdir, str(delim), str(ppid))
+        BaseLoggerProcess.launch_logger(cmd_str)
+        return MultiEthernetDeviceLogger(devices, tag, dt_string, workdir,
+                                         delim, ppid)
+
+    def __init__(self, devices, tag, dt_string, workdir, delim, ppid):
+        """
+        Multiplexed ethernet device logger constructor.
+        @param devices List of (device_host, device_port) tuples.
+        @param tag Unique tag the process file names are built from.
+        @param dt_string Start time string the log file names are built from.
+        @param workdir The work directory.
+        @param delim 2-element delimiter to indicate traffic from the driver
+        in the logfiles.
+        @param ppid Parent process ID, used to self destruct when parents
+        die in test cases.
+        """
+        self.dt_string = dt_string
+        self.devices = devices
+        self.tag = tag
+        self.delim = delim
+        self.ppid = ppid
+        self.last_parent_check = None
+        self.portfname = workdir + 'multi_%s.ports.txt' % tag
+        self.channels = []
+        DaemonProcess.__init__(self, 'multi_%s.pid.txt' % tag,
+                               'multi_%s__%s.log.txt' % (tag, self.dt_string),
+                               workdir)
+
+    def _channel(self, device_host, device_port):
+        """
+        Build the relay channel for one device. Channels are
+        EthernetDeviceLoggers that are never started as processes, the
+        multiplexed logger drives their relay from its own loop.
+        @param device_host Internet address of the device.
+        @param device_port Port of the device.
+        @retval EthernetDeviceLogger for the device.
+        """
+        prefix = '%s_%i_%s' % (device_host, device_port, self.tag)
+        channel = EthernetDeviceLogger(device_host, device_port,
+            '%s.pid.txt' % prefix,
+            self._channel_fname(device_host, device_port, 'log'),
+            self._channel_fname(device_host, device_port, 'status'),
+            '%s.port.txt' % prefix,
+            self.workdir, self.delim, None)
+        channel.logfile = file(channel.logfname, 'w+')
+        return channel
+
+    def get_ports(self):
+        """
+        Read the ports file.
+        @retval Dict of (device_host, device_port) : driver server port, or
+        None if the logger is not listening yet.
+        """
+        try:
+            pf = file(self.portfname, 'r')
+            lines = pf.read().splitlines()
+            pf.close()
+
+        except IOError:
+            return None
+
+        ports = {}
+        for line in lines:
+            (host, port, server_port) = line.split()
+            ports[(host, int(port))] = int(server_port)
+        return ports
+
+    def get_port(self, device_host, device_port):
+        """
+        Read the ports file and return the port drivers of a device
+        connect to.
+        @param device_host Internet address of the device.
+        @param device_port Port of the device.
+        @retval The driver server port or None.
+        """
+        ports = self.get_ports() or {}
+        return ports.get((device_host, device_port))
+
+    def _channel_fname(self, device_host, device_port, kind):
+        """
+        @retval Name of a per device file, relative to workdir.
+        """
+        return '%s_%i_%s__%s.%s.txt' % (device_host, device_port, self.tag,
+                                        self.dt_string, kind)
+
+    def get_logfname(self, device_host, device_port):
+        """
+        @retval The binary log file name of a device.
+        """
+        return self.workdir + self._channel_fname(device_host, device_port, 'log')
+
+    def get_statusfname(self, device_host, device_port):
+        """
+        @retval The status file name of a device.
+        """
+        return self.workdir + self._channel_fname(device_host, device_port, 'status')
+
+    def _write_ports(self):
+        """
+        Publish the driver server ports of all listening channels. Written
+        to a temporary file and renamed so readers never see a partial
+        file.
+        """
+        tmpfname = self.portfname + '.tmp'
+        pf = file(tmpfname, 'w+')
+        for channel in self.channels:
+            pf.write('%s %i %i\n' % (channel.device_host,
+                                     channel.device_port, channel.server_port))
+        pf.close()
+        os.rename(tmpfname, self.portfname)
+
+    def _check_parent(self):
+        """
+        Check if the original parent is still alive, and fire the shutdown
+        process if not detected.
+        """
+        if self.ppid:
+            cur_time = time.time()
+            if not self.last_parent_check or (cur_time - self.last_parent_check > 1):
+                self.last_parent_check = cur_time
+                try:
+                    os.kill(self.ppid, 0)
+
+                except OSError:
+                    self.logfile.write('_check_parent: parent process not detected, shutting down.\n')
+                    self.logfile.flush()
+                    self._cleanup()
+
+    def _cleanup(self):
+        """
+        Cleanup all channels, the ports file and call DaemonProcess
+        cleanup.
+        """
+        for channel in self.channels:
+            channel._cleanup()
+        self.channels = []
+        if os.path.exists(self.portfname):
+            os.remove(self.portfname)
+        DaemonProcess._cleanup(self)
+
+    def _run(self):
+        """
+        Multiplexed logger run loop. Start a relay channel for each device,
+        publish their ports and loop while any device is connected,
+        waiting in one select on the sockets of all channels and handing
+        each channel its readable and writable sockets. A channel whose device
+        disconnects is cleaned up and dropped, the others carry on.
+        """
+        atexit.register(self._cleanup)
+
+        for (device_host, device_port) in self.devices:
+            channel = self._channel(device_host, device_port)
+            if channel._start_relay():
+                self.channels.append(channel)
+                self.logfile.write('_run: relaying %s:%i on port %i.\n'
+                    % (device_host, device_port, channel.server_port))
+            else:
+                self.logfile.write('_run: could not start %s:%i, see %s.\n'
+                    % (device_host, device_port, channel.statusfname))
+        self.logfile.flush()
+        self._write_ports()
+
+        while self.channels:
+            socks = []
+            write_socks = []
+            for channel in self.channels:
+                socks.extend(channel._relay_socks())
+                write_socks.extend(channel._write_socks())
+            timeout = min([channel._select_timeout() for channel in self.channels])
+
+            try:
+                readable, writable, _ = select.select(socks, write_socks, [], timeout)
+            except select.error as e:
+                # [Errno 4] Interrupted system call.
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+
+            for channel in list(self.channels):
+                channel._relay(readable, writable)
+                if not channel._device_connected():
+                    self.logfile.write('_run: device %s:%i disconnected.\n'
+                        % (channel.device_host, channel.device_port))
+                    self.logfile.flush()
+                    channel._cleanup()
+                    self.channels.remove(channel)
+                    self._write_ports()
+
+            self._check_parent()
+
 class SerialDeviceLogger(BaseLoggerProcess):
     """
     A device logger process specialized to read/write to serial devices.
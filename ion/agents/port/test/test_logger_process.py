@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+
+"""
+@package ion.agents.port.test.test_logger_process
+@file ion/agents/port/test/test_logger_process.py
+@author Edward Hunter
+@brief Test cases for the port agent logger process.
+"""
+
+__author__ = 'Edward Hunter'
+__license__ = 'Apache 2.0'
+
+# Standard lib imports
+import os
+import socket
+import tempfile
+import threading
+import time
+import uuid
+import logging
+
+# 3rd party imports
+from nose.plugins.attrib import attr
+
+# Pyon and ION imports
+from pyon.util.unit_test import PyonTestCase
+from pyon.public import CFG
+from ion.agents.port.logger_process import EthernetDeviceLogger
+from ion.agents.port.logger_process import MultiEthernetDeviceLogger
+from ion.agents.port.logger_process import read_log, format_log
+from ion.agents.port.logger_process import LOG_FROM_DRIVER, LOG_FROM_DEVICE
+
+# MI logger
+import ion.agents.instrument.mi_logger
+mi_logger = logging.getLogger('mi_logger')
+
+# bin/nosetests -s -v ion/agents/port/test/test_logger_process.py:TestLoggerProcess
+# bin/nosetests -s -v ion/agents/port/test/test_logger_process.py:TestMultiLoggerProcess
+# bin/nosetests -s -v ion/agents/port/test/test_logger_process.py:TestLoggerProcessSimulator
+
+DELIM = ['<<','>>']
+
+
+def recv_until(sock, n, timeout=5):
+    """
+    Receive exactly n bytes from a blocking socket.
+    """
+    sock.settimeout(timeout)
+    data = ''
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+@attr('UNIT', group='mi')
+class TestLoggerProcess(PyonTestCase):
+    """
+    Runs the logger run loop in a thread against a local echo device.
+    """
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp() + '/'
+
+        # Echo device.
+        self.device_server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.device_server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.device_server.bind(('localhost', 0))
+        self.device_server.listen(1)
+        self.device_conn = None
+        self.device_thread = threading.Thread(target=self._echo)
+        self.device_thread.daemon = True
+        self.device_thread.start()
+
+        tag = str(uuid.uuid4())
+        device_port = self.device_server.getsockname()[1]
+        self.logger = EthernetDeviceLogger('localhost', device_port,
+            '%s.pid.txt' % tag, '%s.log.txt' % tag, '%s.status.txt' % tag,
+            '%s.port.txt' % tag, self.workdir, DELIM, None)
+        self.logger.logfile = file(self.logger.logfname, 'w+')
+
+        self.logger_thread = threading.Thread(target=self.logger._run)
+        self.logger_thread.daemon = True
+        self.logger_thread.start()
+
+        port = self.logger.get_port()
+        while not port:
+            time.sleep(.01)
+            port = self.logger.get_port()
+
+        self.driver = socket.create_connection(('localhost', port))
+        self.driver.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def tearDown(self):
+        self.driver.close()
+        self.device_server.close()
+
+    def _echo(self):
+        self.device_conn, _ = self.device_server.accept()
+        while True:
+            data = self.device_conn.recv(65536)
+            if not data:
+                break
+            self.device_conn.sendall(data)
+
+    def _stop(self):
+        # Closing the device ends the run loop.
+        self.device_conn.shutdown(socket.SHUT_RDWR)
+        self.device_conn.close()
+        self.logger_thread.join(5)
+        self.assertFalse(self.logger_thread.is_alive())
+        self.logger._cleanup()
+
+    def test_relay_latency(self):
+        """
+        Round trips through the logger are not held up by an idle sleep.
+        """
+        # Let the loop go idle first.
+        time.sleep(.3)
+        latencies = []
+        for i in range(20):
+            msg = 'ping %i\r\n' % i
+            start = time.time()
+            self.driver.sendall(msg)
+            self.assertEqual(recv_until(self.driver, len(msg)), msg)
+            latencies.append(time.time() - start)
+            time.sleep(.05)
+
+        mi_logger.info('Logger round trip max %f s, mean %f s.',
+                       max(latencies), sum(latencies)/len(latencies))
+        self.assertTrue(max(latencies) < .05)
+        self._stop()
+
+    def test_binary_log(self):
+        """
+        Relayed traffic is logged as timestamped binary records.
+        """
+        msgs = ['abc\r\n', '\x00\x01\xff binary', 'S>']
+        for msg in msgs:
+            self.driver.sendall(msg)
+            self.assertEqual(recv_until(self.driver, len(msg)), msg)
+        self._stop()
+
+        records = list(read_log(self.logger.logfname))
+        driver_data = ''.join([r[2] for r in records if r[1] == LOG_FROM_DRIVER])
+        device_data = ''.join([r[2] for r in records if r[1] == LOG_FROM_DEVICE])
+        self.assertEqual(driver_data, ''.join(msgs))
+        self.assertEqual(device_data, ''.join(msgs))
+
+        timestamps = [r[0] for r in records]
+        self.assertEqual(timestamps, sorted(timestamps))
+
+        text = format_log(self.logger.logfname, DELIM)
+        self.assertIn("<<'abc\\r\\n'>>", text)
+
+    def test_read_log_bad_file(self):
+        """
+        Reading a file that is not a port agent log fails.
+        """
+        fname = self.workdir + 'not_a_log.txt'
+        file(fname, 'w').write('hello\n')
+        with self.assertRaises(ValueError):
+            list(read_log(fname))
+        self._stop()
+
+
+@attr('UNIT', group='mi')
+class TestMultiLoggerProcess(PyonTestCase):
+    """
+    Runs the multiplexed logger run loop in a thread against several local
+    devices that answer in upper case.
+    """
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp() + '/'
+        self.device_conns = {}
+        self.devices = [('localhost', self._start_device()) for i in range(4)]
+
+        self.logger = MultiEthernetDeviceLogger(self.devices, str(uuid.uuid4()),
+            'now', self.workdir, DELIM, None)
+        self.logger.logfile = file(self.logger.logfname, 'w+')
+        self.logger_thread = threading.Thread(target=self.logger._run)
+        self.logger_thread.daemon = True
+        self.logger_thread.start()
+
+        ports = self.logger.get_ports()
+        while not ports:
+            time.sleep(.01)
+            ports = self.logger.get_ports()
+        self.drivers = [socket.create_connection(('localhost', ports[device]))
+                        for device in self.devices]
+
+    def tearDown(self):
+        for driver in self.drivers:
+            driver.close()
+
+    def _start_device(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('localhost', 0))
+        server.listen(1)
+        port = server.getsockname()[1]
+        def upper():
+            conn, _ = server.accept()
+            self.device_conns[port] = conn
+            try:
+                while True:
+                    data = conn.recv(65536)
+                    if not data:
+                        break
+                    conn.sendall(data.upper())
+            except socket.error:
+                pass
+        thread = threading.Thread(target=upper)
+        thread.daemon = True
+        thread.start()
+        return port
+
+    def _close_device(self, device):
+        conn = self.device_conns[device[1]]
+        conn.shutdown(socket.SHUT_RDWR)
+        conn.close()
+
+    def test_relay(self):
+        """
+        Each driver talks to its own device through the one process, and a
+        device going away leaves the others relaying.
+        """
+        for (i, driver) in enumerate(self.drivers):
+            driver.sendall('device %i' % i)
+        for (i, driver) in enumerate(self.drivers):
+            self.assertEqual(recv_until(driver, len('device %i' % i)), 'DEVICE %i' % i)
+
+        self._close_device(self.devices[0])
+        start = time.time()
+        while len(self.logger.get_ports()) > 3 and time.time() - start < 5:
+            time.sleep(.01)
+        self.assertEqual(set(self.logger.get_ports().keys()), set(self.devices[1:]))
+
+        self.drivers[1].sendall('again')
+        self.assertEqual(recv_until(self.drivers[1], 5), 'AGAIN')
+
+        for device in self.devices[1:]:
+            self._close_device(device)
+        self.logger_thread.join(5)
+        self.assertFalse(self.logger_thread.is_alive())
+        self.logger._cleanup()
+
+        # Per device logs and status.
+        for (i, device) in enumerate(self.devices):
+            records = list(read_log(self.logger.get_logfname(*device)))
+            self.assertEqual(records[0][1:], (LOG_FROM_DRIVER, 'device %i' % i))
+            self.assertEqual(records[1][1:], (LOG_FROM_DEVICE, 'DEVICE %i' % i))
+            self.assertTrue(os.path.exists(self.logger.get_statusfname(*device)))
+
+
+    def test_stalled_driver(self):
+        """
+        A driver that stops reading does not hold up the other devices.
+        """
+        # Flood device 0 through a driver that never reads the echo.
+        flood = threading.Thread(target=self.drivers[0].sendall, args=('x' * 8388608,))
+        flood.daemon = True
+        flood.start()
+        time.sleep(.5)
+
+        latencies = []
+        for i in range(10):
+            msg = 'ping %i' % i
+            start = time.time()
+            self.drivers[1].sendall(msg)
+            self.assertEqual(recv_until(self.drivers[1], len(msg)), msg.upper())
+            latencies.append(time.time() - start)
+
+        mi_logger.info('Round trip beside a stalled driver max %f s.', max(latencies))
+        self.assertTrue(max(latencies) < .5)
+
+        for device in self.devices:
+            self._close_device(device)
+        self.logger_thread.join(5)
+        self.assertFalse(self.logger_thread.is_alive())
+        self.logger._cleanup()
+
+
+@attr('INT', group='mi')
+class TestLoggerProcessSimulator(PyonTestCase):
+    """
+    Throughput and latency of a launched port agent against the SBE37
+    simulator.
+    """
+    def setUp(self):
+        self.pagent = EthernetDeviceLogger.launch_process(CFG.device.sbe37.host,
+            CFG.device.sbe37.port, '/tmp/', DELIM, os.getpid())
+        self.addCleanup(self.pagent.stop)
+
+        port = self.pagent.get_port()
+        start = time.time()
+        while not port and time.time() - start < 10:
+            time.sleep(.1)
+            port = self.pagent.get_port()
+        self.assertTrue(port, 'Port agent did not start.')
+        self.driver = socket.create_connection(('localhost', port))
+        self.driver.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.addCleanup(self.driver.close)
+
+    def _prompt(self):
+        """
+        Wake the simulator and wait for its prompt.
+        @retval Round trip time in seconds.
+        """
+        start = time.time()
+        self.driver.sendall('\r\n')
+        self.driver.settimeout(5)
+        data = ''
+        while 'S>' not in data:
+            data += self.driver.recv(4096)
+        return time.time() - start
+
+    def test_latency_throughput(self):
+        self._prompt()
+        latencies = [self._prompt() for i in range(50)]
+        mi_logger.info('Port agent prompt round trip: min %f s, mean %f s, max %f s.',
+                       min(latencies), sum(latencies)/len(latencies), max(latencies))
+
+        # Stream output from the simulator for a few seconds.
+        self.driver.sendall('startnow\r\n')
+        start = time.time()
+        total = 0
+        self.driver.settimeout(1)
+        while time.time() - start < 5:
+            try:
+                total += len(self.driver.recv(65536))
+            except socket.timeout:
+                pass
+        self.driver.sendall('stop\r\n')
+        mi_logger.info('Port agent relayed %i bytes/s from simulator.',
+                       total / (time.time() - start))
+        self.assertTrue(total > 0)
@@ -207,6 +207,13 @@ class BootstrapService(BaseBootstrapService):
         }
         google_dt_proc_def_id, _ = self.clients.resource_registry.create(google_dt_proc_def)
 
+        data_averager_proc_def = IonObject(RT.ProcessDefinition, name='viz_data_averager_transform_process')
+        data_averager_proc_def.executable = {
+            'module': 'ion.processes.data.transforms.viz.data_averager',
+            'class':'VizTransformDataAvg'
+        }
+        data_averager_proc_def_id, _ = self.clients.resource_registry.create(data_averager_proc_def)
+
         return
 
     def post_startup(self):
@@ -22,7 +22,10 @@ from interface.services.coi.iresource_registry_service import ResourceRegistrySe
 from pyon.event.event import EventSubscriber, EventPublisher
 
 from pyon.util.file_sys import FS, FileSystem
+from pyon.public import RT, PRED
+import gevent
 import hashlib
+import time
 
 class IngestionWorkerException(IonException):
     """
@@ -49,6 +52,21 @@ class IngestionWorker(TransformDataProcess):
     def on_init(self):
         self.event_pub = EventPublisher()
 
+        # Batching state, a batch size of 1 ingests each granule as it arrives
+        self.batch_size = 1
+        self.batch_latency = 1.0
+        self._batch = []
+        self._batch_docs = {}
+        self._batch_files = []
+        self._batch_start = None
+        self._batch_timer = None
+
+        # Partitioning state, set from the partition config of a partitioned worker
+        self.worker_name = None
+        self.partition_subscription_id = None
+        self.config_lookup_interval = 10.0
+        self._config_lookups = {}
+
     def on_start(self):
         super(IngestionWorker,self).on_start()
         #----------------------------------------------
@@ -64,6 +82,23 @@ class IngestionWorker(TransformDataProcess):
 
         self.ingest_config_id = self.CFG.get('configuration_id')
 
+        #----------------------------------------------
+        # Batching: granules are held until batch.size granules or batch.latency seconds have accumulated and then
+        # persisted with one bulk document write
+        #----------------------------------------------
+        self.batch_size = max(int(self.CFG.get_safe('batch.size', 1) or 1), 1)
+        self.batch_latency = float(self.CFG.get_safe('batch.latency', 1.0))
+
+        #----------------------------------------------
+        # Partitioning: a partitioned worker only keeps the dataset configs of the streams bound to its subscription.
+        # The management service moves streams between the subscriptions, so ownership is read from the subscription
+        #----------------------------------------------
+        partition = self.CFG.get('partition') or {}
+        self.worker_name = partition.get('worker')
+        self.partition_subscription_id = partition.get('subscription_id')
+        self.config_lookup_interval = float(self.CFG.get_safe('partition.config_lookup_interval', 10.0))
+        self._config_lookups = {} # stream id : time of the last failed dataset config lookup
+
         self.datastore_name = self.couch_config.get('datastore_name',None) or 'dm_datastore'
         try:
             self.datastore_profile = getattr(DataStore.DS_PROFILE, self.couch_config.get('datastore_profile','SCIDATA'))
@@ -91,8 +126,11 @@ class IngestionWorker(TransformDataProcess):
                     del self.dataset_configs[stream_id]
                 except KeyError:
                     log.info('Tried to remove dataset config that does not exist!')
-            else:
+            elif self.owns_stream(stream_id):
                 self.dataset_configs[stream_id] = event_msg
+            else:
+                # The stream may have moved to another worker
+                self.dataset_configs.pop(stream_id, None)
 
             # Hook to override just before processing is complete
             self.dataset_configs_event_test_hook(event_msg, headers)
@@ -108,8 +146,15 @@ class IngestionWorker(TransformDataProcess):
         self.gl = spawn(self.event_subscriber.listen)
         self.event_subscriber._ready_event.wait(timeout=5)
 
+        if self.batching:
+            self._batch_timer = spawn(self._batch_timer_loop)
+
         log.info(str(self.db))
 
+    @property
+    def batching(self):
+        return self.batch_size > 1
+
     def process(self, packet):
         """Process incoming data!!!!
         """
@@ -130,6 +175,9 @@ class IngestionWorker(TransformDataProcess):
 
         ingest_attributes = self.process_stream(packet, dset_config)
 
+        if self.batching:
+            self._add_to_batch(packet, dset_config, ingest_attributes)
+            return
 
         #@todo - get this data from the dataset config...
         if dset_config:
@@ -153,6 +201,11 @@ class IngestionWorker(TransformDataProcess):
         doc = self.db._ion_object_to_persistence_dict(obj)
         sha1 = sha1hex(doc)
 
+        if self.batching:
+            # Duplicates within a batch collapse onto the same id
+            self._batch_docs[sha1] = doc
+            return
+
         try:
             self.db.create_doc(doc, object_id=sha1)
             log.debug('Persisted document %s', type(obj))
@@ -218,16 +271,125 @@ class IngestionWorker(TransformDataProcess):
 
                 #log.warn('writing to filename: %s' % filename)
 
-                with open(filename, mode='wb') as f:
-                    f.write(values_string)
-                    f.close()
+                if self.batching:
+                    self._batch_files.append((filename, values_string))
+                else:
+                    self._write_file(filename, values_string)
             else:
                 log.warn("Nothing to write!")
 
 
         return ingestion_attributes
 
+    @staticmethod
+    def _write_file(filename, values_string):
+        with open(filename, mode='wb') as f:
+            f.write(values_string)
+
+    def _write_files(self, files):
+        """
+        Writes the hdf strings of a flushed batch
+        """
+        for filename, values_string in files:
+            try:
+                self._write_file(filename, values_string)
+            except IOError:
+                log.exception('Failed to write hdf file %s', filename)
+
+    def _add_to_batch(self, packet, dset_config, ingest_attributes):
+        """
+        Holds the processed packet until the batch is full or stale
+        """
+        if not self._batch:
+            self._batch_start = time.time()
+        self._batch.append((packet, dset_config, ingest_attributes))
+
+        if len(self._batch) >= self.batch_size or time.time() - self._batch_start >= self.batch_latency:
+            self.flush_batch()
+
+    def _batch_timer_loop(self):
+        """
+        Flushes batches that sit longer than batch.latency when the stream goes quiet
+        """
+        while True:
+            gevent.sleep(self.batch_latency)
+            if self._batch and time.time() - self._batch_start >= self.batch_latency:
+                self.flush_batch()
+
+    def _persist_docs(self, docs):
+        """
+        Persists the batch's documents with one bulk write, falling back to single writes if the bulk write is refused
+        """
+        docs = docs.values()
+        try:
+            self.db.create_doc_mult(docs, allow_ids=True)
+            log.debug('Persisted %d documents', len(docs))
+        except BadRequest:
+            # Deduplication in action - a document of the batch already exists
+            for doc in docs:
+                try:
+                    self.db.create_doc(doc, object_id=doc['_id'])
+                except BadRequest:
+                    log.debug('Document %s already persisted', doc['_id'])
+
+    def flush_batch(self):
+        """
+        Writes the hdf strings of the held packets, persists their documents with one bulk document write and
+        publishes one aggregated GranuleIngestedEvent per dataset in the batch. The files are written first so a
+        document or event never refers to a file that is not yet on disk
+        """
+        if not self._batch:
+            return
+
+        # Swap out the batch first so packets arriving during the flush start the next batch
+        batch, self._batch = self._batch, []
+        docs, self._batch_docs = self._batch_docs, {}
+        files, self._batch_files = self._batch_files, []
+        self._batch_start = None
+
+        if files:
+            self._write_files(files)
+
+        if docs:
+            for sha1, doc in docs.iteritems():
+                doc['_id'] = sha1
+            self._persist_docs(docs)
+
+        events = {}
+        for packet, dset_config, ingest_attributes in batch:
+            if not dset_config or not ingest_attributes:
+                continue
+            key = (dset_config.dataset_id, dset_config.stream_id)
+            if key not in events:
+                events[key] = {'variables':[], 'number_of_records':0, 'updated_metadata':False, 'updated_data':False, 'number_of_granules':0}
+            attributes = events[key]
+            for variable in ingest_attributes['variables']:
+                if variable not in attributes['variables']:
+                    attributes['variables'].append(variable)
+            attributes['number_of_records'] += max(ingest_attributes['number_of_records'], 0)
+            attributes['updated_metadata'] |= ingest_attributes['updated_metadata']
+            attributes['updated_data'] |= ingest_attributes['updated_data']
+            attributes['number_of_granules'] += 1
+
+        for (dataset_id, stream_id), ingest_attributes in events.iteritems():
+            self.event_pub.publish_event(event_type="GranuleIngestedEvent", sub_type="DatasetIngest",
+                origin=dataset_id, status=200,
+                ingest_attributes=ingest_attributes, stream_id=stream_id)
+
+        headers = ''
+        for packet, dset_config, ingest_attributes in batch:
+            if dset_config:
+                # Hook to override just before processing is complete
+                self.ingest_process_test_hook(packet, headers)
+
+    def _stop_batching(self):
+        if self._batch_timer is not None:
+            self._batch_timer.kill()
+            self._batch_timer = None
+        self.flush_batch()
+
     def on_stop(self):
+        self._stop_batching()
         TransformDataProcess.on_stop(self)
 
         # close event subscriber safely
@@ -238,6 +400,7 @@ class IngestionWorker(TransformDataProcess):
         self.db.close()
 
     def on_quit(self):
+        self._stop_batching()
         TransformDataProcess.on_quit(self)
 
         # close event subscriber safely
@@ -249,6 +412,42 @@ class IngestionWorker(TransformDataProcess):
 
 
 
+    @property
+    def partitioned(self):
+        return self.partition_subscription_id is not None
+
+    def owns_stream(self, stream_id):
+        """
+        True unless this is a partitioned worker and the stream is not bound to its subscription
+        """
+        if not self.partitioned:
+            return True
+        subscription = self.resource_reg_client.read(self.partition_subscription_id)
+        return stream_id in (subscription.query.stream_ids or [])
+
+    def lookup_dataset_config(self, stream_id):
+        """
+        Reads the dataset config of a stream from the resource registry. A partitioned worker only holds the configs of
+        the streams it owned when it started, so streams moved to it by a rebalance are looked up on their first packet.
+        A failed lookup is retried after config_lookup_interval seconds.
+        """
+        last_lookup = self._config_lookups.get(stream_id)
+        if last_lookup is not None and time.time() - last_lookup < self.config_lookup_interval:
+            return None
+
+        dset_configs, _ = self.resource_reg_client.find_resources(restype=RT.DatasetIngestionConfiguration, id_only=False)
+        for dset_config in dset_configs:
+            if dset_config.configuration.stream_id != stream_id:
+                continue
+            ingest_config_ids, _ = self.resource_reg_client.find_objects(dset_config._id, PRED.hasIngestionConfiguration, id_only=True)
+            if self.ingest_config_id in ingest_config_ids:
+                self._config_lookups.pop(stream_id, None)
+                self.dataset_configs[stream_id] = dset_config
+                return dset_config
+
+        self._config_lookups[stream_id] = time.time()
+        return None
+
     def get_dataset_config(self, incoming_packet):
         """
         Gets the dset_config for the data stream
@@ -263,6 +462,9 @@ class IngestionWorker(TransformDataProcess):
 
         dset_config = self.dataset_configs.get(stream_id, None)
 
+        if dset_config is None and self.partitioned:
+            dset_config = self.lookup_dataset_config(stream_id)
+
         configuration = None
         if dset_config is None:
             log.info('No config found for stream id: %s ' % stream_id)
@@ -16,6 +16,7 @@ from pyon.core.exception import IonException, BadRequest, Inconsistent
 from pyon.datastore.datastore import DataStore
 from pyon.public import log
 from pyon.util.file_sys import FS, FileSystem
+from pyon.util.lru_cache import LRUCache
 
 from prototype.hdf.hdf_array_iterator import acquire_data
 from prototype.hdf.hdf_codec import HDFEncoder
@@ -25,7 +26,7 @@ from interface.objects import BlogBase, StreamGranuleContainer, StreamDefinition
 from interface.services.dm.ireplay_process import BaseReplayProcess
 from interface.services.coi.iresource_registry_service import ResourceRegistryServiceProcessClient
 
-
+DEFAULT_ARRAY_CACHE_SIZE = 4
 
 class ReplayProcessException(IonException):
     """
@@ -44,6 +45,8 @@ class ReplayProcess(BaseReplayProcess):
 
         super(ReplayProcess,self).__init__(*args,**kwargs)
         self.lock = RLock()
+        # sha1 -> {var_name: decoded numpy array}, shared by slicing, subsetting and time lookups
+        self.array_cache = LRUCache(DEFAULT_ARRAY_CACHE_SIZE,0,0)
 
     def on_start(self):
 
@@ -75,6 +78,9 @@ class ReplayProcess(BaseReplayProcess):
         self.domain_ids = self.definition.identifiables[self.data_record_id].domain_ids
         self.time_id = self.definition.identifiables[self.domain_ids[0]].temporal_coordinate_vector_id
 
+        cache_size = self.CFG.get_safe('process.array_cache_size', DEFAULT_ARRAY_CACHE_SIZE)
+        self.array_cache = LRUCache(cache_size,0,0)
+
     def execute_replay(self):
         '''
         @brief Spawns a greenlet to take care of the query and work
@@ -121,6 +127,10 @@ class ReplayProcess(BaseReplayProcess):
             log.info('No Results')
             return
 
+        if self.delivery_format.get('streaming', False):
+            self._stream_query(results)
+            return
+
         publish_queue = self._parse_results(results)
         for item in publish_queue:
             log.debug('Item in queue: %s' % type(item))
@@ -134,6 +144,8 @@ class ReplayProcess(BaseReplayProcess):
 
         if self.delivery_format.has_key('time'):
             granule = self.time_subset(granule, self.delivery_format['time'])
+            if not granule:
+                return # nothing within the time bounds
 
         total_records = granule.identifiables[self.element_count_id].value
         granule.identifiables[self.element_count_id].constraint.intervals = [[0, total_records-1],]
@@ -153,6 +165,59 @@ class ReplayProcess(BaseReplayProcess):
         self.output.publish(granule)
         self.lock.release()
 
+    def _stream_query(self, results):
+        '''
+        @brief Publishes the dataset in granules of 'records' records while walking the time-ordered file list
+        @param results The query results from the couch query
+        @description Unlike _publish_query the dataset is never merged into one HDF string, only the granule
+        metadata is merged. Memory is bounded by the chunk size and the first granule is published as soon
+        as the first chunk is read regardless of the length of the dataset.
+        '''
+        publish_queue = self._parse_results(results)
+        template, file_list = self._merge_metadata(publish_queue)
+        if not template:
+            return # no dataset
+
+        if self.delivery_format.has_key('fields'):
+            self._strip_coverages(template, self.delivery_format['fields'])
+
+        records = self.delivery_format.get('records', self.CFG.get_safe('process.stream_records', 1024))
+        assert isinstance(records, int) and records > 0, 'delivery format is incorrectly formatted.'
+
+        time_bounds = self.delivery_format.get('time', None)
+
+        # The template carries the metadata only, each chunk gets its own values
+        template.identifiables[self.data_stream_id].values = ''
+
+        pairs = self._pair_up(template)
+        var_names = list([i[0] for i in pairs])
+        fields = self._list_data(self.definition, template)
+        time_var = self._time_path(template).split('/').pop()
+
+        log.debug('streaming acquire_data:')
+        log.debug('\tfile_list: %s', file_list)
+        log.debug('\tfields: %s', var_names)
+        log.debug('\trecords: %s', records)
+
+        offset = 0
+        for vectors in acquire_data(file_list, var_names, records):
+            if time_bounds is not None:
+                # Only the files overlapping the bounds are read, the edges still need to be cut
+                slice_ = self._time_slice(vectors[time_var]['values'], time_bounds)
+                if not (slice_.stop > slice_.start):
+                    continue
+                arrays = dict((row, value['values']) for row, value in vectors.iteritems())
+                vectors = self._vectors(arrays, var_names, slice_)
+
+            chunk = self._build_granule(template, pairs, fields, vectors)
+            record_count = chunk.identifiables[self.element_count_id].value
+            chunk.identifiables[self.element_count_id].constraint.intervals = [[offset, offset+record_count-1],]
+            offset += record_count
+
+            self.lock.acquire()
+            self.output.publish(chunk)
+            self.lock.release()
+
     def _parse_results(self, results):
         '''
         @brief Switch-case logic for what packet types replay can handle and how to handle
@@ -178,6 +243,9 @@ class ReplayProcess(BaseReplayProcess):
                 continue # Ignore
 
             if isinstance(packet, StreamGranuleContainer):
+                if self.delivery_format.has_key('time') and not self._in_time_bounds(packet, self.delivery_format['time']):
+                    log.debug('Granule is outside of the time bounds.')
+                    continue
                 packet = self._parse_granule(packet)
                 log.debug('Got packet')
                 if packet:
@@ -189,6 +257,19 @@ class ReplayProcess(BaseReplayProcess):
 
         return publish_queue
 
+    @staticmethod
+    def _in_time_bounds(granule, time_bounds):
+        '''
+        @brief Determines from the granule's time_bounds whether it has records within time_bounds
+        @param granule Stream Granule
+        @param time_bounds tuple consisting of a lower and upper bound
+        @return False only if the granule's time_bounds are known and disjoint from time_bounds
+        '''
+        if not granule.identifiables.has_key('time_bounds'):
+            return True # Can't tell without reading the data
+        lower, upper = granule.identifiables['time_bounds'].value_pair[0:2]
+        return not (upper < time_bounds[0] or lower > time_bounds[1])
+
     def _records(self, granule, n):
         '''
         @brief Yields n records from a granule per iteration
@@ -238,16 +319,53 @@ class ReplayProcess(BaseReplayProcess):
         @param slice_ The slice values for which to create the granule
         @return Crafted subset granule of the parameter granule.
         '''
-        retval = copy.deepcopy(granule)
         fields = self._list_data(self.definition,granule)
         record_count = slice_.stop - slice_.start
         assert record_count > 0, 'slice is malformed'
         pairs = self._pair_up(granule)
         var_names = list([i[0] for i in pairs]) # Get the var_names from the pairs
         log.debug('var_names: %s',var_names)
-        file_path = self._get_hdf_from_string(granule.identifiables[self.data_stream_id].values)
+
+        # Slices of the cached arrays are views, the dataset is decoded once no matter how many slices are taken
+        arrays = self._decode(granule, pairs)
+        vectors = self._vectors(arrays, var_names, slice_)
+
+        return self._build_granule(granule, pairs, fields, vectors)
+
+    @staticmethod
+    def _vectors(arrays, var_names, slice_):
+        '''
+        @brief Slices decoded arrays into the acquire_data format
+        @param arrays dict of var_name : numpy array
+        @param var_names var_names to slice
+        @param slice_ The slice to apply to each array
+        @return dict of var_name : {'values','range'}
+        '''
+        import numpy as np
+
+        vectors = {}
+        for var_name in var_names:
+            values = arrays[var_name][slice_]
+            if len(values):
+                range = (np.nanmin(values), np.nanmax(values))
+            else:
+                range = (np.nan, np.nan)
+            vectors[var_name] = {'values':values, 'range':range}
+        return vectors
+
+    def _build_granule(self, granule, pairs, fields, vectors):
+        '''
+        @brief Creates a granule from the granule parameter's metadata and a set of vectors from acquire_data
+        @param granule Granule used as the metadata template, it is not modified
+        @param pairs List of tuples consisting of pair-wise var_name/value_path
+        @param fields dict of field_id : values_path for the granule
+        @param vectors dict of var_name : {'values','range'} as yielded by acquire_data
+        @return Crafted granule containing the vectors
+        '''
+        retval = self._copy_metadata(granule)
         codec = HDFEncoder()
-        vectors = acquire_data([file_path],var_names,record_count,slice_ ).next()
+        record_count = 0
+        arrays = {}
 
         for row, value in vectors.iteritems():
             vp = self._find_vp(pairs, row)
@@ -263,6 +381,7 @@ class ReplayProcess(BaseReplayProcess):
             retval.identifiables[bounds_id].value_pair[0] = float(range[0])
             retval.identifiables[bounds_id].value_pair[1] = float(range[1])
             codec.add_hdf_dataset(vp, value['values'])
+            arrays[row] = value['values']
             record_count = len(value['values'])
             #----- DEBUGGING ---------
             log.debug('slice- row: %s', row)
@@ -276,9 +395,82 @@ class ReplayProcess(BaseReplayProcess):
         retval.identifiables[self.element_count_id].value = record_count
         hdf_string = codec.encoder_close()
         self._patch_granule(retval, hdf_string)
-        FileSystem.unlink(file_path)
+        self._cache_arrays(retval, arrays)
         return retval
 
+    def _copy_metadata(self, granule):
+        '''
+        @brief Deep copies a granule without copying its hdf_string
+        @param granule Stream Granule
+        @return copy of the granule, the caller is expected to patch in new values
+        '''
+        values = granule.identifiables[self.data_stream_id].values
+        granule.identifiables[self.data_stream_id].values = ''
+        try:
+            retval = copy.deepcopy(granule)
+        finally:
+            granule.identifiables[self.data_stream_id].values = values
+        return retval
+
+    def _cache_arrays(self, granule, arrays):
+        '''
+        @brief Stores decoded arrays for the granule's hdf_string in the array cache
+        @param granule Stream Granule whose encoding sha1 identifies the arrays
+        @param arrays dict of var_name : numpy array
+        '''
+        sha1 = granule.identifiables[self.encoding_id].sha1
+        if self.array_cache.has_key(sha1):
+            self.array_cache.get(sha1).update(arrays)
+        else:
+            self.array_cache.put(sha1, dict(arrays))
+
+    def _decode(self, granule, pairs):
+        '''
+        @brief Obtains the arrays for the var_names in pairs from the granule's hdf_string, decoding them at most once
+        @param granule Stream Granule with an hdf_string
+        @param pairs List of tuples consisting of pair-wise var_name/value_path
+        @return dict of var_name : numpy array
+        '''
+        sha1 = granule.identifiables[self.encoding_id].sha1
+        arrays = self.array_cache.get(sha1) if self.array_cache.has_key(sha1) else {}
+        missing = [pair for pair in pairs if pair[0] not in arrays]
+        if missing:
+            hdf_string = granule.identifiables[self.data_stream_id].values
+            assert hdf_string, 'hdf_string is not provided.'
+            record_count = granule.identifiables[self.element_count_id].value
+            arrays = dict(arrays, **self._read_hdf_string(hdf_string, missing, record_count))
+            self.array_cache.put(sha1, arrays)
+        return arrays
+
+    def _read_hdf_string(self, hdf_string, pairs, record_count):
+        '''
+        @brief Reads the datasets out of an hdf_string, in memory when h5py accepts file objects
+        @param hdf_string binary string consisting of an HDF5 file.
+        @param pairs List of tuples consisting of pair-wise var_name/value_path
+        @param record_count Number of records in the hdf_string
+        @return dict of var_name : numpy array
+        '''
+        try:
+            import h5py
+            from io import BytesIO
+            h5 = h5py.File(BytesIO(hdf_string), 'r')
+        except (ImportError, TypeError, ValueError, IOError):
+            # Older h5py can only open files by name, fall back to a single round trip through a temp file
+            h5 = None
+
+        if h5 is not None:
+            try:
+                return dict((var_name, h5[vp][...]) for var_name, vp in pairs)
+            finally:
+                h5.close()
+
+        file_path = self._get_hdf_from_string(hdf_string)
+        try:
+            data = acquire_data([file_path], [i[0] for i in pairs], record_count).next()
+        finally:
+            FileSystem.unlink(file_path)
+        return dict((row, value['values']) for row, value in data.iteritems())
+
 
     def _parse_granule(self, granule):
         '''
@@ -467,15 +659,11 @@ class ReplayProcess(BaseReplayProcess):
 
 
 
-    def _merge(self, msgs):
+    def _merge_metadata(self, msgs):
         '''
-        @brief Merges all the granules and datasets into one large dataset (Union)
+        @brief Merges the metadata of all the granules without reading any of the datasets
         @param msgs raw granules from couch
-        @return complete dataset
-        @description
-             n
-        D := U [ msgs_i ]
-            i=0
+        @return tuple of the merged granule and the time-ordered list of HDF file paths
         '''
         granule = None
         file_list = list()
@@ -518,7 +706,7 @@ class ReplayProcess(BaseReplayProcess):
                     used_vals.append(file_pair[1][0])
 
         if not granule:
-            return
+            return None, []
         log.debug('file_list: %s', file_list)
         #-------------------------------------------------------------------------------------
         # Order the lists using a stable sort from python (by the first value in the tuples
@@ -529,6 +717,22 @@ class ReplayProcess(BaseReplayProcess):
         file_list = list(i[1] for i in file_list)
         file_list = list([FileSystem.get_hierarchical_url(FS.CACHE, '%s' % i) for i in file_list])
 
+        return granule, file_list
+
+    def _merge(self, msgs):
+        '''
+        @brief Merges all the granules and datasets into one large dataset (Union)
+        @param msgs raw granules from couch
+        @return complete dataset
+        @description
+             n
+        D := U [ msgs_i ]
+            i=0
+        '''
+        granule, file_list = self._merge_metadata(msgs)
+        if not granule:
+            return
+
         pairs = self._pair_up(granule)
         var_names = list([i[0] for i in pairs])
 
@@ -540,9 +744,11 @@ class ReplayProcess(BaseReplayProcess):
         log.debug('\trecords: %s', record_count)
 
         data = acquire_data(file_list, var_names, record_count).next()
+        arrays = {}
 
         for row,value in data.iteritems():
             value_path = self._find_vp(pairs,row)
+            arrays[row] = value['values']
             codec.add_hdf_dataset(value_path,nparray=value['values'])
             #-------------------------------------------------------------------------------------
             # Debugging
@@ -553,6 +759,7 @@ class ReplayProcess(BaseReplayProcess):
 
         hdf_string = codec.encoder_close()
         self._patch_granule(granule,hdf_string)
+        self._cache_arrays(granule, arrays)
         return granule
 
     def _patch_granule(self, granule, hdf_string):
@@ -569,16 +776,50 @@ class ReplayProcess(BaseReplayProcess):
         '''
         @brief Obtains a subset of the granule dataset based on the specified time_bounds
         @param granule Dataset
-        @param time_bounds tuple consisting of a lower and upper bound
-        @return A subset of the granule's dataset based on the time boundaries.
+        @param time_bounds tuple consisting of a lower and upper bound (inclusive) in the time coordinate
+        @return A subset of the granule's dataset based on the time boundaries or None if no records are within them.
         '''
         assert isinstance(granule, StreamGranuleContainer), 'object is not a granule.'
-        lower = time_bounds[0]-1
-        upper = time_bounds[1]
-        granule = self._slice(granule, slice(lower,upper))
+        slice_ = self._time_slice(self._time_vector(granule), time_bounds)
+        if not (slice_.stop > slice_.start):
+            return None
+        granule = self._slice(granule, slice_)
         return granule
 
+    @staticmethod
+    def _time_slice(time_vector, time_bounds):
+        '''
+        @brief Determines the slice of a sorted time vector that lies within time_bounds
+        @param time_vector sorted numpy array of times
+        @param time_bounds tuple consisting of a lower and upper bound (inclusive)
+        @return slice such that time_bounds[0] <= time_vector[slice] <= time_bounds[1]
+        '''
+        import numpy as np
+
+        lower = int(np.searchsorted(time_vector, time_bounds[0], side='left'))
+        upper = int(np.searchsorted(time_vector, time_bounds[1], side='right'))
+        return slice(lower, upper)
+
+    def _time_path(self, granule):
+        '''
+        @brief Determines the value path of the temporal coordinate vector (aka time)
+        @param granule Stream Granule
+        @return values_path for time
+        '''
+        time_field = self.definition.identifiables[self.time_id].coordinate_ids[0]
+        if granule.identifiables.has_key(time_field):
+            return granule.identifiables[time_field].values_path or self.definition.identifiables[time_field].values_path
+        return self.definition.identifiables[time_field].values_path
 
+    def _time_vector(self, granule):
+        '''
+        @brief Obtains the time vector of a complete dataset
+        @param granule must be a complete dataset (hdf_string provided)
+        @return numpy array of times
+        '''
+        value_path = self._time_path(granule)
+        var_name = value_path.split('/').pop()
+        return self._decode(granule, [(var_name, value_path)])[var_name]
 
     def _get_time_index(self, granule, timeval):
         '''
@@ -587,47 +828,24 @@ class ReplayProcess(BaseReplayProcess):
         @param timeval the vector value
         @return Index value for timeval or closest approx such that timeval is IN the subset
         '''
+        import numpy as np
+
         assert isinstance(granule, StreamGranuleContainer), 'object is not a granule.'
         assert granule.identifiables[self.data_stream_id].values, 'hdf_string is not provided.'
 
-        hdf_string = granule.identifiables[self.data_stream_id].values
-        file_path = self._get_hdf_from_string(hdf_string)
-
-        #-------------------------------------------------------------------------------------
-        # Determine the field_id for the temporal coordinate vector (aka time)
-        #-------------------------------------------------------------------------------------
-
-        time_field = self.definition.identifiables[self.time_id].coordinate_ids[0]
-        value_path = granule.identifiables[time_field].values_path or self.definition.identifiables[time_field].values_path
-        record_count = granule.identifiables[self.element_count_id].value
+        time_vector = self._time_vector(granule)
+        if not len(time_vector):
+            return 0
 
         #-------------------------------------------------------------------------------------
-        # Go through the time vector and get the indexes that correspond to the timeval
-        # It will find a value such that
-        # t_n <= i < t_(n+1), where i is the index
+        # Binary search the time vector for an index such that
+        # t_i <= timeval < t_(i+1), clamped to the first and last index
         #-------------------------------------------------------------------------------------
 
-
-        var_name = value_path.split('/').pop()
-        res = acquire_data([file_path], [var_name], record_count).next()
-        time_vector = res[var_name]['values']
-        retval = 0
-        for i in xrange(len(time_vector)):
-            if time_vector[i] == timeval:
-                retval = i
-                break
-            elif i==0 and time_vector[i] > timeval:
-                retval = i
-                break
-            elif (i+1) < len(time_vector): # not last val
-                if time_vector[i] < timeval and time_vector[i+1] > timeval:
-                    retval = i
-                    break
-            else: # last val
-                retval = i
-                break
-        FileSystem.unlink(file_path)
-        return retval
+        i = int(np.searchsorted(time_vector, timeval, side='left'))
+        if i < len(time_vector) and time_vector[i] == timeval:
+            return i
+        return min(max(i-1, 0), len(time_vector)-1)
 
     def _get_hdf_from_string(self, hdf_string):
         '''
@@ -642,14 +860,14 @@ class ReplayProcess(BaseReplayProcess):
         return retval
 
 
-    def subset(self,granule,coverages):
+    def _strip_coverages(self, granule, coverages):
         '''
-        @param granule
-        @return dataset subset based on the fields
+        @brief Removes the range sets (and their bounds) which are not in coverages from the granule metadata
+        @param granule Stream Granule, modified in place
+        @param coverages field_ids the client asked for
+        @return tuple of the values paths, domain ids and coverage ids that are kept
         '''
-        assert isinstance(granule, StreamGranuleContainer), 'object is not a granule.'
         field_ids = self.field_ids
-        element_count_id = self.element_count_id
 
 
         values_path = list()
@@ -734,26 +952,34 @@ class ReplayProcess(BaseReplayProcess):
         log.debug('Ranges: %s', coverage_ids)
         log.debug('Values_paths: %s', values_path)
 
-        file_path = self._get_hdf_from_string(granule.identifiables[self.data_stream_id].values)
+        return values_path, domain_ids, coverage_ids
+
+    def subset(self,granule,coverages):
+        '''
+        @param granule
+        @return dataset subset based on the fields
+        '''
+        assert isinstance(granule, StreamGranuleContainer), 'object is not a granule.'
+        element_count_id = self.element_count_id
+
+        values_path, domain_ids, coverage_ids = self._strip_coverages(granule, coverages)
+
         full_coverage = list(domain_ids + coverage_ids)
 
         log.debug('Full coverage: %s' % full_coverage)
-        log.debug('Calling acquire_data with: %s, %s, %s', [file_path],values_path,granule.identifiables[element_count_id].value)
+        log.debug('Subsetting with: %s, %s', values_path,granule.identifiables[element_count_id].value)
 
         codec = HDFEncoder()
 
         pairs = self._pair_up(granule)
-        var_names = list([i[0] for i in pairs])
-
-        record_count = granule.identifiables[self.element_count_id].value
-        data = acquire_data([file_path], var_names, record_count).next()
-        for row,value in data.iteritems():
-            vp = self._find_vp(pairs, row)
-            codec.add_hdf_dataset(vp, value['values'])
+        arrays = self._decode(granule, pairs)
+        kept = {}
+        for row, vp in pairs:
+            codec.add_hdf_dataset(vp, arrays[row])
+            kept[row] = arrays[row]
 
         hdf_string = codec.encoder_close()
         self._patch_granule(granule,hdf_string)
-
-        FileSystem.unlink(file_path)
+        self._cache_arrays(granule, kept)
 
         return granule
\ No newline at end of file
@@ -0,0 +1,123 @@
+'''
+@author MManning
+@file ion/processes/data/transforms/ctd/bulk_granule.py
+@description Builds point supplement granules from whole arrays for the CTD transforms
+'''
+
+import copy
+import hashlib
+
+import numpy as np
+
+from pyon.public import log
+
+from prototype.hdf.hdf_codec import HDFEncoder
+from prototype.sci_data.constructor_apis import DefinitionTree, PointSupplementConstructor
+
+from interface.objects import RangeSet, CoordinateAxis
+
+def _point_by_point(definition, stream_id, time, longitude, latitude, height, coverages):
+    '''
+    @brief Builds the granule with the point supplement constructor, one point at a time
+    '''
+    psc = PointSupplementConstructor(point_definition=definition, stream_id=stream_id)
+    for i in xrange(len(time)):
+        point_id = psc.add_point(time=time[i],location=(longitude[i],latitude[i],height[i]))
+        for coverage_id, values in coverages.iteritems():
+            psc.add_scalar_point_coverage(point_id=point_id, coverage_id=coverage_id, value=values[i])
+    return psc.close_stream_granule()
+
+
+class PointGranuleBuilder(object):
+    '''
+    @brief Builds point supplement granules for one stream definition from whole arrays. The metadata template for
+    each set of coverages is built once and held on the builder, so a transform holding a builder for its outgoing
+    stream definition pays for it once
+    '''
+
+    def __init__(self, definition):
+        self.definition = definition
+        self._templates = {} # sorted coverage ids -> template granule
+
+    def _get_template(self, coverage_ids):
+        '''
+        @brief Builds (once) a one point granule for the definition to use as the metadata template
+        @param coverage_ids coverage ids the granules carry
+        @return template granule
+        '''
+        key = tuple(sorted(coverage_ids))
+        if key not in self._templates:
+            psc = PointSupplementConstructor(point_definition=self.definition)
+            point_id = psc.add_point(time=0.0, location=(0.0,0.0,0.0))
+            for coverage_id in coverage_ids:
+                psc.add_scalar_point_coverage(point_id=point_id, coverage_id=coverage_id, value=0.0)
+            self._templates[key] = psc.close_stream_granule()
+        return self._templates[key]
+
+    def build(self, stream_id, time, longitude, latitude, height, coverages):
+        '''
+        @brief Builds a point supplement granule from whole arrays, setting each coverage in one call
+        @param stream_id Stream id for the granule
+        @param time array of times
+        @param longitude array of longitudes
+        @param latitude array of latitudes
+        @param height array of heights
+        @param coverages dict of coverage_id : array of values
+        @return Stream Granule equivalent to adding each point with PointSupplementConstructor
+        '''
+        definition = self.definition
+        arrays = dict(coverages)
+        arrays.update({
+            'time':time,
+            'longitude':longitude,
+            'latitude':latitude,
+            'height':height,
+        })
+
+        template = self._get_template(coverages.keys())
+        data_stream_id = definition.data_stream_id
+        encoding_id = DefinitionTree.get(definition,'%s.encoding_id' % data_stream_id)
+        element_count_id = DefinitionTree.get(definition,'%s.element_count_id' % data_stream_id)
+
+        # Copy the metadata without the template's values
+        values = template.identifiables[data_stream_id].values
+        template.identifiables[data_stream_id].values = ''
+        try:
+            granule = copy.deepcopy(template)
+        finally:
+            template.identifiables[data_stream_id].values = values
+        granule.stream_resource_id = stream_id
+
+        codec = HDFEncoder()
+        record_count = len(time)
+        for key, value in granule.identifiables.iteritems():
+            if not isinstance(value, (RangeSet, CoordinateAxis)):
+                continue
+            values_path = value.values_path or definition.identifiables[key].values_path
+            name = values_path.split('/').pop()
+            if name not in arrays:
+                log.debug('No array for %s, building the granule point by point', values_path)
+                return _point_by_point(definition, stream_id, time, longitude, latitude, height, coverages)
+
+            array = np.asanyarray(arrays[name])
+            codec.add_hdf_dataset(values_path, array)
+            if value.bounds_id and granule.identifiables.has_key(value.bounds_id):
+                granule.identifiables[value.bounds_id].value_pair = [float(np.nanmin(array)), float(np.nanmax(array))]
+
+        if granule.identifiables.has_key('time_bounds'):
+            time_array = np.asanyarray(time)
+            granule.identifiables['time_bounds'].value_pair = [float(np.nanmin(time_array)), float(np.nanmax(time_array))]
+
+        granule.identifiables[element_count_id].value = record_count
+        hdf_string = codec.encoder_close()
+        granule.identifiables[data_stream_id].values = hdf_string
+        granule.identifiables[encoding_id].sha1 = hashlib.sha1(hdf_string).hexdigest().upper()
+        return granule
+
+
+def build_point_granule(definition, stream_id, time, longitude, latitude, height, coverages):
+    '''
+    @brief Builds a point supplement granule from whole arrays without holding the template, see PointGranuleBuilder
+    @param definition Stream Definition of the outgoing stream
+    '''
+    return PointGranuleBuilder(definition).build(stream_id, time, longitude, latitude, height, coverages)
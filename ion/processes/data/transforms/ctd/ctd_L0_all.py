@@ -12,7 +12,7 @@ from pyon.public import IonObject, RT, log
 from prototype.sci_data.stream_defs import SBE37_CDM_stream_definition, L0_pressure_stream_definition, L0_temperature_stream_definition, L0_conductivity_stream_definition
 
 from prototype.sci_data.stream_parser import PointSupplementStreamParser
-from prototype.sci_data.constructor_apis import PointSupplementConstructor
+from ion.processes.data.transforms.ctd.bulk_granule import PointGranuleBuilder
 from prototype.sci_data.stream_defs import ctd_stream_definition
 
 
@@ -28,6 +28,11 @@ class ctd_L0_all(TransformDataProcess):
     outgoing_stream_temperature = L0_temperature_stream_definition()
     outgoing_stream_conductivity = L0_conductivity_stream_definition()
 
+    # The granule builders hold the metadata templates of the outgoing streams
+    pressure_granule_builder = PointGranuleBuilder(outgoing_stream_pressure)
+    temperature_granule_builder = PointGranuleBuilder(outgoing_stream_temperature)
+    conductivity_granule_builder = PointGranuleBuilder(outgoing_stream_conductivity)
+
 
 
     # Retrieve the id of the OUTPUT stream from the out Data Product for each of the three output streams
@@ -59,9 +64,9 @@ class ctd_L0_all(TransformDataProcess):
         height = psd.get_values('height')
         time = psd.get_values('time')
 
-        log.warn('Got conductivity: %s' % str(conductivity))
-        log.warn('Got pressure: %s' % str(pressure))
-        log.warn('Got temperature: %s' % str(temperature))
+        log.debug('Got conductivity: %s', conductivity)
+        log.debug('Got pressure: %s', pressure)
+        log.debug('Got temperature: %s', temperature)
 
     
 
@@ -70,29 +75,18 @@ class ctd_L0_all(TransformDataProcess):
 
         # Use the constructor to put data into a granule
 
-        psc_conductivity = PointSupplementConstructor(point_definition=self.outgoing_stream_conductivity, stream_id=self.streams['conductivity'])
-
-        psc_pressure = PointSupplementConstructor(point_definition=self.outgoing_stream_pressure, stream_id=self.streams['pressure'])
-
-        psc_temperature = PointSupplementConstructor(point_definition=self.outgoing_stream_temperature, stream_id=self.streams['temperature'])
-
         ### The stream id is part of the metadata which much go in each stream granule - this is awkward to do at the
         ### application level like this!
+        ### Each coverage is encoded as a whole array, not point by point
 
-        for i in xrange(len(conductivity)):
-            point_id = psc_conductivity.add_point(time=time[i],location=(longitude[i],latitude[i],height[i]))
-            psc_conductivity.add_scalar_point_coverage(point_id=point_id, coverage_id='conductivity', value=conductivity[i])
-        self.conductivity.publish(psc_conductivity.close_stream_granule())
+        self.conductivity.publish(self.conductivity_granule_builder.build(self.streams['conductivity'],
+            time, longitude, latitude, height, {'conductivity':conductivity}))
 
-        for i in xrange(len(pressure)):
-            point_id = psc_pressure.add_point(time=time[i],location=(longitude[i],latitude[i],height[i]))
-            psc_pressure.add_scalar_point_coverage(point_id=point_id, coverage_id='pressure', value=pressure[i])
-        self.pressure.publish(psc_pressure.close_stream_granule())
+        self.pressure.publish(self.pressure_granule_builder.build(self.streams['pressure'],
+            time, longitude, latitude, height, {'pressure':pressure}))
 
-        for i in xrange(len(temperature)):
-            point_id = psc_temperature.add_point(time=time[i],location=(longitude[i],latitude[i],height[i]))
-            psc_temperature.add_scalar_point_coverage(point_id=point_id, coverage_id='temperature', value=temperature[i])
-        self.temperature.publish(psc_temperature.close_stream_granule())
+        self.temperature.publish(self.temperature_granule_builder.build(self.streams['temperature'],
+            time, longitude, latitude, height, {'temperature':temperature}))
 
         return
 
@@ -12,7 +12,7 @@ from pyon.public import IonObject, RT, log
 from prototype.sci_data.stream_defs import L1_conductivity_stream_definition, L0_conductivity_stream_definition
 
 from prototype.sci_data.stream_parser import PointSupplementStreamParser
-from prototype.sci_data.constructor_apis import PointSupplementConstructor
+from ion.processes.data.transforms.ctd.bulk_granule import PointGranuleBuilder
 
 
 class CTDL1ConductivityTransform(TransformFunction):
@@ -27,6 +27,7 @@ class CTDL1ConductivityTransform(TransformFunction):
     # Make the stream definitions of the transform class attributes... best available option I can think of?
     incoming_stream_def = L0_conductivity_stream_definition()
     outgoing_stream_def = L1_conductivity_stream_definition()
+    outgoing_granule_builder = PointGranuleBuilder(outgoing_stream_def)
 
 
 
@@ -44,7 +45,7 @@ class CTDL1ConductivityTransform(TransformFunction):
         height = psd.get_values('height')
         time = psd.get_values('time')
 
-        log.warn('Got conductivity: %s' % str(conductivity))
+        log.debug('Got conductivity: %s', conductivity)
 
 
         # The L1 conductivity data product algorithm takes the L0 conductivity data product and converts it
@@ -53,16 +54,13 @@ class CTDL1ConductivityTransform(TransformFunction):
         #    1) Standard conversion from 5-character hex string to decimal
         #    2)Scaling
         # Use the constructor to put data into a granule
-        psc = PointSupplementConstructor(point_definition=self.outgoing_stream_def, stream_id=self.streams['output'])
         ### Assumes the config argument for output streams is known and there is only one 'output'.
         ### the stream id is part of the metadata which much go in each stream granule - this is awkward to do at the
         ### application level like this!
 
-        for i in xrange(len(conductivity)):
-            scaled_conductivity =  ( conductivity[i] / 100000.0 ) - 0.5
-            point_id = psc.add_point(time=time[i],location=(longitude[i],latitude[i],height[i]))
-            psc.add_scalar_point_coverage(point_id=point_id, coverage_id='conductivity', value=scaled_conductivity)
+        scaled_conductivity = ( conductivity / 100000.0 ) - 0.5
 
-        return psc.close_stream_granule()
+        return self.outgoing_granule_builder.build(self.streams['output'],
+            time, longitude, latitude, height, {'conductivity':scaled_conductivity})
 
   
\ No newline at end of file
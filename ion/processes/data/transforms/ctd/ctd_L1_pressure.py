@@ -13,7 +13,7 @@ from pyon.public import IonObject, RT, log
 from prototype.sci_data.stream_defs import L1_pressure_stream_definition, L0_pressure_stream_definition
 
 from prototype.sci_data.stream_parser import PointSupplementStreamParser
-from prototype.sci_data.constructor_apis import PointSupplementConstructor
+from ion.processes.data.transforms.ctd.bulk_granule import PointGranuleBuilder
 
 class CTDL1PressureTransform(TransformFunction):
     ''' A basic transform that receives input through a subscription,
@@ -27,6 +27,7 @@ class CTDL1PressureTransform(TransformFunction):
     # Make the stream definitions of the transform class attributes... best available option I can think of?
     incoming_stream_def = L0_pressure_stream_definition()
     outgoing_stream_def = L1_pressure_stream_definition()
+    outgoing_granule_builder = PointGranuleBuilder(outgoing_stream_def)
 
 
 
@@ -45,7 +46,7 @@ class CTDL1PressureTransform(TransformFunction):
         height = psd.get_values('height')
         time = psd.get_values('time')
 
-        log.warn('Got pressure: %s' % str(pressure))
+        log.debug('Got pressure: %s', pressure)
 
 
         # L1
@@ -59,17 +60,14 @@ class CTDL1PressureTransform(TransformFunction):
 
 
         # Use the constructor to put data into a granule
-        psc = PointSupplementConstructor(point_definition=self.outgoing_stream_def, stream_id=self.streams['output'])
         ### Assumes the config argument for output streams is known and there is only one 'output'.
         ### the stream id is part of the metadata which much go in each stream granule - this is awkward to do at the
         ### application level like this!
 
-        for i in xrange(len(pressure)):
-            #todo: get pressure range from metadata (if present) and include in calc
-            scaled_pressure = ( pressure[i])
-            point_id = psc.add_point(time=time[i],location=(longitude[i],latitude[i],height[i]))
-            psc.add_scalar_point_coverage(point_id=point_id, coverage_id='pressure', value=scaled_pressure)
+        #todo: get pressure range from metadata (if present) and include in calc
+        scaled_pressure = pressure
 
-        return psc.close_stream_granule()
+        return self.outgoing_granule_builder.build(self.streams['output'],
+            time, longitude, latitude, height, {'pressure':scaled_pressure})
 
   
\ No newline at end of file
@@ -15,7 +15,7 @@ from decimal import *
 from prototype.sci_data.stream_defs import L1_temperature_stream_definition, L0_temperature_stream_definition
 
 from prototype.sci_data.stream_parser import PointSupplementStreamParser
-from prototype.sci_data.constructor_apis import PointSupplementConstructor
+from ion.processes.data.transforms.ctd.bulk_granule import PointGranuleBuilder
 
 from seawater.gibbs import SP_from_cndr
 from seawater.gibbs import cte
@@ -32,6 +32,7 @@ class CTDL1TemperatureTransform(TransformFunction):
     # Make the stream definitions of the transform class attributes... best available option I can think of?
     incoming_stream_def = L0_temperature_stream_definition()
     outgoing_stream_def = L1_temperature_stream_definition()
+    outgoing_granule_builder = PointGranuleBuilder(outgoing_stream_def)
 
 
     def execute(self, granule):
@@ -49,7 +50,7 @@ class CTDL1TemperatureTransform(TransformFunction):
         height = psd.get_values('height')
         time = psd.get_values('time')
 
-        log.warn('Got temperature: %s' % str(temperature))
+        log.debug('Got temperature: %s', temperature)
 
 
         # The L1 temperature data product algorithm takes the L0 temperature data product and converts it into Celcius.
@@ -61,15 +62,12 @@ class CTDL1TemperatureTransform(TransformFunction):
         #    2) Scaling: T [C] = (tdec / 10,000) - 10
 
         # Use the constructor to put data into a granule
-        psc = PointSupplementConstructor(point_definition=self.outgoing_stream_def, stream_id=self.streams['output'])
         ### Assumes the config argument for output streams is known and there is only one 'output'.
         ### the stream id is part of the metadata which much go in each stream granule - this is awkward to do at the
         ### application level like this!
 
-        for i in xrange(len(temperature)):
-            scaled_temperature = ( temperature[i] / 10000.0) - 10
-            point_id = psc.add_point(time=time[i],location=(longitude[i],latitude[i],height[i]))
-            psc.add_scalar_point_coverage(point_id=point_id, coverage_id='temperature', value=scaled_temperature)
+        scaled_temperature = ( temperature / 10000.0) - 10
 
-        return psc.close_stream_granule()
+        return self.outgoing_granule_builder.build(self.streams['output'],
+            time, longitude, latitude, height, {'temperature':scaled_temperature})
   
\ No newline at end of file
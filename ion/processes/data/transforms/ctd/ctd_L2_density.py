@@ -14,7 +14,7 @@ from pyon.public import IonObject, RT, log
 from prototype.sci_data.stream_defs import SBE37_CDM_stream_definition, L2_density_stream_definition
 
 from prototype.sci_data.stream_parser import PointSupplementStreamParser
-from prototype.sci_data.constructor_apis import PointSupplementConstructor
+from ion.processes.data.transforms.ctd.bulk_granule import PointGranuleBuilder
 
 from seawater.gibbs import SP_from_cndr, rho, SA_from_SP
 from seawater.gibbs import cte
@@ -31,6 +31,7 @@ class DensityTransform(TransformFunction):
     # Make the stream definitions of the transform class attributes... best available option I can think of?
     incoming_stream_def = SBE37_CDM_stream_definition()
     outgoing_stream_def = L2_density_stream_definition()
+    outgoing_granule_builder = PointGranuleBuilder(outgoing_stream_def)
 
 
 
@@ -53,9 +54,9 @@ class DensityTransform(TransformFunction):
 
 
 
-        log.warn('Got conductivity: %s' % str(conductivity))
-        log.warn('Got pressure: %s' % str(pressure))
-        log.warn('Got temperature: %s' % str(temperature))
+        log.debug('Got conductivity: %s', conductivity)
+        log.debug('Got pressure: %s', pressure)
+        log.debug('Got temperature: %s', temperature)
 
 
         sp = SP_from_cndr(r=conductivity/cte.C3515, t=temperature, p=pressure)
@@ -64,18 +65,14 @@ class DensityTransform(TransformFunction):
 
         density = rho(sa, temperature, pressure)
 
-        log.warn('Got density: %s' % str(density))
+        log.debug('Got density: %s', density)
 
         # Use the constructor to put data into a granule
-        psc = PointSupplementConstructor(point_definition=self.outgoing_stream_def, stream_id=self.streams['output'])
         ### Assumes the config argument for output streams is known and there is only one 'output'.
         ### the stream id is part of the metadata which much go in each stream granule - this is awkward to do at the
         ### application level like this!
 
-        for i in xrange(len(density)):
-            point_id = psc.add_point(time=time[i],location=(longitude[i],latitude[i],height[i]))
-            psc.add_scalar_point_coverage(point_id=point_id, coverage_id='density', value=density[i])
-
-        return psc.close_stream_granule()
+        return self.outgoing_granule_builder.build(self.streams['output'],
+            time, longitude, latitude, height, {'density':density})
 
   
\ No newline at end of file
@@ -10,7 +10,7 @@ from pyon.core.exception import BadRequest
 from pyon.public import IonObject, RT, log
 
 from prototype.sci_data.stream_parser import PointSupplementStreamParser
-from prototype.sci_data.constructor_apis import PointSupplementConstructor
+from ion.processes.data.transforms.ctd.bulk_granule import PointGranuleBuilder
 
 from prototype.sci_data.stream_defs import SBE37_CDM_stream_definition, L2_density_stream_definition, L2_practical_salinity_stream_definition
 
@@ -25,6 +25,7 @@ class SalinityTransform(TransformFunction):
     '''
 
     outgoing_stream_def = L2_practical_salinity_stream_definition()
+    outgoing_granule_builder = PointGranuleBuilder(outgoing_stream_def)
 
     incoming_stream_def = SBE37_CDM_stream_definition()
 
@@ -50,23 +51,19 @@ class SalinityTransform(TransformFunction):
 
 
 
-        log.warn('Got conductivity: %s' % str(conductivity))
-        log.warn('Got pressure: %s' % str(pressure))
-        log.warn('Got temperature: %s' % str(temperature))
+        log.debug('Got conductivity: %s', conductivity)
+        log.debug('Got pressure: %s', pressure)
+        log.debug('Got temperature: %s', temperature)
 
 
         salinity = SP_from_cndr(r=conductivity/cte.C3515, t=temperature, p=pressure)
 
-        log.warn('Got salinity: %s' % str(salinity))
+        log.debug('Got salinity: %s', salinity)
 
 
         # Use the constructor to put data into a granule
-        psc = PointSupplementConstructor(point_definition=self.outgoing_stream_def, stream_id=self.streams['output'])
 
-        for i in xrange(len(salinity)):
-            point_id = psc.add_point(time=time[i],location=(longitude[i],latitude[i],height[i]))
-            psc.add_scalar_point_coverage(point_id=point_id, coverage_id='salinity', value=salinity[i])
-
-        return psc.close_stream_granule()
+        return self.outgoing_granule_builder.build(self.streams['output'],
+            time, longitude, latitude, height, {'salinity':salinity})
 
 
@@ -7,6 +7,9 @@
 
 from mock import Mock, sentinel, patch
 from collections import defaultdict
+import time
+
+import numpy
 
 from pyon.public import log
 from pyon.util.containers import DotDict
@@ -22,6 +25,10 @@ from ion.processes.data.transforms.ctd.ctd_L1_pressure import CTDL1PressureTrans
 from ion.processes.data.transforms.ctd.ctd_L1_temperature import CTDL1TemperatureTransform
 from ion.processes.data.transforms.ctd.ctd_L2_salinity import SalinityTransform
 from ion.processes.data.transforms.ctd.ctd_L2_density import DensityTransform
+from ion.processes.data.transforms.ctd.bulk_granule import build_point_granule, _point_by_point
+
+from prototype.sci_data.stream_parser import PointSupplementStreamParser
+from prototype.sci_data.stream_defs import L1_conductivity_stream_definition
 
 
 @attr('UNIT', group='ctd')
@@ -88,3 +95,47 @@ class TestScienceObjectCodec(IonUnitTestCase):
 
         L2_dens = self.tx_L2_D.execute(packet)
         log.info("L2 dens: %s" % L2_dens)
+
+    def test_bulk_granule(self):
+        definition = L1_conductivity_stream_definition()
+        length = 50
+        time_ = numpy.arange(length, dtype='float64')
+        lon = numpy.random.uniform(-180, 180, length)
+        lat = numpy.random.uniform(-90, 90, length)
+        height = numpy.zeros(length)
+        cond = numpy.random.uniform(0, 5, length)
+
+        bulk = build_point_granule(definition, 'STR_ID', time_, lon, lat, height, {'conductivity':cond})
+        points = _point_by_point(definition, 'STR_ID', time_, lon, lat, height, {'conductivity':cond})
+
+        self.assertEquals(bulk.stream_resource_id, 'STR_ID')
+        for granule in (bulk, points):
+            psd = PointSupplementStreamParser(stream_definition=definition, stream_granule=granule)
+            numpy.testing.assert_array_almost_equal(psd.get_values('conductivity'), cond)
+            numpy.testing.assert_array_almost_equal(psd.get_values('time'), time_)
+            numpy.testing.assert_array_almost_equal(psd.get_values('latitude'), lat)
+
+        if bulk.identifiables.has_key('time_bounds'):
+            self.assertEquals(bulk.identifiables['time_bounds'].value_pair, [0.0, float(length - 1)])
+
+    def test_transform_throughput(self):
+        length = 1000
+
+        packet = self.px_ctd._get_ctd_packet("STR_ID", length)
+
+        def timed(name, fn, *args):
+            start = time.time()
+            result = fn(*args)
+            elapsed = time.time() - start
+            log.info('%s: %d records in %.3f s (%.0f records/s)', name, length, elapsed, length / max(elapsed, 1e-6))
+            return result
+
+        timed('ctd_L0_all', self.tx_L0.process, packet)
+        timed('CTDL1ConductivityTransform', self.tx_L1_C.execute, self.tx_L0.conductivity.publish.call_args[0][0])
+        timed('CTDL1TemperatureTransform', self.tx_L1_T.execute, self.tx_L0.temperature.publish.call_args[0][0])
+        timed('CTDL1PressureTransform', self.tx_L1_P.execute, self.tx_L0.pressure.publish.call_args[0][0])
+        timed('SalinityTransform', self.tx_L2_S.execute, packet)
+        dens = timed('DensityTransform', self.tx_L2_D.execute, packet)
+
+        psd = PointSupplementStreamParser(stream_definition=self.tx_L2_D.outgoing_stream_def, stream_granule=dens)
+        self.assertEquals(len(psd.get_values('time')), length)
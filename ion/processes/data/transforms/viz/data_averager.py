@@ -5,55 +5,383 @@
 @description transforms for averaging data to create a multi-resolution tree
 '''
 
-from pyon.ion.transform import TransformFunction
-from pyon.service.service import BaseService
-from pyon.core.exception import BadRequest
-from pyon.public import IonObject, RT, log
+from bisect import bisect_right
 
-from prototype.sci_data.stream_defs import SBE37_CDM_stream_definition, SBE37_RAW_stream_definition
+from pyon.ion.transform import TransformDataProcess
+from pyon.core.exception import NotFound
+from pyon.datastore.datastore import DataStore
+from pyon.public import log
+
+import numpy
+from interface.services.coi.iresource_registry_service import ResourceRegistryServiceProcessClient
+from prototype.sci_data.stream_parser import PointSupplementStreamParser
+
+MR_TREE_DATASTORE_NAME = 'mr_tree_datastore'
 
 mr_tree_order = 4   # A quad tree maps well to the notion of time .. secs, mins, hour, days etc
+mr_tree_max_levels = 12 # Each node of the top level summarises mr_tree_order ** 11 (~4 million) records
+mr_tree_chunk_size = 256 # The nodes of a level are persisted in documents of this many nodes
 var_to_skip = ['latitude', 'lat', 'longitude', 'lon', 'depth'] # The variables in this list are not supposed to be averaged
 
-class VizTransformDataAvg(TransformFunction):
+# The statistics kept for each variable in each node of the tree. The mean is sum / count.
+node_stats = ('min', 'max', 'sum', 'count')
+
 
+def aggregate_nodes(nodes, order):
+    """
+    Combine blocks of order consecutive nodes into parent nodes.
+
+    @param nodes dict of stat name : array of the nodes of one variable
+    @param order number of child nodes per parent
+    @retval (parents, remainder) the parent nodes of the complete blocks and the nodes left over
+    """
+    full = len(nodes['count']) - len(nodes['count']) % order
+
+    parents = {
+        'min': nodes['min'][:full].reshape(-1, order).min(axis=1),
+        'max': nodes['max'][:full].reshape(-1, order).max(axis=1),
+        'sum': nodes['sum'][:full].reshape(-1, order).sum(axis=1),
+        'count': nodes['count'][:full].reshape(-1, order).sum(axis=1),
+    }
+    remainder = dict((stat, nodes[stat][full:]) for stat in node_stats)
+
+    return parents, remainder
+
+
+def concatenate_nodes(*node_sets):
+    """
+    @param node_sets dicts of variable name : stat : array of nodes, the same variables in each
+    @retval dict of variable name : stat : array of the nodes of all the sets, in order
     """
-    This class is used for data coming on the incoming streams.
+    return dict((var_name, dict((stat, numpy.concatenate([nodes[var_name][stat] for nodes in node_sets]))
+                                for stat in node_stats)) for var_name in node_sets[0])
+
+
+def slice_nodes(nodes, start, end=None):
+    return dict((var_name, dict((stat, var_nodes[stat][start:end]) for stat in node_stats))
+                for var_name, var_nodes in nodes.iteritems())
+
+
+def nodes_to_doc(nodes):
+    return dict((var_name, dict((stat, var_nodes[stat].tolist()) for stat in node_stats))
+                for var_name, var_nodes in nodes.iteritems())
+
+
+def doc_to_nodes(doc):
+    return dict((var_name, dict((stat, numpy.asarray(doc[var_name][stat], dtype='float64')) for stat in node_stats))
+                for var_name in doc if not var_name.startswith('_'))
+
+
+class MultiResolutionTree(object):
+    """
+    Min/max/mean pyramid of the values of a set of variables, built incrementally as records arrive and persisted
+    in a datastore. Each node of level 1 summarises order consecutive records with the min, max, sum and count of
+    each variable, and each node of level n + 1 summarises order consecutive nodes of level n. The records
+    themselves are the dataset and are not kept.
+
+    The nodes of each level are written in documents of chunk_size nodes. Only the last, open, chunk of each level
+    and the few nodes waiting for a parent are held in memory, so the memory used does not grow with the records.
+    A header document holds the start time of each chunk and the nodes waiting for a parent, from which the tree
+    is restored after a restart.
 
+    A time range can then be read at the finest level with no more than a given number of nodes in it, so the
+    points read for a plot depend on its width rather than the records in the range. Records are expected in
+    time order.
     """
 
-    outgoing_stream_def = incoming_stream_def = SBE37_CDM_stream_definition()
+    def __init__(self, db, tree_id, order=mr_tree_order, max_levels=mr_tree_max_levels,
+                 chunk_size=mr_tree_chunk_size, time_var='time'):
+        self.db = db
+        self.tree_id = tree_id
+        self.order = order
+        self.max_levels = max_levels
+        self.chunk_size = chunk_size
+        self.time_var = time_var
+
+        # Per level, the start time of each chunk of nodes. Level 0, the records, has no chunks
+        self.chunk_times = [[]]
+
+        # Per level above 0, the nodes of the open chunk
+        self.open_chunks = [None]
+
+        # Per level, the nodes which do not have a parent yet. Level 0 holds the records
+        self.pending = []
+
+        # The revisions of the documents which are still updated, the header and the open chunks
+        self.revs = {}
+
+    @property
+    def levels(self):
+        """
+        The number of levels of the tree, including the records
+        """
+        return len(self.chunk_times)
+
+    def load(self):
+        """
+        Restore the tree from its documents.
+
+        @retval False if the tree has not been persisted yet
+        """
+        try:
+            header = self.db.read_doc(self._header_id())
+        except NotFound:
+            return False
+
+        self.order = header['order']
+        self.chunk_size = header['chunk_size']
+        self.chunk_times = header['chunk_times']
+        self.pending = [doc_to_nodes(pending) for pending in header['pending']]
+        self.revs = {self._header_id(): header['_rev']}
+
+        self.open_chunks = [None]
+        for level in xrange(1, self.levels):
+            chunk_id = self._chunk_id(level, len(self.chunk_times[level]) - 1)
+            doc = self.db.read_doc(chunk_id)
+            self.open_chunks.append(doc_to_nodes(doc))
+            self.revs[chunk_id] = doc['_rev']
+
+        return True
+
+    def add(self, vardict):
+        """
+        Add records to the tree and write the chunks they change.
+
+        @param vardict dict of variable name : array of values, the same length for each variable
+        """
+        if len(vardict.get(self.time_var, [])) == 0:
+            return
+
+        nodes = {}
+        for var_name, values in vardict.iteritems():
+            values = numpy.asarray(values, dtype='float64')
+            nodes[var_name] = {'min': values, 'max': values, 'sum': values, 'count': numpy.ones(len(values))}
+
+        level = 0
+        while len(nodes[self.time_var]['count']) > 0:
+            if level > 0:
+                self._add_nodes(level, nodes)
+
+            if level + 1 == self.max_levels:
+                break
+
+            if level == len(self.pending):
+                self.pending.append(slice_nodes(nodes, 0, 0))
+
+            parents = {}
+            for var_name, var_nodes in nodes.iteritems():
+                pending = self.pending[level][var_name]
+                var_nodes = dict((stat, numpy.concatenate((pending[stat], var_nodes[stat]))) for stat in node_stats)
+                parents[var_name], self.pending[level][var_name] = aggregate_nodes(var_nodes, self.order)
+
+            nodes = parents
+            level += 1
+
+        self._write_doc(self._header_id(), {
+            'order': self.order,
+            'chunk_size': self.chunk_size,
+            'chunk_times': self.chunk_times,
+            'pending': [nodes_to_doc(pending) for pending in self.pending],
+        })
+
+    def get_nodes(self, level, first_chunk=0, last_chunk=None):
+        """
+        Read the completed nodes of a level from its chunks.
+
+        @param level level above 0
+        @param first_chunk index of the first chunk read
+        @param last_chunk index of the last chunk read, the open chunk if None
+        @retval dict of variable name : stat : array of the nodes
+        """
+        if last_chunk is None:
+            last_chunk = len(self.chunk_times[level]) - 1
+
+        chunks = []
+        for index in xrange(first_chunk, last_chunk + 1):
+            if index == len(self.chunk_times[level]) - 1:
+                chunks.append(self.open_chunks[level])
+            else:
+                chunks.append(doc_to_nodes(self.db.read_doc(self._chunk_id(level, index))))
+
+        return concatenate_nodes(*chunks)
+
+    def get_partial_node(self, level):
+        """
+        @retval dict of variable name : stat : array of one node summarising the records not yet in a completed
+        node of the level, or None if there are none.
+        """
+        if level == 0 or level > len(self.pending):
+            return None
+
+        nodes = self.pending[level - 1]
+        partial = self.get_partial_node(level - 1)
+        if partial is not None:
+            nodes = concatenate_nodes(nodes, partial)
+
+        if len(nodes[self.time_var]['count']) == 0:
+            return None
+
+        return dict((var_name, aggregate_nodes(var_nodes, len(var_nodes['count']))[0])
+                    for var_name, var_nodes in nodes.iteritems())
+
+    def get_extent(self):
+        """
+        @retval (start time, end time, number of records) of the records added to the tree, None if there are none
+        """
+        top = self.levels - 1
+        nodes = self.get_partial_node(1) if top == 0 else self._read_range(top, None, None)
+        if nodes is None or len(nodes[self.time_var]['count']) == 0:
+            return None
+
+        time_nodes = nodes[self.time_var]
+        return float(time_nodes['min'].min()), float(time_nodes['max'].max()), int(time_nodes['count'].sum())
+
+    def query(self, var_names=None, start_time=None, end_time=None, max_points=1024):
+        """
+        Read the nodes overlapping a time range at the finest level with at most max_points nodes in the range.
+        The number of records in the range, estimated at the top level, gives the level to read; only the chunks
+        of that level overlapping the range are read.
+
+        @param var_names list of variable names, all variables if None
+        @param start_time start of the range, the first record if None
+        @param end_time end of the range, the last record if None
+        @param max_points maximum number of nodes to return
+        @retval dict with the 'level' read, the 'start_time' and 'end_time' arrays of the nodes and a dict of 'min',
+        'max', 'mean' and 'count' arrays for each variable, None if no node has been completed yet
+        """
+        if self.levels == 1:
+            return None
+
+        # The records in the range are estimated from the top level nodes overlapping it, taking the records of a
+        # node to be spread evenly over its time span
+        top = self.levels - 1
+        top_nodes = self._read_range(top, start_time, end_time)
+        time_nodes = top_nodes[self.time_var]
+        span = time_nodes['max'] - time_nodes['min']
+        overlap = time_nodes['max'] if end_time is None else numpy.minimum(time_nodes['max'], end_time)
+        overlap = overlap - (time_nodes['min'] if start_time is None else numpy.maximum(time_nodes['min'], start_time))
+        fraction = numpy.where(span > 0, overlap / numpy.where(span > 0, span, 1.0), 1.0)
+        records = (time_nodes['count'] * fraction).sum()
+
+        level = 1
+        if records > max_points:
+            level = min(top, int(numpy.ceil(numpy.log(float(records) / max_points) / numpy.log(self.order))))
+
+        # The nodes overlapping the ends of the range may take a level over max_points
+        while True:
+            nodes = top_nodes if level == top else self._read_range(level, start_time, end_time)
+            if len(nodes[self.time_var]['count']) <= max_points or level == top:
+                break
+            level += 1
+
+        if var_names is None:
+            var_names = [var_name for var_name in nodes if var_name != self.time_var]
+
+        result = {
+            'level': level,
+            'start_time': nodes[self.time_var]['min'],
+            'end_time': nodes[self.time_var]['max'],
+        }
+        for var_name in var_names:
+            var_nodes = nodes[var_name]
+            result[var_name] = {
+                'min': var_nodes['min'],
+                'max': var_nodes['max'],
+                'mean': var_nodes['sum'] / var_nodes['count'],
+                'count': var_nodes['count'],
+            }
+
+        return result
+
+    def _read_range(self, level, start_time, end_time):
+        # The nodes of a level overlapping a time range, from the chunks starting before the end of the range and
+        # the partial node
+        chunk_times = self.chunk_times[level]
+        first_chunk = 0 if start_time is None else max(0, bisect_right(chunk_times, start_time) - 1)
+        last_chunk = len(chunk_times) - 1 if end_time is None else max(0, bisect_right(chunk_times, end_time) - 1)
+
+        nodes = self.get_nodes(level, first_chunk, last_chunk)
+        partial = self.get_partial_node(level)
+        if partial is not None and last_chunk == len(chunk_times) - 1:
+            nodes = concatenate_nodes(nodes, partial)
+
+        time_nodes = nodes[self.time_var]
+        lo = 0 if start_time is None else numpy.searchsorted(time_nodes['max'], start_time, 'left')
+        hi = len(time_nodes['min']) if end_time is None else numpy.searchsorted(time_nodes['min'], end_time, 'right')
+
+        return slice_nodes(nodes, lo, hi)
+
+    def _add_nodes(self, level, nodes):
+        # Append completed nodes to the open chunk of a level, writing each chunk as it fills up
+        if level == self.levels:
+            self.chunk_times.append([float(nodes[self.time_var]['min'][0])])
+            self.open_chunks.append(slice_nodes(nodes, 0, 0))
+
+        chunk = concatenate_nodes(self.open_chunks[level], nodes)
+        while len(chunk[self.time_var]['count']) > self.chunk_size:
+            index = len(self.chunk_times[level]) - 1
+            chunk_id = self._chunk_id(level, index)
+            self._write_doc(chunk_id, nodes_to_doc(slice_nodes(chunk, 0, self.chunk_size)))
+            self.revs.pop(chunk_id)
+
+            chunk = slice_nodes(chunk, self.chunk_size)
+            self.chunk_times[level].append(float(chunk[self.time_var]['min'][0]))
+
+        self.open_chunks[level] = chunk
+        self._write_doc(self._chunk_id(level, len(self.chunk_times[level]) - 1), nodes_to_doc(chunk))
+
+    def _write_doc(self, doc_id, doc):
+        if doc_id in self.revs:
+            doc['_id'] = doc_id
+            doc['_rev'] = self.revs[doc_id]
+            _, self.revs[doc_id] = self.db.update_doc(doc)
+        else:
+            _, self.revs[doc_id] = self.db.create_doc(doc, object_id=doc_id)
+
+    def _header_id(self):
+        return '%s_mr_tree' % self.tree_id
+
+    def _chunk_id(self, level, index):
+        return '%s_mr_tree_%d_%d' % (self.tree_id, level, index)
+
+
+class VizTransformDataAvg(TransformDataProcess):
+
+    """
+    This class is used for data coming on the incoming streams. The records are added to the multi-resolution tree
+    of the data product, persisted in the MR_TREE_DATASTORE_NAME datastore where the visualization service reads it.
+
+    """
 
     def on_start(self):
         super(VizTransformDataAvg,self).on_start()
 
+        self.rr_cli = ResourceRegistryServiceProcessClient(process = self, node = self.container.node)
+
         #init variables
-        self.leaf_nodes = {} # dictionary stores the node values till we have enough to create an average
+        self.data_product_id = self.CFG.get('data_product_id')
+        self.stream_def_id = self.CFG.get('stream_def_id')
+        self.stream_def = self.rr_cli.read(self.stream_def_id).container
+
+        # The tree is picked up where it was left if the transform is restarted
+        db = self.container.datastore_manager.get_datastore(ds_name=MR_TREE_DATASTORE_NAME, profile=DataStore.DS_PROFILE.SCIDATA)
+        self.mr_tree = MultiResolutionTree(db, self.data_product_id, order=self.CFG.get('mr_tree_order', mr_tree_order))
+        if self.mr_tree.load():
+            log.debug('(Data Averager transform): Restored the multi-resolution tree of %s', self.data_product_id)
 
         return
 
-    def execute(self, granule):
+    def process(self, packet):
 
         log.debug('(Data Averager transform): Received Viz Data Packet' )
 
         # parse the incoming data
-        psd = PointSupplementStreamParser(stream_definition=self.incoming_stream_def, stream_granule=granule)
+        psd = PointSupplementStreamParser(stream_definition=self.stream_def, stream_granule=packet)
 
-        var_val = []
+        vardict = {}
         for var_name in psd.list_field_names():
-            var_val = psd.get_values(var_name)
-            self.leaf_nodes[var_name] = []
-
-            # start averaging once we have a whole set of values
-            for val_idx in range(0,len(var_val),mr_tree_order):
-
-                if (val_idx + mr_tree_order - 1) < len(var_val):
-                    sum = 0
-                    for i in range(mr_tree_order):
-                        sum += var_val[val_idx + i]
-                    avg = sum / mr_tree_order
-
-                    self.leaf_nodes[var_name].append(avg)
-
+            if var_name in var_to_skip:
+                continue
+            vardict[var_name] = psd.get_values(var_name)
 
-        return avg_value
+        self.mr_tree.add(vardict)
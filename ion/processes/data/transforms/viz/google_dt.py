@@ -12,6 +12,7 @@ from pyon.core.exception import BadRequest
 from pyon.public import IonObject, RT, log
 
 from datetime import datetime
+from collections import deque
 import numpy
 from pyon.ion.granule.granule import build_granule
 from pyon.ion.granule.taxonomy import TaxyTool
@@ -21,11 +22,113 @@ from prototype.sci_data.stream_defs import SBE37_CDM_stream_definition, SBE37_RA
 from prototype.sci_data.stream_parser import PointSupplementStreamParser
 from prototype.sci_data.constructor_apis import PointSupplementConstructor, RawSupplementConstructor
 
+import ion.services.ans.gviz_api as gviz_api
+
 
 tx = TaxyTool()
 tx.add_taxonomy_set('google_dt_components','Google DT components for part or entire datatable')
 
 
+class RingBuffer(object):
+    """
+    Fixed size window of the latest rows of a table, stored as a 2D numpy array. Rows appended overwrite the
+    oldest ones once the window is full.
+    """
+
+    def __init__(self, size, columns, dtype='float64'):
+        self.size = size
+        self.data = numpy.empty((size, columns), dtype=dtype)
+        self.start = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, rows):
+        """
+        @param rows 2D array of the rows to append
+        """
+        rows = rows[-self.size:]
+        n = len(rows)
+        index = (self.start + self.count + numpy.arange(n)) % self.size
+        self.data[index] = rows
+
+        overflow = max(0, self.count + n - self.size)
+        self.start = (self.start + overflow) % self.size
+        self.count = min(self.count + n, self.size)
+
+    def get(self):
+        """
+        @retval 2D array of the rows in the window, oldest first
+        """
+        return self.data[(self.start + numpy.arange(self.count)) % self.size]
+
+
+class RealtimeDataTable(object):
+    """
+    Sliding window of the latest records of a data product as a Google datatable, with a 'time' column of
+    datetimes followed by number columns. The values are kept in a ring buffer and the JSON of each row is encoded
+    once, when it is appended, so the JSON response for the window is joined from the rows already encoded.
+    The response is the same as gviz_api.DataTable(...).ToJSonResponse() for the rows in the window.
+    """
+
+    def __init__(self, table_description, window_size=100):
+        """
+        @param table_description list of (id, type, label) column descriptions, 'time' first
+        @param window_size maximum number of rows in the window
+        """
+        self.table_description = table_description
+        self.columns = [col[0] for col in table_description]
+        self.window = RingBuffer(window_size, len(self.columns))
+        self.row_json = deque(maxlen=window_size)
+
+        # The response is built from that of an empty table, with the rows inserted
+        self.empty_table = gviz_api.DataTable(table_description)
+
+    def append(self, vardict):
+        """
+        @param vardict dict of column id : array of values
+        """
+        rows = numpy.column_stack([numpy.asarray(vardict[col], dtype='float64') for col in self.columns])
+        rows = rows[-self.window.size:]
+        self.window.append(rows)
+
+        columns = dict((col, rows[:, i]) for i, col in enumerate(self.columns))
+        self.row_json.extend(gviz_api.DataTable.FromColumns(self.table_description, columns).ToJSonRows())
+
+    def get_content(self):
+        """
+        @retval list of the rows in the window, oldest first, with the time in seconds
+        """
+        return self.window.get().tolist()
+
+    def to_json_response(self, req_id=0, response_handler="google.visualization.Query.setResponse"):
+        """
+        @retval the JSON response for the rows in the window, as gviz_api.DataTable.ToJSonResponse
+        """
+        empty = self.empty_table.ToJSonResponse(req_id=req_id, response_handler=response_handler)
+        return empty.replace('"rows":[]', '"rows":[%s]' % ','.join(self.row_json), 1)
+
+
+def mr_tree_data_table(mr_tree_result, var_names=None):
+    """
+    Google datatable of the nodes read from a multi-resolution tree by MultiResolutionTree.query, with a row for
+    each node. The time of a row is the start time of its node and the values are the means over the node.
+
+    @param mr_tree_result dict returned by MultiResolutionTree.query
+    @param var_names list of the variables of the number columns, all the variables of the result if None
+    @retval gviz_api.DataTable
+    """
+    if var_names is None:
+        var_names = sorted(var_name for var_name in mr_tree_result if var_name not in ('level', 'start_time', 'end_time'))
+
+    table_description = [('time', 'datetime', 'time')] + [(var_name, 'number', var_name) for var_name in var_names]
+    columns = dict((var_name, mr_tree_result[var_name]['mean']) for var_name in var_names)
+    columns['time'] = mr_tree_result['start_time']
+
+    return gviz_api.DataTable.FromColumns(table_description, columns)
+
+
 class VizTransformGoogleDT(TransformFunction):
 
     """
@@ -59,6 +162,8 @@ class VizTransformGoogleDT(TransformFunction):
 
         # init config. Need to move it to YAML or something
         self.realtime_window_size = 100
+        self.dataDescription = []
+        self.window = None # Ring buffer of the latest records, created from the variables of the first granule
         self.max_google_dt_len = 1024 # Remove this once the decimation has been moved in to the incoming dp
 
         # Note some transform parameters
@@ -68,8 +173,6 @@ class VizTransformGoogleDT(TransformFunction):
 
         log.debug('(Google DT transform): Received Viz Data Packet' )
 
-        self.dataDescription = []
-        self.dataTableContent = []
         element_count_id = 0
         expected_range = []
 
@@ -81,44 +184,29 @@ class VizTransformGoogleDT(TransformFunction):
 
         psd = PointSupplementStreamParser(stream_definition=self.incoming_stream_def, stream_granule=granule)
         vardict = {}
-        arrLen = None
         for varname in psd.list_field_names():
             vardict[varname] = psd.get_values(varname)
-            arrLen = len(vardict[varname])
 
 
-        #iinit the dataTable
-        # create data description from the variables in the message
-        self.dataDescription = [('time', 'datetime', 'time')]
+        #if its the first time, init the dataTable
+        if self.window is None:
+            # create data description from the variables in the message
+            self.dataDescription = [('time', 'datetime', 'time')]
 
-        # split the data string to extract variable names
-        for varname in psd.list_field_names():
-            if varname == 'time':
-                continue
+            # split the data string to extract variable names
+            for varname in psd.list_field_names():
+                if varname == 'time':
+                    continue
 
-            self.dataDescription.append((varname, 'number', varname))
+                self.dataDescription.append((varname, 'number', varname))
 
+            self.window = RingBuffer(self.realtime_window_size, len(self.dataDescription))
 
-        # Add the records to the datatable
-        for i in xrange(arrLen):
-            varTuple = []
 
-            for varname,_,_ in self.dataDescription:
-                val = float(vardict[varname][i])
-                if varname == 'time':
-                    #varTuple.append(datetime.fromtimestamp(val))
-                    varTuple.append(val)
-                else:
-                    varTuple.append(val)
-
-            # Append the tuples to the data table
-            self.dataTableContent.append (varTuple)
-
-            # Maintain a sliding window for realtime transform processes
-            if len(self.dataTableContent) > self.realtime_window_size:
-                # always pop the first element till window size is what we want
-                while len(self.dataTableContent) > realtime_window_size:
-                    self.dataTableContent.pop(0)
+        # Add the records to the sliding window, the oldest ones drop out once it is full
+        self.window.append(numpy.column_stack([numpy.asarray(vardict[varname], dtype='float64')
+                                               for varname,_,_ in self.dataDescription]))
+        self.dataTableContent = self.window.get().tolist()
 
 
         """ To Do : Do we need to figure out the how many granules have been received for a replay stream ??
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+'''
+@file ion/processes/data/transforms/viz/graph_render_worker.py
+@description Renders Matplotlib graphs, in process or in a child process of the GraphRenderer of the Matplotlib
+graphs transforms. Only Matplotlib is imported, so the child process does not load the container.
+'''
+
+import os
+import sys
+import struct
+import cPickle
+import traceback
+import StringIO
+
+# Matplotlib related imports
+from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
+from matplotlib.figure import Figure
+
+# Messages between the renderer and its child process are pickles preceded by their length
+header_format = '!I'
+header_size = struct.calcsize(header_format)
+
+
+def render_graphs(x_name, series):
+    """
+    Plot each series, one PNG image per series.
+
+    @param x_name name of the variable on the x axis
+    @param series list of (variable name, x array, y array)
+    @retval list of (image name, PNG image data)
+    """
+    fig = Figure()
+    ax = fig.add_subplot(111)
+    canvas = FigureCanvas(fig)
+
+    images = []
+    for var_name, x, y in series:
+        ax.plot(x, y, 'ro')
+        ax.set_xlabel(x_name)
+        ax.set_ylabel(var_name)
+        ax.set_title(var_name + ' vs ' + x_name)
+        ax.set_autoscale_on(False)
+
+        # Save the figure to an in memory file
+        imgInMem = StringIO.StringIO()
+        canvas.print_figure(imgInMem, format="png")
+        images.append((var_name + '_vs_' + x_name + '.png', imgInMem.getvalue()))
+
+        #clear the canvas for the next image
+        ax.clear()
+
+    return images
+
+
+def read_message(f):
+    """
+    @retval the object read, None at the end of the file
+    """
+    header = f.read(header_size)
+    if len(header) < header_size:
+        return None
+    (size,) = struct.unpack(header_format, header)
+    return cPickle.loads(f.read(size))
+
+
+def encode_message(obj):
+    data = cPickle.dumps(obj, cPickle.HIGHEST_PROTOCOL)
+    return struct.pack(header_format, len(data)) + data
+
+
+def main():
+    """
+    Render the (x_name, series) requests read from stdin until it is closed. Each reply is (True, images) or
+    (False, traceback) if the rendering failed.
+    """
+    # The replies get a copy of stdout to themselves, anything printed goes to stderr
+    out = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    while True:
+        request = read_message(sys.stdin)
+        if request is None:
+            break
+
+        try:
+            reply = (True, render_graphs(*request))
+        except Exception:
+            reply = (False, traceback.format_exc())
+
+        out.write(encode_message(reply))
+        out.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,21 @@
 
 from pyon.ion.transform import TransformFunction
 from pyon.service.service import BaseService
-from pyon.core.exception import BadRequest
+from pyon.core.exception import BadRequest, ServerError
 from pyon.public import IonObject, RT, log
 
+import os
+import sys
 import time
+import errno
+import fcntl
+import struct
+import cPickle
+import numpy
+from subprocess import Popen
+from subprocess import PIPE
+from gevent.coros import RLock
+from gevent.socket import wait_read, wait_write
 from pyon.ion.granule.granule import build_granule
 from pyon.ion.granule.taxonomy import TaxyTool
 from pyon.ion.granule.record_dictionary import RecordDictionaryTool
@@ -13,16 +24,189 @@ from prototype.sci_data.stream_defs import SBE37_CDM_stream_definition, SBE37_RA
 from prototype.sci_data.stream_parser import PointSupplementStreamParser
 from prototype.sci_data.constructor_apis import PointSupplementConstructor, RawSupplementConstructor
 
-import StringIO
-from numpy import array, append
+from numpy import array
 
-# Matplotlib related imports
-from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
-from matplotlib.figure import Figure
+from ion.processes.data.transforms.viz.google_dt import RingBuffer
+from ion.processes.data.transforms.viz.graph_render_worker import render_graphs, encode_message, header_format, header_size
 
 tx = TaxyTool()
 tx.add_taxonomy_set('matplotlib_graphs','Matplotlib generated graphs for a particular data product')
 
+graph_history_size = 10000 # Number of the latest records of a data product kept for its graphs
+graph_resolution = 800 # Roughly the width of a graph in pixels. Series are decimated to a min and max per pixel
+var_to_skip = ['height', 'longitude', 'latitude'] # The variables in this list are not graphed
+
+
+def decimate_min_max(x, y, num_bins=graph_resolution):
+    """
+    Shape preserving decimation of a series for plotting. The x range is split into num_bins bins, about a pixel
+    each, and only the points with the min and max y of each bin are kept, so spikes and dropouts still show.
+    Points with a NaN coordinate are dropped.
+
+    @param x array of the x coordinates
+    @param y array of the y coordinates
+    @param num_bins number of bins
+    @retval (x, y) arrays of the points kept, in their original order
+    """
+    x = numpy.asarray(x, dtype='float64')
+    y = numpy.asarray(y, dtype='float64')
+
+    finite = numpy.isfinite(x) & numpy.isfinite(y)
+    if not finite.all():
+        x, y = x[finite], y[finite]
+
+    if len(x) <= 2 * num_bins:
+        return x, y
+
+    x_min, x_max = x.min(), x.max()
+    if x_max > x_min:
+        bins = numpy.minimum(((x - x_min) / (x_max - x_min) * num_bins).astype('int64'), num_bins - 1)
+    else:
+        bins = numpy.zeros(len(x), dtype='int64')
+
+    # Points sorted by bin then y, the first and last of each bin are its min and max
+    order = numpy.lexsort((y, bins))
+    bin_starts = numpy.flatnonzero(numpy.diff(bins[order])) + 1
+    first = order[numpy.concatenate(([0], bin_starts))]
+    last = order[numpy.concatenate((bin_starts - 1, [len(order) - 1]))]
+
+    keep = numpy.union1d(first, last)
+    return x[keep], y[keep]
+
+
+class GraphHistory(object):
+    """
+    Bounded history of the records of a data product for its graphs. The latest records are kept in a ring
+    buffer, and the history is dirty from when records are added until its graphs are rendered. The revision
+    counts the appends, so a renderer can tell whether records came in while it was rendering.
+    """
+
+    def __init__(self, size=graph_history_size):
+        self.size = size
+        self.var_names = None
+        self.window = None
+        self.dirty = False
+        self.revision = 0
+
+    def __len__(self):
+        return len(self.window) if self.window is not None else 0
+
+    def append(self, vardict):
+        """
+        @param vardict dict of variable name : array of values, the same variables in each call
+        """
+        if self.window is None:
+            self.var_names = sorted(vardict.keys())
+            self.window = RingBuffer(self.size, len(self.var_names))
+
+        self.window.append(numpy.column_stack([numpy.asarray(vardict[var_name], dtype='float64')
+                                               for var_name in self.var_names]))
+        self.dirty = True
+        self.revision += 1
+
+    def get(self):
+        """
+        @retval dict of variable name : array of its values in the history, oldest first
+        """
+        if self.window is None:
+            return {}
+
+        rows = self.window.get()
+        return dict((var_name, rows[:, i]) for i, var_name in enumerate(self.var_names))
+
+
+class GraphRenderer(object):
+    """
+    Renders the graphs of a data product from its history, each variable against time. The series are decimated
+    before plotting, so the rendering time depends on the size of the graphs rather than the number of records.
+    Out of process, the graphs are rendered by a child process running graph_render_worker, started on first use.
+    The calling greenlet waits on the pipes to the child cooperatively, so the other greenlets of the container
+    keep running while the graphs are rendered.
+    """
+
+    def __init__(self, out_of_process=False, resolution=graph_resolution, x_name='time'):
+        self.out_of_process = out_of_process
+        self.resolution = resolution
+        self.x_name = x_name
+        self.worker = None
+        self.worker_lock = RLock()
+
+    def render(self, graph_data):
+        """
+        @param graph_data dict of variable name : array of values, as returned by GraphHistory.get
+        @retval list of (image name, PNG image data)
+        @throws ServerError    the rendering failed in the child process
+        """
+        x = graph_data[self.x_name]
+        series = []
+        for var_name in sorted(graph_data.keys()):
+            if var_name == self.x_name or var_name in var_to_skip:
+                continue
+            series.append((var_name,) + decimate_min_max(x, graph_data[var_name], self.resolution))
+
+        if not self.out_of_process:
+            return render_graphs(self.x_name, series)
+
+        with self.worker_lock:
+            if self.worker is None:
+                self._start_worker()
+
+            try:
+                self._write(encode_message((self.x_name, series)))
+                (size,) = struct.unpack(header_format, self._read(header_size))
+                ok, reply = cPickle.loads(self._read(size))
+            except (EOFError, IOError, OSError) as ex:
+                # The child is restarted on the next call
+                self.close()
+                raise ServerError('Graph rendering process failed: %s' % ex)
+
+        if not ok:
+            raise ServerError('Graph rendering failed: %s' % reply)
+        return reply
+
+    def close(self):
+        if self.worker is not None:
+            self.worker.stdin.close()
+            self.worker.stdout.close()
+            self.worker.kill()
+            self.worker.wait()
+            self.worker = None
+
+    def _start_worker(self):
+        # The child gets the path of the container, which may have been set up by a buildout script
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        self.worker = Popen([sys.executable, '-m', 'ion.processes.data.transforms.viz.graph_render_worker'],
+                            stdin=PIPE, stdout=PIPE, close_fds=True, env=env)
+        for f in (self.worker.stdin, self.worker.stdout):
+            fcntl.fcntl(f.fileno(), fcntl.F_SETFL, fcntl.fcntl(f.fileno(), fcntl.F_GETFL) | os.O_NONBLOCK)
+
+    def _write(self, data):
+        fd = self.worker.stdin.fileno()
+        while data:
+            try:
+                data = data[os.write(fd, data):]
+            except OSError as ex:
+                if ex.errno != errno.EAGAIN:
+                    raise
+                wait_write(fd)
+
+    def _read(self, size):
+        fd = self.worker.stdout.fileno()
+        chunks = []
+        while size:
+            try:
+                chunk = os.read(fd, size)
+            except OSError as ex:
+                if ex.errno != errno.EAGAIN:
+                    raise
+                wait_read(fd)
+                continue
+            if not chunk:
+                raise EOFError('end of output')
+            chunks.append(chunk)
+            size -= len(chunk)
+        return ''.join(chunks)
+
 class VizTransformMatplotlibGraphs(TransformFunction):
 
     """
@@ -37,13 +221,16 @@ class VizTransformMatplotlibGraphs(TransformFunction):
     def on_start(self):
         super(VizTransformMatplotlibGraphs,self).on_start()
 
-        self.initDataFlag = True
         self.out_granule = None
-        self.graph_data = {} # Stores a dictionary of variables : [List of values]
+        self.history = GraphHistory(self.CFG.get('graph_history_size', graph_history_size)) # The latest records of each variable
+        self.renderer = GraphRenderer(out_of_process=self.CFG.get('render_out_of_process', False))
         self.lastRenderTime = 0
         self.renderTimeThreshold = 10 # if two consecutive calls to renderGraphs() was done within this time
                                     # interval, it would be ignored (in seconds)
 
+    def on_quit(self):
+        self.renderer.close()
+        super(VizTransformMatplotlibGraphs,self).on_quit()
 
 
     def execute(self, granule):
@@ -54,24 +241,13 @@ class VizTransformMatplotlibGraphs(TransformFunction):
 
         # re-arrange incoming data into an easy to parse dictionary
         vardict = {}
-        arrLen = None
         for varname in psd.list_field_names():
             vardict[varname] = psd.get_values(varname)
-            arrLen = len(vardict[varname])
-
-        if self.initDataFlag:
-            # look at the incoming packet and store
-            for varname in psd.list_field_names():
-                self.graph_data[varname] = []
 
-            self.initDataFlag = False
+        # Add the values to the history, the oldest ones drop out once it is full
+        self.history.append(vardict)
 
-        # If code reached here, the graph data storage has been initialized. Just add values
-        # to the list
-        for varname in psd.list_field_names():
-            self.graph_data[varname].extend(vardict[varname])
-
-        if (time.time() - self.lastRenderTime) > self.renderTimeThreshold:
+        if self.history.dirty and (time.time() - self.lastRenderTime) > self.renderTimeThreshold:
             self.lastRenderTime = time.time()
             self.render_graphs()
 
@@ -80,51 +256,21 @@ class VizTransformMatplotlibGraphs(TransformFunction):
 
     def render_graphs(self):
 
-        # init Matplotlib
-        fig = Figure()
-        ax = fig.add_subplot(111)
-        canvas = FigureCanvas(fig)
-        imgInMem = StringIO.StringIO()
-
-        # If there's no data, wait
-        # For the simple case of testing, lets plot all time variant variables one at a time
-        xAxisVar = 'time'
-        xAxisFloatData = self.graph_data[xAxisVar]
-        rdt = RecordDictionaryTool(taxonomy=tx)
-        rdt['matplotlib_graphs'] = array([])
-
-        for varName, varData in self.graph_data.iteritems():
-            if varName == 'time' or varName == 'height' or varName == 'longitude' or varName == 'latitude':
-                continue
-
-            yAxisVar = varName
-            yAxisFloatData = self.graph_data[varName]
-
-            # Generate the plot
-            ax.plot(xAxisFloatData, yAxisFloatData, 'ro')
-            ax.set_xlabel(xAxisVar)
-            ax.set_ylabel(yAxisVar)
-            ax.set_title(yAxisVar + ' vs ' + xAxisVar)
-            ax.set_autoscale_on(False)
-
-            # generate filename for the output image
-            fileName = yAxisVar + '_vs_' + xAxisVar + '.png'
-            # Save the figure to the in memory file
-            canvas.print_figure(imgInMem, format="png")
-            imgInMem.seek(0)
+        graph_data = self.history.get()
+        images = self.renderer.render(graph_data)
+        self.history.dirty = False
 
+        msgs = []
+        for fileName, image_obj in images:
             # submit resulting table back using the out stream publisher
-            msg = {"viz_product_type": "matplotlib_graphs",
-                   "data_product_id": "FAKE_DATAPRODUCT_ID_0001",
-                   "image_obj": imgInMem.getvalue(),
-                   "image_name": fileName}
-
-            append(rdt['matplotlib_graphs'], msg)
+            msgs.append({"viz_product_type": "matplotlib_graphs",
+                         "data_product_id": "FAKE_DATAPRODUCT_ID_0001",
+                         "image_obj": image_obj,
+                         "image_name": fileName})
 
-            #clear the canvas for the next image
-            ax.clear()
+        rdt = RecordDictionaryTool(taxonomy=tx)
+        rdt['matplotlib_graphs'] = array(msgs)
 
         #Generate a list of the graph objects generated
         self.out_granule = build_granule(data_producer_id='matplotlib_graphs_transform', taxonomy=tx, record_dictionary=rdt)
 
-
@@ -0,0 +1,24 @@
+#!/usr/bin/env python
+
+'''
+@brief Test data shared by the tests of the viz transforms and of the Google datatables
+'''
+
+import numpy
+
+
+def make_records(start, count, offset=0.0):
+    """
+    CTD like records, one per second.
+
+    @param start index of the first record
+    @param count number of records
+    @param offset added to the times, start + offset being the time of the first record
+    @retval dict of variable name : array of values, for 'time', 'temperature' and 'pressure'
+    """
+    t = numpy.arange(start, start + count, dtype='float64') + offset
+    return {
+        'time': t,
+        'temperature': 10.0 + numpy.sin(t / 50.0),
+        'pressure': numpy.cos(t / 7.0) * 100.0,
+    }
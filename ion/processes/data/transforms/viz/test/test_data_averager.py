@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+
+'''
+@brief Test the multi-resolution tree of the data averager transform
+'''
+
+import copy
+import time
+import numpy
+
+from pyon.core.exception import NotFound
+from pyon.public import log
+from pyon.util.unit_test import IonUnitTestCase
+from nose.plugins.attrib import attr
+
+from ion.processes.data.transforms.viz.data_averager import MultiResolutionTree
+from ion.processes.data.transforms.viz.test.helpers import make_records
+
+
+class FakeDatastore(object):
+    """
+    Documents held in memory, counting the documents read and written
+    """
+
+    def __init__(self):
+        self.docs = {}
+        self.reads = 0
+        self.writes = 0
+
+    def create_doc(self, doc, object_id=None):
+        self.writes += 1
+        doc = copy.deepcopy(doc)
+        doc['_id'], doc['_rev'] = object_id, 1
+        self.docs[object_id] = doc
+        return doc['_id'], doc['_rev']
+
+    def update_doc(self, doc):
+        self.writes += 1
+        if self.docs[doc['_id']]['_rev'] != doc['_rev']:
+            raise AssertionError('Document update conflict: %s' % doc['_id'])
+        doc = copy.deepcopy(doc)
+        doc['_rev'] += 1
+        self.docs[doc['_id']] = doc
+        return doc['_id'], doc['_rev']
+
+    def read_doc(self, doc_id):
+        self.reads += 1
+        if doc_id not in self.docs:
+            raise NotFound('Document %s does not exist' % doc_id)
+        return copy.deepcopy(self.docs[doc_id])
+
+
+@attr('UNIT', group='as')
+class TestMultiResolutionTree(IonUnitTestCase):
+
+    def assert_trees_equal(self, tree, expected):
+        self.assertEqual(tree.levels, expected.levels)
+        for level in range(1, tree.levels):
+            nodes = tree.get_nodes(level)
+            expected_nodes = expected.get_nodes(level)
+            for var_name in ['time', 'temperature', 'pressure']:
+                for stat in ['min', 'max', 'sum', 'count']:
+                    numpy.testing.assert_array_almost_equal(nodes[var_name][stat], expected_nodes[var_name][stat])
+
+    def test_incremental(self):
+        # Adding granules of any size gives the same tree as adding all the records at once
+        tree = MultiResolutionTree(FakeDatastore(), 'dp', order=4, chunk_size=8)
+        start = 0
+        for count in [1, 3, 7, 16, 2, 64, 5, 100, 1]:
+            tree.add(make_records(start, count))
+            start += count
+
+        whole = MultiResolutionTree(FakeDatastore(), 'dp', order=4, chunk_size=8)
+        whole.add(make_records(0, start))
+
+        self.assert_trees_equal(tree, whole)
+
+    def test_node_stats(self):
+        # Each node of level n summarises order ** n records
+        records = make_records(0, 1000)
+        tree = MultiResolutionTree(FakeDatastore(), 'dp', order=4, chunk_size=8)
+        tree.add(records)
+
+        self.assertEqual(tree.levels, 5)
+        for level in [1, 2, 3, 4]:
+            size = 4 ** level
+            nodes = tree.get_nodes(level)['pressure']
+            self.assertEqual(len(nodes['count']), 1000 / size)
+            blocks = records['pressure'][:len(nodes['count']) * size].reshape(-1, size)
+            numpy.testing.assert_array_almost_equal(nodes['min'], blocks.min(axis=1))
+            numpy.testing.assert_array_almost_equal(nodes['max'], blocks.max(axis=1))
+            numpy.testing.assert_array_almost_equal(nodes['sum'], blocks.sum(axis=1))
+            numpy.testing.assert_array_equal(nodes['count'], size)
+
+        # The records not yet in a node of a level are summarised by a partial node
+        partial = tree.get_partial_node(4)['pressure']
+        self.assertEqual(partial['count'][0], 1000 - 3 * 256)
+        self.assertAlmostEqual(partial['min'][0], records['pressure'][768:].min())
+
+    def test_bounded_memory(self):
+        # Only the open chunk of each level and the nodes waiting for a parent are held, the other chunks are read
+        # back from the datastore
+        db = FakeDatastore()
+        tree = MultiResolutionTree(db, 'dp', order=4, chunk_size=16)
+        for i in range(100):
+            tree.add(make_records(i * 100, 100))
+
+        for level in range(1, tree.levels):
+            self.assertTrue(len(tree.open_chunks[level]['time']['count']) <= 16)
+        for pending in tree.pending:
+            self.assertTrue(len(pending['time']['count']) < 4)
+
+        self.assertEqual(len(tree.chunk_times[1]), 10000 / 4 / 16 + 1)
+        self.assertEqual(tree.get_nodes(1)['time']['count'].sum(), 10000)
+
+    def test_restore(self):
+        # A tree loaded from its documents carries on where the first one stopped
+        db = FakeDatastore()
+        tree = MultiResolutionTree(db, 'dp', order=4, chunk_size=8)
+        self.assertFalse(tree.load())
+        tree.add(make_records(0, 333))
+
+        restored = MultiResolutionTree(db, 'dp')
+        self.assertTrue(restored.load())
+        self.assertEqual((restored.order, restored.chunk_size), (4, 8))
+        restored.add(make_records(333, 500))
+
+        whole = MultiResolutionTree(FakeDatastore(), 'dp', order=4, chunk_size=8)
+        whole.add(make_records(0, 833))
+
+        self.assert_trees_equal(restored, whole)
+        self.assertEqual(restored.query()['pressure']['count'].sum(), 833)
+
+    def test_extent(self):
+        tree = MultiResolutionTree(FakeDatastore(), 'dp', order=4, chunk_size=8)
+        self.assertEqual(tree.get_extent(), None)
+
+        # Records not yet in a node are included, at every size of tree
+        start = 10
+        for count in [3, 1, 100, 1000]:
+            tree.add(make_records(start, count))
+            start += count
+            self.assertEqual(tree.get_extent(), (10.0, start - 1.0, start - 10))
+
+    def test_query(self):
+        records = make_records(0, 10000)
+        tree = MultiResolutionTree(FakeDatastore(), 'dp', order=4, chunk_size=64)
+        tree.add(records)
+
+        # The whole range is read from the finest level with at most max_points nodes, including the latest records
+        result = tree.query(max_points=800)
+        self.assertEqual(result['level'], 2)
+        self.assertTrue(len(result['start_time']) <= 800)
+        self.assertEqual(result['pressure']['count'].sum(), 10000)
+        self.assertAlmostEqual(result['pressure']['min'].min(), records['pressure'].min())
+        self.assertAlmostEqual(result['pressure']['max'].max(), records['pressure'].max())
+        self.assertEqual(result['end_time'][-1], 9999.0)
+
+        # A short range is read from the finest level
+        result = tree.query(var_names=['temperature'], start_time=100.0, end_time=199.0, max_points=800)
+        self.assertEqual(result['level'], 1)
+        numpy.testing.assert_array_equal(result['start_time'], records['time'][100:200:4])
+        numpy.testing.assert_array_almost_equal(result['temperature']['mean'],
+            records['temperature'][100:200].reshape(-1, 4).mean(axis=1))
+        self.assertFalse('pressure' in result)
+
+        # Nodes overlapping the ends of the range are included
+        result = tree.query(start_time=1000.5, end_time=2000.5, max_points=100)
+        self.assertEqual(result['level'], 2)
+        self.assertTrue(result['start_time'][0] <= 1000.5 <= result['end_time'][0])
+        self.assertTrue(result['start_time'][-1] <= 2000.5 <= result['end_time'][-1])
+
+    def test_benchmark(self):
+        # Stream a day of 1 Hz records in granules and read the whole range and an hour of it for a plot 1000
+        # pixels wide. The times are logged, only the documents read are checked
+        db = FakeDatastore()
+        tree = MultiResolutionTree(db, 'dp', order=4)
+
+        start = time.time()
+        for i in range(864):
+            tree.add(make_records(i * 100, 100))
+        add_time = time.time() - start
+        writes = db.writes
+
+        for start_time, end_time in [(None, None), (43200.0, 46800.0)]:
+            db.reads = 0
+            start = time.time()
+            result = tree.query(start_time=start_time, end_time=end_time, max_points=1000)
+            query_time = time.time() - start
+
+            log.info('Multi-resolution tree: added 864 granules in %f s with %d writes, read %d of 86400 records as %d level %d nodes from %d documents in %f s' %
+                     (add_time, writes, result['pressure']['count'].sum(), len(result['start_time']), result['level'], db.reads, query_time))
+            self.assertTrue(len(result['start_time']) <= 1000)
+            self.assertTrue(db.reads <= 1000 / 256 + 4)
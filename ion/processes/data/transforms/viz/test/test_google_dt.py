@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+'''
+@brief Test the realtime Google datatable window of the Google DT transforms
+'''
+
+import time
+from datetime import datetime
+import numpy
+
+from pyon.public import log
+from pyon.util.unit_test import IonUnitTestCase
+from nose.plugins.attrib import attr
+
+import ion.services.ans.gviz_api as gviz_api
+from ion.processes.data.transforms.viz.google_dt import RingBuffer, RealtimeDataTable, mr_tree_data_table
+from ion.processes.data.transforms.viz.test.helpers import make_records
+
+description = [('time', 'datetime', 'time'), ('temperature', 'number', 'temperature'), ('pressure', 'number', 'pressure')]
+
+def full_data_table(records, window_size):
+    # The datatable of the window built row by row
+    rows = [[datetime.fromtimestamp(float(records['time'][i])), float(records['temperature'][i]), float(records['pressure'][i])]
+            for i in xrange(len(records['time']))][-window_size:]
+    data_table = gviz_api.DataTable(description)
+    data_table.LoadData(rows)
+    return data_table
+
+
+@attr('UNIT', group='as')
+class TestRealtimeDataTable(IonUnitTestCase):
+
+    def test_ring_buffer(self):
+        ring = RingBuffer(5, 2)
+        ring.append(numpy.array([[1, 1], [2, 2]]))
+        self.assertEqual(ring.get()[:, 0].tolist(), [1, 2])
+
+        ring.append(numpy.array([[3, 3], [4, 4], [5, 5], [6, 6]]))
+        self.assertEqual(len(ring), 5)
+        self.assertEqual(ring.get()[:, 0].tolist(), [2, 3, 4, 5, 6])
+
+        ring.append(numpy.array([[i, i] for i in range(7, 20)]))
+        self.assertEqual(ring.get()[:, 1].tolist(), [15, 16, 17, 18, 19])
+
+    def test_json_response(self):
+        # The response for the window is the same as that of the datatable built from all the records
+        data_table = RealtimeDataTable(description, window_size=100)
+        all_records = dict((col, numpy.array([])) for col in ['time', 'temperature', 'pressure'])
+
+        start = 0
+        for count in [1, 10, 50, 3, 120, 7]:
+            records = make_records(start, count, 0.25)
+            if start == 0:
+                records['pressure'][0] = numpy.nan
+            data_table.append(records)
+            for col in all_records:
+                all_records[col] = numpy.concatenate((all_records[col], records[col]))
+            start += count
+
+            expected = full_data_table(all_records, 100)
+            self.assertEqual(data_table.to_json_response(), expected.ToJSonResponse())
+            self.assertEqual(data_table.to_json_response(req_id=3, response_handler='cb'),
+                             expected.ToJSonResponse(req_id=3, response_handler='cb'))
+
+        self.assertEqual(data_table.get_content()[-1], [start - 1 + 0.25, all_records['temperature'][-1], all_records['pressure'][-1]])
+
+    def test_mr_tree_data_table(self):
+        # A row for each node read from a multi-resolution tree, with the means of the variables
+        records = make_records(0, 4, 0.25)
+        result = {
+            'level': 1,
+            'start_time': records['time'],
+            'end_time': records['time'] + 3,
+            'temperature': {'mean': records['temperature']},
+            'pressure': {'mean': records['pressure']},
+        }
+
+        expected = full_data_table(records, 4)
+        self.assertEqual(mr_tree_data_table(result, ['temperature', 'pressure']).ToJSonResponse(), expected.ToJSonResponse())
+        self.assertEqual([col['id'] for col in mr_tree_data_table(result).columns], ['time', 'pressure', 'temperature'])
+
+    def test_benchmark(self):
+        # Cost per granule of 10 records of a window of 100 rows, logged rather than checked
+        count = 200
+        window = RealtimeDataTable(description, window_size=100)
+
+        start = time.time()
+        for i in xrange(count):
+            window.append(make_records(i * 10, 10, 0.25))
+            window.to_json_response()
+        window_time = (time.time() - start) / count
+
+        rows = []
+        start = time.time()
+        for i in xrange(count):
+            records = make_records(i * 10, 10, 0.25)
+            for j in xrange(10):
+                rows.append([datetime.fromtimestamp(float(records['time'][j])), float(records['temperature'][j]), float(records['pressure'][j])])
+                while len(rows) > 100:
+                    rows.pop(0)
+            data_table = gviz_api.DataTable(description)
+            data_table.LoadData(rows)
+            data_table.ToJSonResponse()
+        rebuild_time = (time.time() - start) / count
+
+        log.info('Realtime datatable per granule: %f ms rebuilt, %f ms windowed' % (rebuild_time * 1000, window_time * 1000))
+        self.assertEqual(window.to_json_response(), data_table.ToJSonResponse())
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+'''
+@brief Test the bounded history, decimation and rendering of the Matplotlib graphs transforms
+'''
+
+import time
+import gevent
+import numpy
+
+from pyon.public import log
+from pyon.util.unit_test import IonUnitTestCase
+from nose.plugins.attrib import attr
+
+from ion.processes.data.transforms.viz.matplotlib_graphs import decimate_min_max, render_graphs, GraphHistory, GraphRenderer
+from ion.processes.data.transforms.viz.test.helpers import make_records
+
+
+@attr('UNIT', group='as')
+class TestMatplotlibGraphs(IonUnitTestCase):
+
+    def test_decimate_min_max(self):
+        records = make_records(0, 100000)
+        x, y = records['time'], records['temperature']
+        y[12345] = 50.0
+        y[54321] = -50.0
+        y[777] = numpy.nan
+
+        dx, dy = decimate_min_max(x, y, 800)
+        self.assertTrue(len(dx) <= 1600)
+        self.assertTrue(numpy.all(numpy.diff(dx) > 0))
+
+        # The min and max of each bin are kept, spikes included
+        bins = numpy.minimum((x / x[-1] * 800).astype('int64'), 799)
+        for i in [0, 15, 123, 799]:
+            in_bin = (bins == i) & numpy.isfinite(y)
+            self.assertEqual(dy[numpy.in1d(dx, x[in_bin])].max(), y[in_bin].max())
+            self.assertEqual(dy[numpy.in1d(dx, x[in_bin])].min(), y[in_bin].min())
+        self.assertTrue(50.0 in dy.tolist() and -50.0 in dy.tolist())
+        self.assertFalse(numpy.isnan(dy).any())
+
+        # Short series are returned as they are
+        dx, dy = decimate_min_max(x[:100], y[:100], 800)
+        self.assertEqual(dy.tolist(), y[:100].tolist())
+
+        dx, dy = decimate_min_max(numpy.ones(5000), numpy.arange(5000), 800)
+        self.assertEqual(dy.tolist(), [0, 4999])
+
+    def test_graph_history(self):
+        history = GraphHistory(size=1000)
+        self.assertEqual(history.get(), {})
+        self.assertFalse(history.dirty)
+
+        for i in xrange(30):
+            history.append(make_records(i * 100, 100))
+        self.assertTrue(history.dirty)
+        self.assertEqual(history.revision, 30)
+        self.assertEqual(len(history), 1000)
+
+        graph_data = history.get()
+        self.assertEqual(graph_data['time'].tolist(), range(2000, 3000))
+        self.assertEqual(graph_data['pressure'].tolist(), make_records(2000, 1000)['pressure'].tolist())
+
+    def test_render(self):
+        # No graph is rendered for the position
+        records = make_records(0, 5000)
+        records['latitude'] = numpy.ones(5000) * 32.7
+        history = GraphHistory()
+        history.append(records)
+
+        images = GraphRenderer().render(history.get())
+        self.assertEqual([name for name, _ in images], ['pressure_vs_time.png', 'temperature_vs_time.png'])
+        for name, image in images:
+            self.assertTrue(image.startswith('\x89PNG'))
+
+        # The same images are rendered by a child process, while the other greenlets keep running
+        ticks = []
+        def tick():
+            while True:
+                ticks.append(time.time())
+                gevent.sleep(0.01)
+        ticker = gevent.spawn(tick)
+
+        renderer = GraphRenderer(out_of_process=True)
+        try:
+            start = time.time()
+            self.assertEqual(renderer.render(history.get()), images)
+            self.assertTrue(len([t for t in ticks if t > start]) > 1)
+            self.assertEqual(renderer.render(history.get()), images)
+        finally:
+            ticker.kill()
+            renderer.close()
+        self.assertEqual(renderer.worker, None)
+
+    def test_benchmark(self):
+        # Rendering time of the graphs of a day of records, every point and decimated, logged rather than checked
+        records = make_records(0, 86400)
+        series = [(var_name, records['time'], records[var_name]) for var_name in ['pressure', 'temperature']]
+
+        start = time.time()
+        full_images = render_graphs('time', series)
+        full_time = time.time() - start
+
+        start = time.time()
+        decimated_images = GraphRenderer().render(records)
+        decimated_time = time.time() - start
+
+        log.info('Graphs of %d records: %f s every point, %f s decimated' % (len(records['time']), full_time, decimated_time))
+        self.assertEqual([name for name, _ in decimated_images], [name for name, _ in full_images])
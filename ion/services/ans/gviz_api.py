@@ -26,19 +26,68 @@ Google Visualization API.
 
 __author__ = "Amit Weinstein, Misha Seltzer, Jacob Baskin"
 
+import calendar
 import cgi
 import cStringIO
 import csv
 import datetime
 import json
+import time
 import types
 
+import numpy
+
 
 class DataTableException(Exception):
   """The general exception object thrown by DataTable."""
   pass
 
 
+def LocalTimeFields(timestamps):
+  """Converts seconds since the epoch to local time, as fromtimestamp does.
+
+  The calendar conversion is vectorized; the local time offset is looked up
+  for each distinct second, as a range may cross any number of DST changes.
+
+  Args:
+    timestamps: A sequence of seconds since the epoch.
+
+  Returns:
+    A tuple of numpy arrays (year, month, day, hour, minute, second).
+  """
+  timestamps = numpy.asarray(timestamps, dtype="float64")
+
+  # Whole seconds, rounding the fraction to microseconds like datetime does.
+  seconds = numpy.floor(timestamps)
+  seconds += numpy.round((timestamps - seconds) * 1e6) >= 1e6
+  seconds = seconds.astype("int64")
+
+  def UtcOffset(t):
+    return calendar.timegm(time.localtime(t)) - t
+
+  unique_seconds, inverse = numpy.unique(seconds, return_inverse=True)
+  offsets = numpy.array([UtcOffset(t) for t in unique_seconds.tolist()],
+                        dtype="int64")
+  seconds = seconds + offsets[inverse]
+
+  days = seconds // 86400
+  seconds_of_day = seconds - days * 86400
+
+  # Civil date from days since 1970-01-01 in the proleptic Gregorian calendar.
+  z = days + 719468
+  era = z // 146097
+  doe = z - era * 146097
+  yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+  doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+  mp = (5 * doy + 2) // 153
+  day = doy - (153 * mp + 2) // 5 + 1
+  month = numpy.where(mp < 10, mp + 3, mp - 9)
+  year = yoe + era * 400 + (month <= 2)
+
+  return (year, month, day, seconds_of_day // 3600,
+          seconds_of_day // 60 % 60, seconds_of_day % 60)
+
+
 class DataTableJSONEncoder(json.JSONEncoder):
   """JSON encoder that handles date/time/datetime objects correctly."""
 
@@ -155,12 +204,32 @@ class DataTable(object):
     """
     self.__columns = self.TableDescriptionParser(table_description)
     self.__data = []
+    # Data loaded by LoadColumns, until rows are needed.
+    self.__column_data = None
+    self.__column_rows = 0
     self.custom_properties = {}
     if custom_properties is not None:
       self.custom_properties = custom_properties
     if data:
       self.LoadData(data)
 
+  @classmethod
+  def FromColumns(cls, table_description, columns, custom_properties=None):
+    """Creates a data table from a table schema and columns of values.
+
+    Args:
+      table_description: A table schema of flat columns, such as a list of
+                         column descriptor tuples.
+      columns: Passed as is to LoadColumns().
+      custom_properties: Optional. The table's custom properties.
+
+    Returns:
+      The DataTable.
+    """
+    data_table = cls(table_description, custom_properties=custom_properties)
+    data_table.LoadColumns(columns)
+    return data_table
+
   @staticmethod
   def CoerceValue(value, value_type):
     """Coerces a single value into the type expected for its column.
@@ -507,6 +576,8 @@ class DataTable(object):
 
   def NumberOfRows(self):
     """Returns the number of rows in the current data stored in the table."""
+    if self.__column_data is not None:
+      return self.__column_rows
     return len(self.__data)
 
   def SetRowsCustomProperties(self, rows, custom_properties):
@@ -520,6 +591,7 @@ class DataTable(object):
       custom_properties: A string to string dictionary of custom properties to
       set for all rows.
     """
+    self._MaterializeColumns()
     if not hasattr(rows, "__iter__"):
       rows = [rows]
     for row in rows:
@@ -538,8 +610,66 @@ class DataTable(object):
                          properties for all rows.
     """
     self.__data = []
+    self.__column_data = None
     self.AppendData(data, custom_properties)
 
+  def LoadColumns(self, columns):
+    """Loads new rows to the data table from columns of values.
+
+    Clears existing rows. This is a faster alternative to LoadData for large
+    tables: number, date and datetime columns given as numpy arrays are
+    encoded in bulk by ToJSon() and ToJSonResponse() rather than cell by
+    cell. Other output methods convert the columns to rows first.
+
+    Args:
+      columns: A dictionary from column ID to a sequence of the column's
+               values, such as a numpy array. All sequences must have the
+               same length. Columns of the table not given are null. The
+               values of date and datetime columns can be datetime objects,
+               or seconds since the epoch which are converted to local time.
+
+    Raises:
+      DataTableException: The table schema is not flat, a column is not in
+                          the schema, or the columns differ in length.
+    """
+    if self.__columns[-1]["depth"]:
+      raise DataTableException("Columns can only be loaded to a flat table")
+    col_ids = set(col["id"] for col in self.__columns)
+    lengths = set()
+    for col_id, values in columns.iteritems():
+      if col_id not in col_ids:
+        raise DataTableException("Column %s is not in the table" % col_id)
+      lengths.add(len(values))
+    if len(lengths) > 1:
+      raise DataTableException("The columns differ in length")
+
+    self.__data = []
+    self.__column_data = dict(columns)
+    self.__column_rows = lengths.pop() if lengths else 0
+
+  def _MaterializeColumns(self):
+    """Converts data loaded by LoadColumns to rows."""
+    if self.__column_data is None:
+      return
+    col_values = []
+    for col in self.__columns:
+      values = self.__column_data.get(col["id"])
+      if values is None:
+        continue
+      if isinstance(values, numpy.ndarray):
+        if (col["type"] in ("date", "datetime") and
+            values.dtype.kind in "iuf"):
+          values = [datetime.datetime.fromtimestamp(value)
+                    for value in values.tolist()]
+        else:
+          values = values.tolist()
+      col_values.append((col["id"], values))
+    self.__data = [({}, None) for _ in xrange(self.__column_rows)]
+    for col_id, values in col_values:
+      for (row, _), value in zip(self.__data, values):
+        row[col_id] = value
+    self.__column_data = None
+
   def AppendData(self, data, custom_properties=None):
     """Appends new data to the table.
 
@@ -557,6 +687,7 @@ class DataTable(object):
     Raises:
       DataTableException: The data structure does not match the description.
     """
+    self._MaterializeColumns()
     # If the maximal depth is 0, we simply iterate over the data table
     # lines and insert them using _InnerAppendData. Otherwise, we simply
     # let the _InnerAppendData handle all the levels.
@@ -635,6 +766,7 @@ class DataTable(object):
     Raises:
       DataTableException: Sort direction not in 'asc' or 'desc'
     """
+    self._MaterializeColumns()
     if not order_by:
       return self.__data
 
@@ -653,15 +785,12 @@ class DataTable(object):
         raise DataTableException("Expected tuple with second value: "
                                  "'asc' or 'desc'")
 
-    def SortCmpFunc(row1, row2):
-      """cmp function for sorted. Compares by keys and 'asc'/'desc' keywords."""
-      for key, asc_mult in proper_sort_keys:
-        cmp_result = asc_mult * cmp(row1[0].get(key), row2[0].get(key))
-        if cmp_result:
-          return cmp_result
-      return 0
-
-    return sorted(self.__data, cmp=SortCmpFunc)
+    # Stable sorts by each key, the last key first, give the order of sorting
+    # by all the keys at once.
+    data = list(self.__data)
+    for key, asc_mult in reversed(proper_sort_keys):
+      data.sort(key=lambda row: row[0].get(key), reverse=asc_mult < 0)
+    return data
 
   def ToJSCode(self, name, columns_order=None, order_by=()):
     """Writes the data table as a JS code string.
@@ -724,7 +853,7 @@ class DataTable(object):
       if col_dict[col]["custom_properties"]:
         jscode += "%s.setColumnProperties(%d, %s);\n" % (
             name, i, encoder.encode(col_dict[col]["custom_properties"]))
-    jscode += "%s.addRows(%d);\n" % (name, len(self.__data))
+    jscode += "%s.addRows(%d);\n" % (name, self.NumberOfRows())
 
     # We now go over the data and add each row
     for (i, (row, cp)) in enumerate(self._PreparedData(order_by)):
@@ -885,7 +1014,7 @@ class DataTable(object):
     return (self.ToCsv(columns_order, order_by, separator="\t")
             .decode("utf-8").encode("UTF-16LE"))
 
-  def _ToJSonObj(self, columns_order=None, order_by=()):
+  def _ToJSonObj(self, columns_order=None, order_by=(), rows=True):
     """Returns an object suitable to be converted to JSON.
 
     Args:
@@ -894,6 +1023,7 @@ class DataTable(object):
                      all column IDs must be present.
       order_by: Optional. Specifies the name of the column(s) to sort by.
                 Passed as is to _PreparedData().
+      rows: Optional. If False, the rows are left empty.
 
     Returns:
       A dictionary object for use by ToJSon or ToJSonResponse.
@@ -914,7 +1044,7 @@ class DataTable(object):
 
     # Creating the rows jsons
     row_objs = []
-    for row, cp in self._PreparedData(order_by):
+    for row, cp in (self._PreparedData(order_by) if rows else []):
       cell_objs = []
       for col in columns_order:
         value = self.CoerceValue(row.get(col, None), col_dict[col]["type"])
@@ -940,6 +1070,82 @@ class DataTable(object):
 
     return json_obj
 
+  def ToJSonRows(self, columns_order=None):
+    """Returns the JSON of each row, as written by ToJSon().
+
+    Args:
+      columns_order: Optional. Specifies the order of columns, as in ToJSon().
+
+    Returns:
+      A list of the JSON strings of the rows.
+    """
+    if columns_order is None:
+      columns_order = [col["id"] for col in self.__columns]
+    if self.__column_data is None:
+      encoder = DataTableJSONEncoder()
+      return [encoder.encode(row_obj).encode("utf-8") for row_obj in
+              self._ToJSonObj(columns_order)["rows"]]
+
+    col_dict = dict([(col["id"], col) for col in self.__columns])
+    cells = [self._ColumnJSonCells(self.__column_data.get(col),
+                                   col_dict[col]["type"])
+             for col in columns_order]
+    return ['{"c":[%s]}' % ",".join(row_cells) for row_cells in zip(*cells)]
+
+  def _ColumnJSonCells(self, values, value_type):
+    """Returns the JSON of the cells of a column loaded by LoadColumns."""
+    if values is None:
+      return ["null"] * self.__column_rows
+
+    if isinstance(values, numpy.ndarray):
+      kind = values.dtype.kind
+      if value_type == "number" and kind in "iu":
+        return ['{"v":%s}' % value for value in map(str, values.tolist())]
+      if value_type == "number" and kind == "f":
+        cells = ['{"v":%s}' % value for value in map(repr, values.tolist())]
+        # NaN and infinities are encoded as the encoder does.
+        encoder = DataTableJSONEncoder()
+        for i in numpy.flatnonzero(~numpy.isfinite(values)).tolist():
+          cells[i] = encoder.encode({"v": float(values[i])})
+        return cells
+      if value_type in ("date", "datetime") and kind in "iuf":
+        fields = numpy.column_stack(LocalTimeFields(values))
+        fields[:, 1] -= 1  # Months count from 0 in JS
+        if value_type == "date":
+          return ['{"v":"Date(%d,%d,%d)"}' % tuple(date)
+                  for date in fields[:, :3].tolist()]
+        return ['{"v":"Date(%d,%d,%d,%d,%d,%d)"}' % tuple(date)
+                for date in fields.tolist()]
+      values = values.tolist()
+
+    # Any other column is encoded cell by cell, as by _ToJSonObj.
+    encoder = DataTableJSONEncoder()
+    if value_type in ("date", "datetime"):
+      values = [datetime.datetime.fromtimestamp(value)
+                if isinstance(value, (int, long, float)) else value
+                for value in values]
+    cells = []
+    for value in values:
+      value = self.CoerceValue(value, value_type)
+      if value is None:
+        cell_obj = None
+      elif isinstance(value, tuple):
+        cell_obj = {"v": value[0]}
+        if len(value) > 1 and value[1] is not None:
+          cell_obj["f"] = value[1]
+        if len(value) == 3:
+          cell_obj["p"] = value[2]
+      else:
+        cell_obj = {"v": value}
+      cells.append(encoder.encode(cell_obj).encode("utf-8"))
+    return cells
+
+  def _InsertJSonRows(self, json_str, columns_order):
+    """Inserts the rows of columns loaded by LoadColumns in encoded JSON."""
+    return json_str.encode("utf-8").replace(
+        '"rows":[]', '"rows":[%s]' % ",".join(self.ToJSonRows(columns_order)),
+        1)
+
   def ToJSon(self, columns_order=None, order_by=()):
     """Returns a string that can be used in a JS DataTable constructor.
 
@@ -979,6 +1185,10 @@ class DataTable(object):
     """
 
     encoder = DataTableJSONEncoder()
+    if self.__column_data is not None and not order_by:
+      return self._InsertJSonRows(
+          encoder.encode(self._ToJSonObj(columns_order, rows=False)),
+          columns_order)
     return encoder.encode(
         self._ToJSonObj(columns_order, order_by)).encode("utf-8")
 
@@ -1011,13 +1221,17 @@ class DataTable(object):
           Visualization Gadgets or from JS code.
     """
 
+    columnar = self.__column_data is not None and not order_by
     response_obj = {
         "version": "0.6",
         "reqId": str(req_id),
-        "table": self._ToJSonObj(columns_order, order_by),
+        "table": self._ToJSonObj(columns_order, order_by, rows=not columnar),
         "status": "ok"
     }
     encoder = DataTableJSONEncoder()
+    if columnar:
+      return "%s(%s);" % (response_handler, self._InsertJSonRows(
+          encoder.encode(response_obj), columns_order))
     return "%s(%s);" % (response_handler,
                         encoder.encode(response_obj).encode("utf-8"))
 
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+'''
+@brief Test the columnar loading and JSON encoding of Google datatables
+'''
+
+import os
+import time
+from datetime import datetime, date
+import numpy
+
+from pyon.public import log
+from pyon.util.unit_test import IonUnitTestCase
+from nose.plugins.attrib import attr
+
+import ion.services.ans.gviz_api as gviz_api
+from ion.processes.data.transforms.viz.test.helpers import make_records
+
+description = [('time', 'datetime', 'time'), ('day', 'date', 'day'), ('temperature', 'number', 'temperature'),
+               ('conductivity', 'number', 'conductivity'), ('pressure', 'number', 'pressure'),
+               ('salinity', 'number', 'salinity'), ('density', 'number', 'density'), ('count', 'number', 'count'),
+               ('quality', 'string', 'quality')]
+
+def make_columns(count):
+    # CTD like records, one per second from around a DST change, with a few gaps and columns of other types
+    columns = make_records(0, count, 1331445600.25)
+    t = columns['time']
+    columns.update({
+        'day': t,
+        'conductivity': 3.0 + numpy.cos(t / 30.0) / 10.0,
+        'salinity': 35.0 + numpy.sin(t / 11.0),
+        'density': 1025.0 + numpy.cos(t / 13.0),
+        'count': numpy.arange(count),
+        'quality': numpy.array(['good', 'bad', u'caf\xe9'] * (count // 3 + 1))[:count],
+    })
+    columns['pressure'][::97] = numpy.nan
+    columns['salinity'][5::101] = numpy.inf
+    return columns
+
+def make_rows(columns, table_description=description):
+    # The same records as rows, with datetime objects
+    rows = []
+    for i in xrange(len(columns['time'])):
+        row = []
+        for col, _, _ in table_description:
+            value = columns[col][i].tolist()
+            if col == 'time':
+                value = datetime.fromtimestamp(value)
+            elif col == 'day':
+                value = datetime.fromtimestamp(value).date()
+            row.append(value)
+        rows.append(row)
+    return rows
+
+
+@attr('UNIT', group='as')
+class TestGvizApi(IonUnitTestCase):
+
+    def test_local_time_fields(self):
+        tz = os.environ.get('TZ')
+        try:
+            for zone in ['UTC', 'America/New_York', 'Australia/Adelaide', 'Australia/Lord_Howe']:
+                os.environ['TZ'] = zone
+                time.tzset()
+
+                # Around a DST change, over a few centuries, and daily over 2012, which crosses two DST changes
+                # between endpoints with the same offset
+                timestamps = numpy.concatenate((numpy.arange(1331445600.0, 1331460000.0, 599.9999999),
+                                                numpy.linspace(-2e9, 4e9, 1000),
+                                                numpy.arange(1325419200.0, 1356955200.0, 86400.0)))
+                fields = numpy.column_stack(gviz_api.LocalTimeFields(timestamps)).tolist()
+                expected = [list(datetime.fromtimestamp(t).timetuple()[:6]) for t in timestamps.tolist()]
+                self.assertEqual(fields, expected)
+        finally:
+            if tz is None:
+                del os.environ['TZ']
+            else:
+                os.environ['TZ'] = tz
+            time.tzset()
+
+    def test_from_columns(self):
+        # The JSON of columns is the same as that of the rows
+        columns = make_columns(1024)
+        data_table = gviz_api.DataTable.FromColumns(description, columns)
+        expected = gviz_api.DataTable(description, make_rows(columns))
+
+        self.assertEqual(data_table.NumberOfRows(), 1024)
+        self.assertEqual(data_table.ToJSon(), expected.ToJSon())
+        self.assertEqual(data_table.ToJSonResponse(req_id=3), expected.ToJSonResponse(req_id=3))
+
+        columns_order = ['count', 'quality', 'temperature', 'time', 'day', 'pressure', 'salinity', 'density',
+                         'conductivity']
+        self.assertEqual(data_table.ToJSon(columns_order=columns_order), expected.ToJSon(columns_order=columns_order))
+
+        # Missing columns are null, datetimes are taken as they are
+        rows = make_rows(make_columns(10))
+        data_table = gviz_api.DataTable.FromColumns(description, {'time': [row[0] for row in rows],
+                                                                  'count': numpy.arange(10)})
+        expected = gviz_api.DataTable(description, [[row[0]] + [None] * 6 + [i] for i, row in enumerate(rows)])
+        self.assertEqual(data_table.ToJSonResponse(), expected.ToJSonResponse())
+
+        self.assertEqual(gviz_api.DataTable.FromColumns(description, {}).ToJSon(),
+                         gviz_api.DataTable(description).ToJSon())
+
+        self.assertRaises(gviz_api.DataTableException, data_table.LoadColumns, {'bogus': [1]})
+        self.assertRaises(gviz_api.DataTableException, data_table.LoadColumns, {'time': [1, 2], 'count': [1]})
+        self.assertRaises(gviz_api.DataTableException, gviz_api.DataTable.FromColumns,
+                          {('a', 'number'): [('b', 'number')]}, {})
+
+    def test_order_by(self):
+        # Sorting and other output of columns go through the rows
+        columns = make_columns(300)
+        columns['count'] = numpy.arange(300) % 7
+        data_table = gviz_api.DataTable.FromColumns(description, columns)
+        expected = gviz_api.DataTable(description, make_rows(columns))
+
+        for order_by in ['count', ('count', 'desc'), [('quality', 'desc'), 'temperature'], ['count', ('time', 'desc')]]:
+            self.assertEqual(data_table.ToJSon(order_by=order_by), expected.ToJSon(order_by=order_by))
+        self.assertEqual(data_table.ToCsv(), expected.ToCsv())
+        self.assertEqual(data_table.ToJSCode('dt'), expected.ToJSCode('dt'))
+
+        data_table.AppendData(make_rows(make_columns(5)))
+        self.assertEqual(data_table.NumberOfRows(), 305)
+
+    def test_benchmark(self):
+        # Cost of the JSON response of a historical datatable of 1024 rows, logged rather than checked
+        count = 20
+        columns = make_columns(1024)
+        del columns['day'], columns['quality']
+        table_description = [col for col in description if col[0] in columns]
+
+        start = time.time()
+        for i in xrange(count):
+            data_table = gviz_api.DataTable(table_description)
+            data_table.LoadData(make_rows(columns, table_description))
+            data_table.ToJSonResponse()
+        rows_time = (time.time() - start) / count
+
+        start = time.time()
+        for i in xrange(count):
+            response = gviz_api.DataTable.FromColumns(table_description, columns).ToJSonResponse()
+        columns_time = (time.time() - start) / count
+
+        log.info('Datatable of 1024 rows: %f ms from rows, %f ms from columns' % (rows_time * 1000, columns_time * 1000))
+        self.assertEqual(response, data_table.ToJSonResponse())
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+'''
+@brief Test the size bounded cache of the visualization service
+'''
+
+import os
+import time
+
+from pyon.public import log
+from pyon.util.unit_test import IonUnitTestCase
+from nose.plugins.attrib import attr
+
+from ion.services.ans.viz_cache import VizCache
+
+
+@attr('UNIT', group='as')
+class TestVizCache(IonUnitTestCase):
+
+    def test_lru(self):
+        cache = VizCache(max_bytes=300)
+        for i in xrange(3):
+            cache.put(('matplotlib_graphs', 'dp', 'image%d.png' % i), 'x' * 100)
+        self.assertEqual(cache.bytes_held, 300)
+
+        # The least recently used image is evicted
+        self.assertEqual(cache.get(('matplotlib_graphs', 'dp', 'image0.png')), 'x' * 100)
+        cache.put(('google_realtime_dt', 'dp'), 'y' * 100)
+        self.assertFalse(('matplotlib_graphs', 'dp', 'image1.png') in cache)
+        self.assertTrue(('matplotlib_graphs', 'dp', 'image0.png') in cache)
+        self.assertEqual(cache.get(('matplotlib_graphs', 'dp', 'image1.png')), None)
+
+        # Replacing an entry replaces its size, an entry larger than the cache is kept on its own
+        cache.put(('google_realtime_dt', 'dp'), 'y' * 50)
+        self.assertEqual(cache.bytes_held, 250)
+        cache.put(('google_realtime_dt', 'dp'), 'y' * 1000)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.bytes_held, 1000)
+
+        cache.delete(('google_realtime_dt', 'dp'))
+        self.assertEqual(cache.bytes_held, 0)
+
+        metrics = cache.get_metrics()
+        self.assertEqual(metrics['hits'], 1)
+        self.assertEqual(metrics['misses'], 1)
+        self.assertEqual(metrics['hit_rate'], 0.5)
+        self.assertEqual(metrics['evictions'], 3)
+
+    def test_pinned(self):
+        # A pinned entry is held until deleted and does not count towards the bound
+        cache = VizCache(max_bytes=200)
+        cache.put(('google_dt', 'token'), 'z' * 1000, pinned=True)
+        for i in xrange(3):
+            cache.put(('matplotlib_graphs', 'dp', 'image%d.png' % i), 'x' * 100)
+
+        self.assertTrue(('google_dt', 'token') in cache)
+        self.assertFalse(('matplotlib_graphs', 'dp', 'image0.png') in cache)
+        self.assertEqual((cache.bytes_held, cache.bytes_pinned), (200, 1000))
+
+        self.assertEqual(cache.get(('google_dt', 'token')), 'z' * 1000)
+        cache.put(('matplotlib_graphs', 'dp', 'image3.png'), 'x' * 100)
+        self.assertTrue(('google_dt', 'token') in cache)
+        self.assertEqual(len(cache), 3)
+
+        cache.delete(('google_dt', 'token'))
+        self.assertEqual((cache.bytes_held, cache.bytes_pinned), (200, 0))
+        self.assertEqual(cache.get_metrics()['evictions'], 2)
+
+    def test_etag(self):
+        cache = VizCache()
+        entry = cache.put('a', 'png data')
+        etag, last_modified = cache.get_info('a')
+        self.assertEqual(etag, entry.etag)
+
+        # The last modified time only changes with the value
+        time.sleep(0.01)
+        cache.put('a', 'png data')
+        self.assertEqual(cache.get_info('a'), (etag, last_modified))
+        cache.put('a', 'new png data')
+        self.assertNotEqual(cache.get_info('a')[0], etag)
+        self.assertTrue(cache.get_info('a')[1] > last_modified)
+        self.assertEqual(cache.get_info('b'), None)
+
+    def test_spill(self):
+        cache = VizCache(max_bytes=300, spill=True, max_spill_bytes=200)
+        for i in xrange(5):
+            cache.put(i, str(i) * 100)
+
+        # The evicted entries are spilled, the oldest spilled ones are removed
+        self.assertEqual(sorted(cache.entries.keys()), [2, 3, 4])
+        self.assertEqual(sorted(cache.spilled.keys()), [0, 1])
+        self.assertEqual(cache.bytes_spilled, 200)
+        filename = cache.spilled[0].filename
+        self.assertTrue(os.path.exists(filename))
+
+        # Spilled entries are read back on their next use, and their ETag is kept
+        etag = cache.get_info(0)[0]
+        self.assertEqual(cache.get(0), '0' * 100)
+        self.assertEqual(cache.get_info(0)[0], etag)
+        self.assertFalse(os.path.exists(filename))
+        self.assertEqual(sorted(cache.entries.keys()), [0, 3, 4])
+        self.assertEqual(sorted(cache.spilled.keys()), [1, 2])
+
+        cache.put(5, '5' * 100)
+        self.assertEqual(sorted(cache.spilled.keys()), [2, 3])
+        self.assertEqual(cache.get_metrics()['bytes_spilled'], 200)
+
+        filenames = [entry.filename for entry in cache.spilled.values()]
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.bytes_spilled, 0)
+        self.assertFalse(any(os.path.exists(filename) for filename in filenames))
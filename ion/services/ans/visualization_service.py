@@ -9,7 +9,7 @@ __license__ = 'Apache 2.0'
 Note:
 [1] Currently for th case of replay data, the transform processes created libger on and need to be cleaned up.
 [2] Also need to clean up the storage used by the data tables in the case of replay. After they have been fetched by the
-    UI, the viz_data_dictionary should be cleaned up.
+    UI, the viz_data_dictionary and viz_cache should be cleaned up.
 """
 
 # Pyon imports
@@ -28,6 +28,7 @@ import random
 import StringIO
 import simplejson
 import math
+import numpy
 import gevent
 from gevent.greenlet import Greenlet
 
@@ -35,6 +36,7 @@ from interface.services.ans.ivisualization_service import BaseVisualizationServi
 from interface.services.dm.idata_retriever_service import DataRetrieverServiceClient
 from interface.services.dm.idataset_management_service import DatasetManagementServiceClient
 from pyon.event.event import EventSubscriber
+from pyon.datastore.datastore import DataStore
 from pyon.util.async import spawn
 #from interface.objects import ResourceModificationType
 from prototype.sci_data.stream_parser import PointSupplementStreamParser
@@ -49,21 +51,33 @@ from matplotlib.figure import Figure
 
 # Google viz library for google charts
 import ion.services.ans.gviz_api as gviz_api
+from ion.services.ans.viz_cache import VizCache, DEFAULT_MAX_BYTES, DEFAULT_MAX_SPILL_BYTES
+from collections import OrderedDict
+from ion.processes.data.transforms.viz.google_dt import RealtimeDataTable, mr_tree_data_table
+from ion.processes.data.transforms.viz.data_averager import MultiResolutionTree, MR_TREE_DATASTORE_NAME
+from ion.processes.data.transforms.viz.matplotlib_graphs import GraphHistory, GraphRenderer
 
 class VisualizationService(BaseVisualizationService):
 
     def on_start(self):
 
-        # The data dictionary object holds a copy of all the viz products created by the service. The viz
-        # products are indexed by the viz_product_type and data_product_id (which could be google_datatables or
-        # mpl_graphs
+        # The data dictionary object holds the transform processes and the image names of the viz products created
+        # by the service. The viz products are indexed by the viz_product_type and data_product_id (which could be
+        # google_datatables or mpl_graphs
         self.viz_data_dictionary = {}
         self.viz_data_dictionary['google_dt'] = {}
         self.viz_data_dictionary['google_realtime_dt'] = {}
         self.viz_data_dictionary['matplotlib_graphs'] = {}
+        self.viz_data_dictionary['mr_tree'] = {}
         # Kind of redundant but we will maintain a separate list of data product_ids registered with the viz_service
         self.data_products = []
 
+        # The viz products themselves (images and datatables) are held in a size bounded LRU cache, keyed by
+        # (viz_product_type, data_product_id[, image_name]). Evicted products are optionally spilled under FS.CACHE
+        self.viz_cache = VizCache(max_bytes=self.CFG.get_safe('process.viz_cache_max_bytes', DEFAULT_MAX_BYTES),
+                                  spill=self.CFG.get_safe('process.viz_cache_spill', False),
+                                  max_spill_bytes=self.CFG.get_safe('process.viz_cache_max_spill_bytes', DEFAULT_MAX_SPILL_BYTES))
+
         # Create clients to interface with PubSub, Transform Management Service and Resource Registry
         self.pubsub_cli = self.clients.pubsub_management
         self.tms_cli = self.clients.transform_management
@@ -95,6 +109,16 @@ class VisualizationService(BaseVisualizationService):
         proc_def_ids,_ = self.rr_cli.find_resources(restype=RT.ProcessDefinition, lcstate=None, name="viz_google_dt_transform_process", id_only=True)
         self.google_dt_proc_def_id = proc_def_ids[0]
 
+        proc_def_ids,_ = self.rr_cli.find_resources(restype=RT.ProcessDefinition, lcstate=None, name="viz_data_averager_transform_process", id_only=True)
+        self.data_averager_proc_def_id = proc_def_ids[0]
+
+        # The data averager transforms persist the multi-resolution trees of the data products here. A tree only
+        # holds the records published while its averager runs, so the historical datatables are only read from the
+        # trees if configured, for deployments where the averagers run with the ingestion
+        self.mr_tree_db = self.container.datastore_manager.get_datastore(ds_name=MR_TREE_DATASTORE_NAME, profile=DataStore.DS_PROFILE.SCIDATA)
+        self.google_dt_from_mr_tree = self.CFG.get_safe('process.google_dt_from_mr_tree', False)
+        self.max_google_dt_len = self.CFG.get_safe('process.max_google_dt_len', 1024)
+
         # Create a stream that all the transform processes will use to submit data back to the viz service
         self.viz_service_submit_stream_id = self.pubsub_cli.create_stream(name="visualization_service_submit_stream." + self.random_id_generator())
 
@@ -130,6 +154,9 @@ class VisualizationService(BaseVisualizationService):
     def on_stop(self):
         self.event_subscriber.deactivate()
 
+        log.info('Visualization service cache: %s', self.viz_cache.get_metrics())
+        self.viz_cache.clear()
+
         super(VisualizationService, self).on_stop()
         return
 
@@ -166,6 +193,13 @@ class VisualizationService(BaseVisualizationService):
         if dp_obj.dataset_id == '':
             return None
 
+        # If the multi-resolution tree of the data product covers its dataset the datatable is read from it, with at
+        # most max_google_dt_len nodes, rather than replaying the dataset
+        result = self._read_mr_tree(data_product_id, dp_obj.dataset_id)
+        if result is not None:
+            self.viz_data_dictionary['google_dt'][data_product_id_token] = {'ready_flag': False, 'transform_proc': ''}
+            self.submit_google_dt(data_product_id_token, mr_tree_data_table(result).ToJSonResponse())
+            return "google_dt_transform_cb(\"" + data_product_id_token + "\")"
 
         # define replay. If no filters are passed the entire ingested dataset is returned
         replay_id, replay_stream_id = self.dr_cli.define_replay(dataset_id=dp_obj.dataset_id)
@@ -174,7 +208,7 @@ class VisualizationService(BaseVisualizationService):
 
         # setup the transform to handle the data coming back from the replay
         # Init storage for the resulting data_table
-        self.viz_data_dictionary['google_dt'][data_product_id_token] = {'data_table': [], 'ready_flag': False}
+        self.viz_data_dictionary['google_dt'][data_product_id_token] = {'ready_flag': False}
 
         # Create the subscription to the stream. This will be passed as parameter to the transform worker
         query = StreamQuery(stream_ids=[replay_stream_id,])
@@ -199,6 +233,36 @@ class VisualizationService(BaseVisualizationService):
 
         return "google_dt_transform_cb(\"" + data_product_id_token + "\")"
 
+    def _read_mr_tree(self, data_product_id, dataset_id):
+        """
+        Read the nodes of a historical datatable from the multi-resolution tree of a data product, if configured and
+        the tree holds every record of the dataset. Short datasets are replayed rather than read as level 1 means.
+
+        @retval the result of MultiResolutionTree.query, None if the dataset is to be replayed
+        """
+        if not self.google_dt_from_mr_tree:
+            return None
+
+        mr_tree = MultiResolutionTree(self.mr_tree_db, data_product_id)
+        if not mr_tree.load():
+            return None
+
+        extent = mr_tree.get_extent()
+        if extent is None or extent[2] <= self.max_google_dt_len:
+            return None
+
+        # The averager may have been started after the first records of the dataset or be behind the ingestion
+        try:
+            time_bounds = self.dsm_cli.get_dataset_bounds(dataset_id=dataset_id).get('time_bounds')
+        except Exception as ex:
+            log.warn('Visualization service: could not read the bounds of dataset %s: %s', dataset_id, ex)
+            return None
+
+        if not time_bounds or extent[0] > time_bounds[0] or extent[1] < time_bounds[1]:
+            return None
+
+        return mr_tree.query(max_points=self.max_google_dt_len)
+
 
     def is_google_dt_ready(self, data_product_id_token=''):
         try:
@@ -213,7 +277,14 @@ class VisualizationService(BaseVisualizationService):
         except AttributeError:
             return None
 
-    def get_google_dt(self, data_product_id_token=''):
+    def get_google_dt(self, data_product_id_token='', if_none_match='', if_modified_since=0):
+        """Request to fetch the datatable of a replay started by start_google_dt_transform
+
+        @param data_product_id_token    str
+        @param if_none_match    str, the ETag of the client's copy, see _get_viz_product
+        @param if_modified_since    float, the time the client's copy was last modified, see _get_viz_product
+        @retval datatable    str
+        """
 
         try:
             # check if token is valid
@@ -223,10 +294,14 @@ class VisualizationService(BaseVisualizationService):
                     return None
                 else:
                     # Make a reference to the data_table and clean space in global dict
-                    data_table = self.viz_data_dictionary['google_dt'][data_product_id_token]['data_table']
-                    # clean up the transform and space in global dict
-                    self.tms_cli.deactivate_transform(self.viz_data_dictionary['google_dt'][data_product_id_token]['transform_proc'])
+                    key = ('google_dt', data_product_id_token)
+                    data_table = self._get_viz_product(key, if_none_match, if_modified_since)
+                    # clean up the transform, if the datatable was not read from a multi-resolution tree, and space in
+                    # global dict
+                    if self.viz_data_dictionary['google_dt'][data_product_id_token]['transform_proc']:
+                        self.tms_cli.deactivate_transform(self.viz_data_dictionary['google_dt'][data_product_id_token]['transform_proc'])
                     del self.viz_data_dictionary['google_dt'][data_product_id_token]
+                    self.viz_cache.delete(key)
 
                     # returning the reference to the data_table should mark the objects used by this tranform as ready
                     # for deletion
@@ -238,11 +313,13 @@ class VisualizationService(BaseVisualizationService):
         except AttributeError:
             return None
 
-    def get_google_realtime_dt(self, data_product_id='', query=''):
+    def get_google_realtime_dt(self, data_product_id='', query='', if_none_match='', if_modified_since=0):
         """Request to fetch the datatable for a data product as specified in the query. Query will also specify whether its a realtime view or one-shot
 
         @param data_product_id    str
         @param query    str
+        @param if_none_match    str, the ETag of the client's copy, see _get_viz_product
+        @param if_modified_since    float, the time the client's copy was last modified, see _get_viz_product
         @retval datatable    str
         @throws NotFound    object with specified id, query does not exist
         """
@@ -251,7 +328,7 @@ class VisualizationService(BaseVisualizationService):
             if data_product_id in self.viz_data_dictionary['google_realtime_dt']:
                 # assign data_table to a temp var before returning it. This will ensure a complete object is returned
                 # in case the data_table is being updated by a transform process
-                data_table = self.viz_data_dictionary['google_realtime_dt'][data_product_id]['data_table']
+                data_table = self._get_viz_product(('google_realtime_dt', data_product_id), if_none_match, if_modified_since)
                 return data_table
             else:
                 return None
@@ -271,7 +348,8 @@ class VisualizationService(BaseVisualizationService):
         try:
             if data_product_id in self.viz_data_dictionary['matplotlib_graphs']:
                 # assign data_table to a temp var before returning it. This will ensure a complete object is returned
-                img_list = self.viz_data_dictionary['matplotlib_graphs'][data_product_id]['list_of_images']
+                img_list = [image_name for image_name in self.viz_data_dictionary['matplotlib_graphs'][data_product_id]['images']
+                            if ('matplotlib_graphs', data_product_id, image_name) in self.viz_cache]
                 json_img_list = simplejson.dumps({'data': img_list})
                 return "image_list_callback("+json_img_list+")"
             else:
@@ -280,26 +358,50 @@ class VisualizationService(BaseVisualizationService):
         except AttributeError:
             return None
 
-    def get_image(self, data_product_id = '', image_name=''):
+    def get_image(self, data_product_id = '', image_name='', if_none_match='', if_modified_since=0):
         """Request to fetch a file object from within the Visualization Service
 
         @param file_name    str
+        @param if_none_match    str, the ETag of the client's copy, see _get_viz_product
+        @param if_modified_since    float, the time the client's copy was last modified, see _get_viz_product
         @retval file_obj    str
         @throws NotFound    object with specified id does not exist
         """
         try:
             if data_product_id in self.viz_data_dictionary['matplotlib_graphs']:
-                if image_name in self.viz_data_dictionary['matplotlib_graphs'][data_product_id]:
-                    img = self.viz_data_dictionary['matplotlib_graphs'][data_product_id][image_name]
-                    return img
-                else:
-                    return None
+                return self._get_viz_product(('matplotlib_graphs', data_product_id, image_name), if_none_match, if_modified_since)
             else:
                 return None
 
         except AttributeError:
             return None
 
+    def _get_viz_product(self, key, if_none_match='', if_modified_since=0):
+        """Fetch a viz product from the cache. If the client's copy is current, as told by its ETag or last modified
+        time, an empty string is returned without reading the product back
+
+        @param key    tuple, (viz_product_type, data_product_id[, image_name])
+        @param if_none_match    str, the ETag of the client's copy
+        @param if_modified_since    float, the time the client's copy was last modified, in seconds since the epoch
+        @retval viz_product    str, None if not in the cache
+        """
+        info = self.viz_cache.get_info(key)
+        if info is None:
+            return None
+
+        etag, last_modified = info
+        if (if_none_match and if_none_match == etag) or (if_modified_since and last_modified <= if_modified_since):
+            return ''
+
+        return self.viz_cache.get(key)
+
+    def get_viz_cache_metrics(self):
+        """Hit rate and bytes held by the cache of viz products
+
+        @retval metrics    dict, see VizCache.get_metrics
+        """
+        return self.viz_cache.get_metrics()
+
 
     def submit_google_dt(self, data_product_id_token='', data_table=''):
         """Send the rendered image to
@@ -311,8 +413,8 @@ class VisualizationService(BaseVisualizationService):
 
         """
 
-        # Just copy the datatable in to the data dictionary
-        self.viz_data_dictionary['google_dt'][data_product_id_token]['data_table'] = data_table
+        # Just copy the datatable in to the cache. It is held until fetched by get_google_dt
+        self.viz_cache.put(('google_dt', data_product_id_token), data_table, pinned=True)
         self.viz_data_dictionary['google_dt'][data_product_id_token]['ready_flag'] = True
 
         #self.result.set(True)
@@ -329,8 +431,8 @@ class VisualizationService(BaseVisualizationService):
 
         """
 
-        # Just copy the datatable in to the data dictionary
-        self.viz_data_dictionary['google_realtime_dt'][data_product_id]['data_table'] = data_table
+        # Just copy the datatable in to the cache
+        self.viz_cache.put(('google_realtime_dt', data_product_id), data_table)
 
         return
 
@@ -343,21 +445,13 @@ class VisualizationService(BaseVisualizationService):
         @throws BadRequest    check data_product_id
         """
 
-        # Store the image object in the data dictionary and note the image in the list.
-
-        # Check for existing entries before updating the list_of_images
-        found = False
-        for name in self.viz_data_dictionary['matplotlib_graphs'][data_product_id]['list_of_images']:
-            if name == image_name:
-                found = True
-                break
+        # Note the image in the data dictionary, in the order the images were first submitted
+        images = self.viz_data_dictionary['matplotlib_graphs'][data_product_id]['images']
+        if image_name not in images:
+            images[image_name] = None
 
-        if not found:
-            list_len = len(self.viz_data_dictionary['matplotlib_graphs'][data_product_id]['list_of_images'])
-            self.viz_data_dictionary['matplotlib_graphs'][data_product_id]['list_of_images'].append(image_name)
-
-        # Add binary data from the image to the dictionary
-        self.viz_data_dictionary['matplotlib_graphs'][data_product_id][image_name] = image_obj
+        # Add binary data from the image to the cache
+        self.viz_cache.put(('matplotlib_graphs', data_product_id, image_name), image_obj)
 
         return
 
@@ -392,12 +486,12 @@ class VisualizationService(BaseVisualizationService):
 
         # init the space needed to store matplotlib_graphs and realtime Google data tables
 
-        # For the matplotlib graphs, the list_of_images stores the names of the image files. The actual binary data for the
-        # images is also stored in the same dictionary as {img_name1: binary_data1, img_name2: binary_data2 .. etc}
-        self.viz_data_dictionary['matplotlib_graphs'][data_product_id] = {'transform_proc': "", 'list_of_images': []}
+        # For the matplotlib graphs, the images ordered dict holds the names of the image files. The actual binary data
+        # for the images is stored in the cache
+        self.viz_data_dictionary['matplotlib_graphs'][data_product_id] = {'transform_proc': "", 'images': OrderedDict()}
 
-        # The 'data_table' key points to a JSON string
-        self.viz_data_dictionary['google_realtime_dt'][data_product_id] = {'transform_proc': "", 'data_table': []}
+        # The JSON string of the data table is stored in the cache
+        self.viz_data_dictionary['google_realtime_dt'][data_product_id] = {'transform_proc': ""}
 
         ###############################################################################
         # Create transform process for the matplotlib graphs.
@@ -448,6 +542,32 @@ class VisualizationService(BaseVisualizationService):
         self.viz_data_dictionary['google_realtime_dt'][data_product_id]['transform_proc'] = viz_transform_id2
 
 
+        ###############################################################################
+        # Create transform process for the multi-resolution tree read by the historical Google datatables
+        ###############################################################################
+
+        # The averager is the only writer of the tree, the one started for the data product by an earlier instance of
+        # the service is stopped first
+        averager_name = 'viz_transform_data_averager.' + data_product_id
+        old_transform_ids,_ = self.rr_cli.find_resources(restype=RT.Transform, lcstate=None, name=averager_name, id_only=True)
+        for old_transform_id in old_transform_ids:
+            self.tms_cli.delete_transform(old_transform_id)
+
+        query3 = StreamQuery(viz_stream_id)
+        viz_subscription_id3 = self.pubsub_cli.create_subscription(query=query3, exchange_name='viz_data_exchange.'+self.random_id_generator())
+
+        configuration3 = {"stream_def_id": viz_stream_def_id, "data_product_id": data_product_id}
+
+        viz_transform_id3 = self.tms_cli.create_transform( name=averager_name,
+            in_subscription_id=viz_subscription_id3,
+            process_definition_id=self.data_averager_proc_def_id,
+            configuration=configuration3)
+        self.tms_cli.activate_transform(viz_transform_id3)
+
+        # keep a record of the the viz_transform_id
+        self.viz_data_dictionary['mr_tree'][data_product_id] = {'transform_proc': viz_transform_id3}
+
+
     def random_id_generator(self, size=8, chars=string.ascii_uppercase + string.digits):
         id = ''.join(random.choice(chars) for x in range(size))
         return id
@@ -493,13 +613,17 @@ class VizTransformProcForGoogleDT(TransformDataProcess):
         else:
             self.data_product_id_token = self.CFG.get('data_product_id_token')
 
+        # Number of the latest records in the realtime datatable
+        self.realtime_window_size = self.CFG.get('realtime_window_size', 100)
+        self.realtime_data_table = None
+
 
         # extract the stream_id associated with the DP. Needed later
         stream_ids,_ = self.rr_cli.find_objects(self.data_product_id, PRED.hasStream, None, True)
         self.stream_id = stream_ids[0]
 
         self.dataDescription = []
-        self.dataTableContent = []
+        self.dataTableContent = {}
         self.varTuple = []
         self.total_num_of_records_recvd = 0
 
@@ -533,28 +657,17 @@ class VizTransformProcForGoogleDT(TransformDataProcess):
 
             self.initDataTableFlag = False
 
+            if self.realtime_flag:
+                self.realtime_data_table = RealtimeDataTable(self.dataDescription, self.realtime_window_size)
 
-        # Add the records to the datatable
-        for i in xrange(arrLen):
-            varTuple = []
 
+        if self.realtime_flag:
+            # Maintain a sliding window for realtime transform processes. Only the new records are encoded
+            self.realtime_data_table.append(vardict)
+        else:
+            # Add the records to the columns of the datatable, the time is kept in seconds since the epoch
             for varname,_,_ in self.dataDescription:
-                val = float(vardict[varname][i])
-                if varname == 'time':
-                    varTuple.append(datetime.fromtimestamp(val))
-                else:
-                    varTuple.append(val)
-
-            # Append the tuples to the data table
-            self.dataTableContent.append (varTuple)
-
-            if self.realtime_flag:
-                # Maintain a sliding window for realtime transform processes
-                realtime_window_size = 100
-                if len(self.dataTableContent) > realtime_window_size:
-                    # always pop the first element till window size is what we want
-                    while len(self.dataTableContent) > realtime_window_size:
-                        self.dataTableContent.pop(0)
+                self.dataTableContent.setdefault(varname, []).append(numpy.asarray(vardict[varname], dtype='float64'))
 
 
         if not self.realtime_flag:
@@ -570,35 +683,27 @@ class VizTransformProcForGoogleDT(TransformDataProcess):
 
         # submit the Json version of the datatable to the viz service
         if self.realtime_flag:
-        # create the google viz data table
-            data_table = gviz_api.DataTable(self.dataDescription)
-            data_table.LoadData(self.dataTableContent)
-
             # submit resulting table back using the out stream publisher
             msg = {"viz_product_type": "google_realtime_dt",
                    "data_product_id": self.data_product_id,
-                   "data_table": data_table.ToJSonResponse() }
+                   "data_table": self.realtime_data_table.to_json_response() }
             self.out_stream_pub.publish(msg)
         else:
             # Submit table back to the service if we received all the replay data
             if self.total_num_of_records_recvd == (expected_range[1] + 1):
-                # If the datatable received was too big, decimate on the fly to a fixed size
-                max_google_dt_len = 1024
-                if len(self.dataTableContent) > max_google_dt_len:
-                    decimation_factor = int(math.ceil(len(self.dataTableContent) / (max_google_dt_len)))
-
-                    tempDataTableContent = []
-                    for i in xrange(0, len(self.dataTableContent), decimation_factor):
-                        # check limits
-                        if i >= len(self.dataTableContent):
-                            break
+                columns = dict((varname, numpy.concatenate(chunks)) for varname, chunks in self.dataTableContent.iteritems())
+                num_of_records = len(columns['time'])
 
-                        tempDataTableContent.append(self.dataTableContent[i])
-
-                    self.dataTableContent = tempDataTableContent
+                # If the datatable received was too big, decimate on the fly to a fixed size. This is only done for
+                # the data products without a multi-resolution tree, see VisualizationService.start_google_dt_transform
+                max_google_dt_len = 1024
+                if num_of_records > max_google_dt_len:
+                    decimation_factor = int(math.ceil(num_of_records / (max_google_dt_len)))
+                    for varname in columns:
+                        columns[varname] = columns[varname][::decimation_factor]
 
-                data_table = gviz_api.DataTable(self.dataDescription)
-                data_table.LoadData(self.dataTableContent)
+                # The columns are encoded in bulk rather than row by row
+                data_table = gviz_api.DataTable.FromColumns(self.dataDescription, columns)
 
                 # submit resulting table back using the out stream publisher
                 msg = {"viz_product_type": "google_dt",
@@ -623,8 +728,11 @@ class VizTransformProcForMatplotlibGraphs(TransformDataProcess):
     def on_start(self):
         super(VizTransformProcForMatplotlibGraphs,self).on_start()
         #assert len(self.streams)==1
-        self.initDataFlag = True
-        self.graph_data = {} # Stores a dictionary of variables : [List of values]
+        # The latest records of each variable, and the renderer of their graphs. The graphs are rendered in a child
+        # process if configured, so the rendering does not hold up the other greenlets of the container
+        self.history = GraphHistory(self.CFG.get('graph_history_size', 10000))
+        self.renderer = GraphRenderer(out_of_process=self.CFG.get('render_out_of_process', False))
+        self.render_interval = self.CFG.get('render_interval', 20)
 
         # Need some clients
         self.rr_cli = ResourceRegistryServiceProcessClient(process = self, node = self.container.node)
@@ -660,82 +768,51 @@ class VizTransformProcForMatplotlibGraphs(TransformDataProcess):
 
         # re-arrange incoming data into an easy to parse dictionary
         vardict = {}
-        arrLen = None
         for varname in psd.list_field_names():
             vardict[varname] = psd.get_values(varname)
-            arrLen = len(vardict[varname])
-
-        if self.initDataFlag:
-            # look at the incoming packet and store
-            for varname in psd.list_field_names():
-                self.lock.acquire()
-                self.graph_data[varname] = []
-                self.lock.release()
-
-            self.initDataFlag = False
 
-        # If code reached here, the graph data storage has been initialized. Just add values
-        # to the list
+        # Add the values to the history, the oldest ones drop out once it is full
         with self.lock:
-            for varname in psd.list_field_names():
-                self.graph_data[varname].extend(vardict[varname])
+            self.history.append(vardict)
+
+    def on_quit(self):
+        self.rendering_proc.kill()
+        self.renderer.close()
+        super(VizTransformProcForMatplotlibGraphs,self).on_quit()
 
 
     def rendering_thread(self):
-        from copy import deepcopy
-        # Service Client
-
-        # init Matplotlib
-        fig = Figure()
-        ax = fig.add_subplot(111)
-        canvas = FigureCanvas(fig)
-        imgInMem = StringIO.StringIO()
         while True:
 
-            # Sleep for a pre-decided interval. Should be specifiable in a YAML file
-            gevent.sleep(20)
+            # Sleep for a pre-decided interval
+            gevent.sleep(self.render_interval)
 
-            # If there's no data, wait
-            # Lock is used here to make sure the entire vector exists start to finish, this assures that the data won
-            working_set=None
+            # Only the graphs of data products which received records since they were last rendered are rendered
             with self.lock:
-                if len(self.graph_data) == 0:
+                if not self.history.dirty:
                     continue
-                else:
-                    working_set = deepcopy(self.graph_data)
+                working_set = self.history.get()
+                revision = self.history.revision
 
+            # A failed rendering is tried again on the next interval, the history staying dirty
+            try:
+                images = self.renderer.render(working_set)
+            except Exception:
+                log.exception('(%s): Rendering the graphs of data product %s failed' % (self.name, self.data_product_id))
+                continue
 
-            # For the simple case of testing, lets plot all time variant variables one at a time
-            xAxisVar = 'time'
-            xAxisFloatData = working_set[xAxisVar]
-
-            for varName, varData in working_set.iteritems():
-                if varName == 'time' or varName == 'height' or varName == 'longitude' or varName == 'latitude':
-                    continue
-
-                yAxisVar = varName
-                yAxisFloatData = working_set[varName]
-
-                # Generate the plot
-
-                ax.plot(xAxisFloatData, yAxisFloatData, 'ro')
-                ax.set_xlabel(xAxisVar)
-                ax.set_ylabel(yAxisVar)
-                ax.set_title(yAxisVar + ' vs ' + xAxisVar)
-                ax.set_autoscale_on(False)
-
-                # generate filename for the output image
-                fileName = yAxisVar + '_vs_' + xAxisVar + '.png'
-                # Save the figure to the in memory file
-                canvas.print_figure(imgInMem, format="png")
-                imgInMem.seek(0)
+            # Records added while rendering are rendered on the next interval
+            with self.lock:
+                if self.history.revision == revision:
+                    self.history.dirty = False
 
+            for fileName, image_obj in images:
                 # submit resulting table back using the out stream publisher
                 msg = {"viz_product_type": "matplotlib_graphs",
                        "data_product_id": self.data_product_id,
-                       "image_obj": imgInMem.getvalue(),
+                       "image_obj": image_obj,
                        "image_name": fileName}
-                self.out_stream_pub.publish(msg)
-
-                #clear the canvas for the next image
-                ax.clear()
+                try:
+                    self.out_stream_pub.publish(msg)
+                except Exception:
+                    log.exception('(%s): Publishing graph %s failed' % (self.name, fileName))
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+
+'''
+@file ion/services/ans/viz_cache.py
+@description Size bounded cache of the images and datatables held by the visualization service
+'''
+
+import os
+import time
+import hashlib
+from collections import OrderedDict
+
+from pyon.public import log
+from pyon.util.file_sys import FS, FileSystem
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_MAX_SPILL_BYTES = 1024 * 1024 * 1024
+
+
+class VizCacheEntry(object):
+    """
+    A viz product in the cache. The ETag is the SHA1 of the value and the last modified time is when the value
+    last changed, so a client can tell whether the copy it holds is current without fetching the value. A pinned
+    entry is never evicted.
+    """
+
+    def __init__(self, value, etag, last_modified, size=None, filename=None, pinned=False):
+        self.value = value # None once spilled to filename
+        self.etag = etag
+        self.last_modified = last_modified
+        self.size = len(value) if size is None else size
+        self.filename = filename
+        self.pinned = pinned
+
+
+class VizCache(object):
+    """
+    LRU cache of viz products (PNG images and JSON datatables), bounded by the bytes held in memory. Once the bound
+    is exceeded the least recently used entries are evicted or, with spill enabled, written to files under FS.CACHE
+    and read back on their next use. Spilled files are bounded in the same way and removed least recently used first.
+    Pinned entries, such as the datatable of a replay which has not been fetched yet, are held until deleted and do
+    not count towards the bound. Hits, misses and evictions are counted for the metrics.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, spill=False, max_spill_bytes=DEFAULT_MAX_SPILL_BYTES):
+        self.max_bytes = max_bytes
+        self.spill = spill
+        self.max_spill_bytes = max_spill_bytes
+
+        self.entries = OrderedDict() # key : VizCacheEntry, least recently used first
+        self.spilled = OrderedDict() # key : VizCacheEntry holding the file name of the value, least recently used first
+        self.bytes_held = 0 # Not counting the pinned entries
+        self.bytes_pinned = 0
+        self.bytes_spilled = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        return key in self.entries or key in self.spilled
+
+    def __len__(self):
+        return len(self.entries) + len(self.spilled)
+
+    def put(self, key, value, pinned=False):
+        """
+        Add or replace an entry. The last modified time is kept if the value did not change.
+
+        @param key hashable key of the entry
+        @param value str
+        @param pinned True if the entry must be held until deleted
+        @retval the VizCacheEntry
+        """
+        etag = hashlib.sha1(value).hexdigest()
+        info = self.get_info(key)
+        last_modified = info[1] if info is not None and info[0] == etag else time.time()
+
+        self.delete(key)
+        entry = VizCacheEntry(value, etag, last_modified, pinned=pinned)
+        self.entries[key] = entry
+        self._add_bytes(entry, entry.size)
+        self._evict()
+
+        return entry
+
+    def get(self, key):
+        """
+        @retval the value of the entry, None if not in the cache
+        """
+        entry = self.get_entry(key)
+        return entry.value if entry is not None else None
+
+    def get_entry(self, key):
+        """
+        Look up an entry, reading it back from its file if spilled, and mark it most recently used.
+
+        @retval the VizCacheEntry, None if not in the cache
+        """
+        entry = self.entries.pop(key, None)
+        if entry is None and key in self.spilled:
+            entry = self._unspill(key)
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.entries[key] = entry
+        if not entry.pinned:
+            self._evict()
+        return entry
+
+    def get_info(self, key):
+        """
+        The ETag and last modified time of an entry, without reading a spilled value back.
+
+        @retval (etag, last_modified), None if not in the cache
+        """
+        entry = self.entries.get(key) or self.spilled.get(key)
+        if entry is None:
+            return None
+        return entry.etag, entry.last_modified
+
+    def delete(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self._add_bytes(entry, -entry.size)
+
+        entry = self.spilled.pop(key, None)
+        if entry is not None:
+            self._remove_file(entry)
+
+    def clear(self):
+        for key in self.spilled.keys():
+            self.delete(key)
+        self.entries.clear()
+        self.bytes_held = 0
+        self.bytes_pinned = 0
+
+    def get_metrics(self):
+        """
+        @retval dict of the hits, misses, hit_rate, evictions, entries and bytes held in memory, pinned and spilled to disk
+        """
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'entries': len(self.entries),
+            'bytes_held': self.bytes_held,
+            'bytes_pinned': self.bytes_pinned,
+            'spilled_entries': len(self.spilled),
+            'bytes_spilled': self.bytes_spilled,
+        }
+
+    def _add_bytes(self, entry, size):
+        if entry.pinned:
+            self.bytes_pinned += size
+        else:
+            self.bytes_held += size
+
+    def _evict(self):
+        # Evict the least recently used entries which are not pinned until the bytes held are within the bound. The
+        # most recently used entry is kept even if it exceeds the bound on its own
+        if self.bytes_held <= self.max_bytes:
+            return
+
+        for key in self.entries.keys()[:-1]:
+            entry = self.entries[key]
+            if entry.pinned:
+                continue
+
+            del self.entries[key]
+            self.bytes_held -= entry.size
+            self.evictions += 1
+
+            if self.spill and entry.size <= self.max_spill_bytes:
+                self._spill(key, entry)
+
+            if self.bytes_held <= self.max_bytes:
+                break
+
+    def _spill(self, key, entry):
+        filename = FileSystem.get_hierarchical_url(FS.CACHE, 'viz_' + hashlib.sha1(repr(key)).hexdigest(), '.dat')
+        try:
+            with open(filename, 'wb') as f:
+                f.write(entry.value)
+        except IOError as ex:
+            log.warn('Could not spill viz product %s to %s: %s', key, filename, ex)
+            return
+
+        self.spilled[key] = VizCacheEntry(None, entry.etag, entry.last_modified, entry.size, filename)
+        self.bytes_spilled += entry.size
+
+        while self.bytes_spilled > self.max_spill_bytes:
+            _, old_entry = self.spilled.popitem(last=False)
+            self._remove_file(old_entry)
+
+    def _unspill(self, key):
+        spilled_entry = self.spilled.pop(key)
+        try:
+            with open(spilled_entry.filename, 'rb') as f:
+                value = f.read()
+        except IOError as ex:
+            log.warn('Could not read spilled viz product %s from %s: %s', key, spilled_entry.filename, ex)
+            self.bytes_spilled -= spilled_entry.size
+            return None
+        self._remove_file(spilled_entry)
+
+        entry = VizCacheEntry(value, spilled_entry.etag, spilled_entry.last_modified)
+        self.bytes_held += entry.size
+        return entry
+
+    def _remove_file(self, spilled_entry):
+        self.bytes_spilled -= spilled_entry.size
+        try:
+            os.unlink(spilled_entry.filename)
+        except OSError:
+            pass
@@ -648,6 +648,10 @@ class OrgManagementService(BaseOrgManagementService):
         param_objects = self._validate_parameters(user_id=user_id)
         user = param_objects['user']
 
+        return self._find_enrolled_orgs(user)
+
+    def _find_enrolled_orgs(self, user=None):
+
         org_list,_ = self.clients.resource_registry.find_subjects(RT.Org,PRED.hasMembership, user )
 
         #Membership into the Root ION Org is implied as part of registration
@@ -783,14 +787,49 @@ class OrgManagementService(BaseOrgManagementService):
         param_objects = self._validate_parameters(user_id=user_id)
         user = param_objects['user']
 
-        ret_val = dict()
+        org_list = self._find_enrolled_orgs(user)
+
+        return self._find_all_org_roles_by_user(org_list, user)
+
+    def _find_all_org_roles_by_user(self, org_list=None, user=None):
+        """Returns the User Roles of the user in each of the Orgs by Org name, as _find_org_roles_by_user
+        does for a single Org. Instead of querying the roles of each Org in turn, the roles of the user are
+        found with one hasRole query and the membership roles of all Orgs with one query by role name;
+        each role carries the id of its Org.
+        """
+
+        if org_list is None:
+            raise BadRequest("The org_list parameter is missing")
+
+        if user is None:
+            raise BadRequest("The user parameter is missing")
+
+        org_ids = set(org._id for org in org_list)
 
-        org_list = self.find_enrolled_orgs(user_id)
+        role_list,_ = self.clients.resource_registry.find_objects(user, PRED.hasRole, RT.UserRole)
+        member_role_list,_ = self.clients.resource_registry.find_resources(restype=RT.UserRole, name=MEMBER_ROLE)
+
+        #The membership role of each Org
+        member_roles = dict()
+        for role in member_role_list:
+            if role.org_id in org_ids:
+                member_roles[role.org_id] = role
+
+        #The roles associated with the user by Org
+        user_roles = dict()
+        for role in role_list:
+            if role.org_id in org_ids:
+                user_roles.setdefault(role.org_id, []).append(role)
+
+        ret_val = dict()
 
         #Membership with the ION Root Org is implied thrgoun
         for org in org_list:
-            role_list = self._find_org_roles_by_user(org, user)
-            ret_val[org.name] = role_list
+            #Because a user is enrolled with an Org then the membership role is implied - so add it to the list
+            if not member_roles.has_key(org._id):
+                raise Inconsistent('The %s User Role is not found.' % MEMBER_ROLE)
+
+            ret_val[org.name] = user_roles.get(org._id, []) + [member_roles[org._id]]
 
         return ret_val
 
@@ -19,6 +19,16 @@ ION_MANAGER = 'ION_MANAGER'   # Can act upon resources across all Orgs - like a
 
 class PolicyManagementService(BasePolicyManagementService):
 
+    def __init__(self, *args, **kwargs):
+        super(PolicyManagementService,self).__init__(*args,**kwargs)
+
+        #The active policy rules are cached by (org_id, service_name) or ('', resource_id). Each entry is
+        #(policy rules, ids of the resources the rules came from, ids of the policies of those resources)
+        #so that it can be invalidated when any of them change.
+        self.policy_rules_cache = dict()
+
+        #Incremented on each invalidation, so policy rules assembled while the policies changed are not cached
+        self.policy_cache_generation = 0
 
     def on_init(self):
         self.event_pub = EventPublisher()
@@ -26,11 +36,17 @@ class PolicyManagementService(BasePolicyManagementService):
         self.policy_event_subscriber = EventSubscriber(event_type="ResourceModifiedEvent", origin_type="Policy", callback=self.policy_event_callback)
         self.policy_event_subscriber.activate()
 
+        self.resource_policy_event_subscriber = EventSubscriber(event_type="ResourcePolicyEvent", callback=self.resource_policy_event_callback)
+        self.resource_policy_event_subscriber.activate()
+
     def on_quit(self):
 
         if self.policy_event_subscriber is not None:
             self.policy_event_subscriber.deactivate()
 
+        if self.resource_policy_event_subscriber is not None:
+            self.resource_policy_event_subscriber.deactivate()
+
 
     """
     Provides the interface to define and manage policy and a repository to store and retrieve policy and templates for
@@ -67,6 +83,8 @@ class PolicyManagementService(BasePolicyManagementService):
 
         self.clients.resource_registry.update(policy)
 
+        self._invalidate_policy_rules(policy_id=policy._id)
+
     def read_policy(self, policy_id=''):
         """Returns the Policy object for the specified policy id.
         Throws exception if id does not match any persisted Policy
@@ -99,6 +117,8 @@ class PolicyManagementService(BasePolicyManagementService):
             raise NotFound("Policy %s does not exist" % policy_id)
         self.clients.resource_registry.delete(policy_id)
 
+        self._invalidate_policy_rules(policy_id=policy_id)
+
 
     def enable_policy(self, policy_id=''):
         """Sets a flag to enable the use of the policy rule
@@ -130,6 +150,8 @@ class PolicyManagementService(BasePolicyManagementService):
         policy_id = policy_event.origin
         log.debug("Policy modified: %s" % policy_id)
 
+        self._invalidate_policy_rules(policy_id=policy_id)
+
         try:
             policy = self.clients.resource_registry.read(policy_id)
             if policy:
@@ -143,6 +165,15 @@ class PolicyManagementService(BasePolicyManagementService):
             if policy_event.sub_type != 'DELETE':
                 log.error(e)
 
+    def resource_policy_event_callback(self, *args, **kwargs):
+        """
+        This method is a callback function for receiving Resource Policy Events.
+        """
+        resource_policy_event = args[0]
+        log.debug("Resource policy modified: %s" % resource_policy_event.resource_id)
+
+        self._invalidate_policy_rules(resource_id=resource_policy_event.resource_id, policy_id=resource_policy_event.origin)
+
 
     def add_resource_policy(self, resource_id='', policy_id=''):
         """Associates a policy rule to a specific resource
@@ -171,6 +202,8 @@ class PolicyManagementService(BasePolicyManagementService):
         if not aid:
             return False
 
+        self._invalidate_policy_rules(resource_id=resource_id)
+
         #Publish an event that the resource policy has changed
         self._publish_resource_policy_event(policy, resource)
 
@@ -205,6 +238,8 @@ class PolicyManagementService(BasePolicyManagementService):
 
         self.clients.resource_registry.delete_association(aid)
 
+        self._invalidate_policy_rules(resource_id=resource_id)
+
         #Publish an event that the resource policy has changed
         self._publish_resource_policy_event(policy, resource)
 
@@ -284,6 +319,55 @@ class PolicyManagementService(BasePolicyManagementService):
 
         return policy_template
 
+    def _get_cached_policy_rules(self, key):
+        """Returns the cached policy rules for the key, or None if they are not cached.
+        """
+        entry = self.policy_rules_cache.get(key)
+        if entry is None:
+            return None
+        return entry[0]
+
+    def _assemble_policy_rules(self, key, org_name, name, resource_ids):
+        """Assembles the enabled policy rules of the resources, in order, into a policy set
+        and caches it by key.
+
+        @param key    tuple
+        @param org_name    str
+        @param name    str
+        @param resource_ids    list
+        @retval policy    str
+        """
+        generation = self.policy_cache_generation
+
+        rules = []
+        policy_ids = set()
+        for resource_id in resource_ids:
+            policy_set,_ = self.clients.resource_registry.find_objects(resource_id, PRED.hasPolicy, RT.Policy)
+            for p in policy_set:
+                policy_ids.add(p._id)
+                if p.enabled:
+                    rules.append(p.rule)
+
+        policy_rules = self._get_policy_template() % (org_name, name, ''.join(rules))
+
+        if generation == self.policy_cache_generation:
+            self.policy_rules_cache[key] = (policy_rules, set(resource_ids), policy_ids)
+
+        return policy_rules
+
+    def _invalidate_policy_rules(self, resource_id='', policy_id=''):
+        """Removes the cached policy rules that came from the resource or that include the policy.
+
+        @param resource_id    str
+        @param policy_id    str
+        """
+        self.policy_cache_generation += 1
+
+        for key, (policy_rules, resource_ids, policy_ids) in self.policy_rules_cache.items():
+            if resource_id in resource_ids or policy_id in policy_ids:
+                log.debug("Invalidating cached policy rules: %s" % str(key))
+                del self.policy_rules_cache[key]
+
 
     def get_active_resource_policy_rules(self, resource_id=''):
         """Generates the set of all enabled policies for the specified resource
@@ -295,23 +379,16 @@ class PolicyManagementService(BasePolicyManagementService):
         if not resource_id:
             raise BadRequest("The resource_id parameter is missing")
 
+        key = ('', resource_id)
+        policy_rules = self._get_cached_policy_rules(key)
+        if policy_rules is not None:
+            return policy_rules
+
         resource = self.clients.resource_registry.read(resource_id)
         if not resource:
             raise NotFound("Resource %s does not exist" % resource_id)
 
-        policy = self._get_policy_template()
-
-        #TODO - investigate better ways to optimize this
-        rules = ""
-        policy_set = self.find_resource_policies(resource_id)
-
-        for p in policy_set:
-            if p.enabled:
-                rules += p.rule
-
-        policy_rules = policy % ('', resource_id, rules)
-
-        return policy_rules
+        return self._assemble_policy_rules(key, '', resource_id, [resource_id])
 
     def add_service_policy(self, service_name='', policy_id=''):
         """Associates a policy rule to a specific service
@@ -369,34 +446,22 @@ class PolicyManagementService(BasePolicyManagementService):
         if not org_id:
             raise BadRequest("The org_id parameter is missing")
 
-        org = self.clients.resource_registry.read(org_id)
-        if not org:
-            raise NotFound("Org %s does not exist" % org_id)
-
         if not service_name:
             raise BadRequest("The name parameter is missing")
 
-        policy = self._get_policy_template()
-
-        #TODO - investigate better ways to optimize this
-
-        rules = ""
-        #First get any global Org rules
-        policy_set = self.find_resource_policies(org_id)
-        for p in policy_set:
-            if p.enabled:
-                rules += p.rule
-
-        #Next get service specific rules
-        policy_set = self.find_service_policies(service_name)
-        for p in policy_set:
-            if p.enabled:
-                rules += p.rule
+        key = (org_id, service_name)
+        policy_rules = self._get_cached_policy_rules(key)
+        if policy_rules is not None:
+            return policy_rules
 
+        org = self.clients.resource_registry.read(org_id)
+        if not org:
+            raise NotFound("Org %s does not exist" % org_id)
 
-        policy_rules = policy % (org.name, service_name, rules)
+        service_resource = self._find_service_resource_by_name(service_name)
 
-        return policy_rules
+        #First any global Org rules, then the service specific rules
+        return self._assemble_policy_rules(key, org.name, service_name, [org_id, service_resource._id])
 
 
 
@@ -4,7 +4,7 @@
 __author__ = 'Stephen P. Henrie'
 __license__ = 'Apache 2.0'
 
-import inspect, collections, ast, simplejson, json, sys, time, traceback
+import inspect, collections, ast, simplejson, json, sys, time, traceback, bisect, zlib, itertools, hashlib
 from flask import Flask, request, abort
 from gevent.wsgi import WSGIServer
 
@@ -33,8 +33,10 @@ service_gateway_instance = None
 DEFAULT_WEB_SERVER_HOSTNAME = ""
 DEFAULT_WEB_SERVER_PORT = 5000
 DEFAULT_USER_CACHE_SIZE = 2000
+DEFAULT_USER_CACHE_EXPIRY_MS = 300000
 
 GATEWAY_RESPONSE = 'GatewayResponse'
+GATEWAY_PAGING = 'GatewayPaging'
 GATEWAY_ERROR = 'GatewayError'
 GATEWAY_ERROR_EXCEPTION = 'Exception'
 GATEWAY_ERROR_MESSAGE = 'Message'
@@ -46,6 +48,19 @@ DEFAULT_EXPIRY = '0'
 #Stuff for specifying other return types
 RETURN_FORMAT_PARAM = 'return_format'
 RETURN_FORMAT_RAW_JSON = 'raw_json'
+PRETTY_PARAM = 'pretty'
+
+#Stuff for paging through find results
+LIMIT_PARAM = 'limit'
+OFFSET_PARAM = 'offset'
+CURSOR_PARAM = 'cursor'
+
+#Size of the chunks JSON responses are streamed in
+JSON_CHUNK_SIZE = 65536
+
+#JSON responses are encoded before they are returned up to this size, so encoding errors are reported as an error
+#response; only the rest of larger responses is encoded as it is streamed
+JSON_EAGER_SIZE = 1048576
 
 #This class is used to manage the WSGI/Flask server as an ION process - and as a process endpoint for ION RPC calls
 class ServiceGatewayService(BaseServiceGatewayService):
@@ -101,19 +116,38 @@ class ServiceGatewayService(BaseServiceGatewayService):
         except Exception, e:
             self.user_cache_size = DEFAULT_USER_CACHE_SIZE
 
-
-        #Start the gevent web server unless disabled
-        if self.web_server_enabled:
-            self.start_service(self.server_hostname,self.server_port)
-
-        self.user_role_event_subscriber = EventSubscriber(event_type="UserRoleModifiedEvent", origin_type="Org", callback=self.user_role_event_callback)
-        self.user_role_event_subscriber.activate()
+        try:
+            #Get the age in milliseconds after which cached user roles are looked up again; 0 keeps them until evicted
+            self.user_cache_expiry_ms = self.CFG['container']['service_gateway']['user_cache_expiry_ms']
+        except Exception, e:
+            self.user_cache_expiry_ms = DEFAULT_USER_CACHE_EXPIRY_MS
 
         #Initialize an LRU Cache to keep user roles cached for performance reasons
         #maxSize = maximum number of elements to keep in cache
         #maxAgeMs = oldest entry to keep
+        #Entries are (role header, time cached) so they can be expired by user_cache_expiry_ms
         self.user_data_cache = LRUCache(self.user_cache_size,0,0)
 
+        #Clients used to validate requesters and find their roles, reused across requests
+        self.idm_client = IdentityManagementServiceProcessClient(node=Container.instance.node, process=self)
+        self.org_client = OrgManagementServiceProcessClient(node=Container.instance.node, process=self)
+
+        #Dispatch table of the service operations callable through the gateway - keyed by (service name, operation)
+        #and the clients the operations are called with - keyed by service name
+        self.service_dispatch = dict()
+        self.service_clients = dict()
+        self.build_service_dispatch()
+
+        #Resource type schemas returned by the gateway - keyed by resource type
+        self.resource_schema_cache = dict()
+
+        self.user_role_event_subscriber = EventSubscriber(event_type="UserRoleModifiedEvent", origin_type="Org", callback=self.user_role_event_callback)
+        self.user_role_event_subscriber.activate()
+
+        #Start the gevent web server unless disabled
+        if self.web_server_enabled:
+            self.start_service(self.server_hostname,self.server_port)
+
     def on_quit(self):
         self.stop_service()
 
@@ -140,6 +174,80 @@ class ServiceGatewayService(BaseServiceGatewayService):
             self.http_server.stop()
         return True
 
+    def build_service_dispatch(self):
+        """
+        Precompute the dispatch entries for the operations of every registered service with a client class, so
+        requests do not inspect client methods or look up parameter types. Operations not found here are added
+        by get_service_operation on their first request.
+        """
+        from pyon.core.bootstrap import service_registry
+
+        try:
+            service_defs = service_registry.services.values()
+        except Exception, e:
+            log.warning("Service Gateway could not list the registered services, operations will be added on first request: %s" % str(e))
+            return
+
+        for service_def in service_defs:
+            if not getattr(service_def, 'client', None):
+                continue
+
+            for operation in get_client_operations(service_def.client):
+                try:
+                    self.get_service_operation(service_def.name, operation, service_def.client)
+                except Exception, e:
+                    log.debug("Service Gateway could not build the dispatch entry for %s.%s: %s" % (service_def.name, operation, str(e)))
+
+        log.info("Service Gateway dispatch table holds %d service operations" % len(self.service_dispatch))
+
+    def get_service_operation(self, service_name, operation, client_class, create_client=True):
+        """
+        Returns the dispatch entry for a service operation, creating it if needed. The entry holds the argument
+        names of the client method, the parameter types of the arguments and the client of the service to call the
+        operation with, unless create_client is False.
+        """
+        entry = self.service_dispatch.get((service_name, operation), None)
+        if entry is not None:
+            if create_client and entry['client'] is None:
+                entry['client'] = self.get_service_client(service_name, client_class)
+            return entry
+
+        method = getattr(client_class, operation, None)
+        if method is None or operation.startswith('_'):
+            raise BadRequest("The requested operation (%s) is not available for service %s" % (operation, service_name))
+
+        arg_names = [arg for arg in inspect.getargspec(method)[0] if arg != 'self' and arg != 'headers']
+
+        #Parameter types that can not be found now are looked up again when they are needed.
+        param_types = dict()
+        for arg in arg_names:
+            try:
+                param_types[arg] = get_message_class_in_parm_type(service_name, operation, arg)
+            except Exception, e:
+                pass
+
+        client = None
+        if create_client:
+            client = self.get_service_client(service_name, client_class)
+
+        entry = {
+            'args': arg_names,
+            'param_types': param_types,
+            'client': client,
+        }
+        self.service_dispatch[(service_name, operation)] = entry
+        return entry
+
+    def get_service_client(self, service_name, client_class):
+        """
+        Returns the client used for all requests to a service, creating it if needed.
+        """
+        client = self.service_clients.get(service_name, None)
+        if client is None:
+            client = client_class(node=Container.instance.node, process=self)
+            self.service_clients[service_name] = client
+        return client
+
     def is_trusted_address(self, requesting_address):
 
         if self.trusted_originators is None:
@@ -253,11 +361,16 @@ def process_gateway_request(service_name, operation):
         ion_actor_id, expiry = validate_request(ion_actor_id, expiry)
         param_list['headers'] = build_message_headers(ion_actor_id, expiry)
 
-        client = target_client(node=Container.instance.node, process=service_gateway_instance)
-        methodToCall = getattr(client, operation)
+        entry = service_gateway_instance.get_service_operation(service_name, operation, target_client)
+        methodToCall = getattr(entry['client'], operation)
         result = methodToCall(**param_list)
 
-        return gateway_json_response(result)
+        #Page the results of find operations unless the operation takes the paging parameters itself
+        paging = None
+        if operation.startswith('find_') and LIMIT_PARAM not in entry['args'] and OFFSET_PARAM not in entry['args']:
+            result, paging = page_find_result(result)
+
+        return gateway_json_response(result, paging)
 
 
     except Exception, e:
@@ -325,12 +438,66 @@ def process_gateway_agent_request(resource_id, operation):
 
 
 #Private implementation of standard flask jsonify to specify the use of an encoder to walk ION objects
+#The JSON is compact unless the pretty parameter is in the request, and gzip compressed if the client accepts it.
+#The first JSON_EAGER_SIZE bytes are encoded here, so an encoding error raises in the calling view and becomes an
+#error response; the rest of a larger response is streamed in chunks as it is encoded rather than built as one string.
 def json_response(response_data):
 
-    return app.response_class(simplejson.dumps(response_data, default=ion_object_encoder,
-        indent=None if request.is_xhr else 2), mimetype='application/json')
+    if request.args.has_key(PRETTY_PARAM):
+        encoder = simplejson.JSONEncoder(default=ion_object_encoder, indent=2)
+    else:
+        encoder = simplejson.JSONEncoder(default=ion_object_encoder, separators=(',', ':'))
+
+    pieces = encoder.iterencode(response_data)
+    head = []
+    size = 0
+    chunks = None
+    for piece in pieces:
+        head.append(piece)
+        size += len(piece)
+        if size >= JSON_EAGER_SIZE:
+            chunks = itertools.chain([''.join(head)], buffer_chunks(pieces))
+            break
+    if chunks is None:
+        chunks = [''.join(head)]
+
+    headers = dict()
+    if 'gzip' in request.headers.get('Accept-Encoding', ''):
+        chunks = gzip_chunks(chunks)
+        headers['Content-Encoding'] = 'gzip'
+        headers['Vary'] = 'Accept-Encoding'
+
+    return app.response_class(chunks, mimetype='application/json', headers=headers)
+
+#Joins the many small pieces produced by the JSON encoder into chunks of about JSON_CHUNK_SIZE bytes
+def buffer_chunks(pieces):
+    buf = []
+    size = 0
+    try:
+        for piece in pieces:
+            buf.append(piece)
+            size += len(piece)
+            if size >= JSON_CHUNK_SIZE:
+                yield ''.join(buf)
+                buf = []
+                size = 0
+    except Exception, e:
+        #The response has started so the error can not be returned; the client receives truncated JSON. Only
+        #happens to responses larger than JSON_EAGER_SIZE, see json_response
+        log.error("Service Gateway failed encoding a JSON response: %s" % str(e))
+    if buf:
+        yield ''.join(buf)
+
+#Compresses a stream of chunks into a gzip stream
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
 
-def gateway_json_response(response_data):
+def gateway_json_response(response_data, paging=None):
 
 
     if request.args.has_key(RETURN_FORMAT_PARAM):
@@ -338,7 +505,76 @@ def gateway_json_response(response_data):
         if return_format == RETURN_FORMAT_RAW_JSON:
             return app.response_class(response_data, mimetype='application/json')
 
-    return json_response({'data':{ GATEWAY_RESPONSE: response_data} } )
+    response = {'data':{ GATEWAY_RESPONSE: response_data} }
+    if paging is not None:
+        response['data'][GATEWAY_PAGING] = paging
+
+    return json_response(response)
+
+#Returns the limit, offset and cursor paging parameters of the request; a limit of 0 is no limit
+def get_paging_from_request():
+
+    try:
+        limit = int(request.args.get(LIMIT_PARAM, 0))
+        offset = int(request.args.get(OFFSET_PARAM, 0))
+    except ValueError, e:
+        raise BadRequest("The %s and %s parameters must be integers" % (LIMIT_PARAM, OFFSET_PARAM))
+
+    if limit < 0 or offset < 0:
+        raise BadRequest("The %s and %s parameters can not be negative" % (LIMIT_PARAM, OFFSET_PARAM))
+
+    cursor = convert_unicode(request.args.get(CURSOR_PARAM, u''))
+
+    return limit, offset, cursor
+
+#Returns the page of a list of ids sorted ascending. The page starts offset ids after the cursor, the last id of
+#the previous page, or after the start of the list if there is no cursor. The paging info returned holds the
+#cursor for the next page, which is None on the last page.
+def page_ids(ids, limit, offset, cursor):
+
+    start = offset
+    if cursor:
+        start += bisect.bisect_right(ids, cursor)
+
+    end = start + limit if limit else len(ids)
+    page = ids[start:end]
+
+    paging = {
+        LIMIT_PARAM: limit,
+        OFFSET_PARAM: start,
+        'total': len(ids),
+        'next_cursor': page[-1] if page and end < len(ids) else None,
+    }
+    return page, paging
+
+#Pages the result of a find operation by the limit and offset parameters of the request, if any. The result is
+#a list or a tuple of parallel lists; e.g. resources and their associations. These results have no order to resume
+#from, so unlike the REST find_resources route (see page_ids) they are paged by offset only and a cursor is rejected.
+def page_find_result(result):
+
+    if not any(request.args.has_key(param) for param in (LIMIT_PARAM, OFFSET_PARAM, CURSOR_PARAM)):
+        return result, None
+
+    limit, offset, cursor = get_paging_from_request()
+    if cursor:
+        raise BadRequest("The %s parameter is only supported by the REST find_resources route; use %s" % (CURSOR_PARAM, OFFSET_PARAM))
+    end = offset + limit if limit else None
+
+    if isinstance(result, list):
+        total = len(result)
+        result = result[offset:end]
+    elif isinstance(result, tuple) and result and all(isinstance(r, list) for r in result):
+        total = len(result[0])
+        result = tuple(r[offset:end] for r in result)
+    else:
+        return result, None
+
+    paging = {
+        LIMIT_PARAM: limit,
+        OFFSET_PARAM: offset,
+        'total': total,
+    }
+    return result, paging
 
 def build_error_response(e):
 
@@ -385,10 +621,8 @@ def validate_request(ion_actor_id, expiry):
         expiry = DEFAULT_EXPIRY  #Since this is now an anonymous request, there really is no expiry associated with it
         return ion_actor_id, expiry
 
-    idm_client = IdentityManagementServiceProcessClient(node=Container.instance.node, process=service_gateway_instance)
-
     try:
-        user = idm_client.read_actor_identity(user_id=ion_actor_id, headers={"ion-actor-id": service_gateway_instance.name, 'expiry': DEFAULT_EXPIRY })
+        user = service_gateway_instance.idm_client.read_actor_identity(user_id=ion_actor_id, headers={"ion-actor-id": service_gateway_instance.name, 'expiry': DEFAULT_EXPIRY })
     except NotFound, e:
         ion_actor_id = DEFAULT_ACTOR_ID  # If the user isn't found default to anonymous
         expiry = DEFAULT_EXPIRY  #Since this is now an anonymous request, there really is no expiry associated with it
@@ -423,20 +657,22 @@ def build_message_headers( ion_actor_id, expiry):
     try:
         #Check to see if the user's roles are cached already - keyed by user id
         if service_gateway_instance.user_data_cache.has_key(ion_actor_id):
-            role_header = service_gateway_instance.user_data_cache.get(ion_actor_id)
-            if role_header is not None:
-                headers['ion-actor-roles'] = role_header
-                return headers
+            cached_roles = service_gateway_instance.user_data_cache.get(ion_actor_id)
+            if cached_roles is not None:
+                role_header, cache_time = cached_roles
+                expiry_ms = service_gateway_instance.user_cache_expiry_ms
+                if not expiry_ms or current_time_millis() - cache_time < expiry_ms:
+                    headers['ion-actor-roles'] = role_header
+                    return headers
 
 
-        #The user's roles were not cached so hit the datastore to find it.
-        org_client = OrgManagementServiceProcessClient(node=Container.instance.node, process=service_gateway_instance)
-        org_roles = org_client.find_all_roles_by_user(ion_actor_id, headers={"ion-actor-id": service_gateway_instance.name, 'expiry': DEFAULT_EXPIRY })
+        #The user's roles were not cached or have expired so hit the datastore to find it.
+        org_roles = service_gateway_instance.org_client.find_all_roles_by_user(ion_actor_id, headers={"ion-actor-id": service_gateway_instance.name, 'expiry': DEFAULT_EXPIRY })
 
         role_header = get_role_message_headers(org_roles)
 
         #Cache the roles by user id
-        service_gateway_instance.user_data_cache.put(ion_actor_id, role_header)
+        service_gateway_instance.user_data_cache.put(ion_actor_id, (role_header, current_time_millis()))
 
     except Exception, e:
         role_header = dict()  # Default to empty dict if there is a problem finding roles for the user
@@ -456,16 +692,26 @@ def get_role_message_headers(org_roles):
             role_header[org].append(role.name)
     return role_header
 
-#Build parameter list dynamically from
+#Returns the names of the operations a service client class can call
+def get_client_operations(client_class):
+    operations = []
+    for name, member in inspect.getmembers(client_class, inspect.ismethod):
+        if name.startswith('_') or hasattr(ProcessRPCClient, name): continue # skip the RPC client's own methods
+        operations.append(name)
+    return operations
+
+#Build parameter list dynamically from the dispatch entry of the operation
 def create_parameter_list(request_type, service_name, target_client,operation, json_params):
     param_list = {}
-    method_args = inspect.getargspec(getattr(target_client,operation))
-    for arg in method_args[0]:
-        if arg == 'self' or arg == 'headers': continue # skip self and headers from being set
+    entry = service_gateway_instance.get_service_operation(service_name, operation, target_client, create_client=(request_type == 'serviceRequest'))
+    for arg in entry['args']:
 
         if not json_params:
             if request.args.has_key(arg):
-                param_type = get_message_class_in_parm_type(service_name, operation, arg)
+                param_type = entry['param_types'].get(arg, None)
+                if param_type is None:
+                    param_type = get_message_class_in_parm_type(service_name, operation, arg)
+                    entry['param_types'][arg] = param_type
                 if param_type == 'str':
                     param_list[arg] = convert_unicode(request.args[arg])
                 else:
@@ -579,6 +825,11 @@ def get_resource_schema(resource_type):
 
         #ION Objects are not registered as UNICODE names
         ion_object_name = convert_unicode(resource_type)
+
+        #The schema of a type does not change, so return it from the cache if it has been built already
+        if service_gateway_instance.resource_schema_cache.has_key(ion_object_name):
+            return gateway_json_response(service_gateway_instance.resource_schema_cache[ion_object_name])
+
         ret_obj = IonObject(ion_object_name, {})
 
         # If it's an op input param or response message object.
@@ -595,6 +846,7 @@ def get_resource_schema(resource_type):
                         value = None
                     setattr(ret_obj, field, value)
 
+        service_gateway_instance.resource_schema_cache[ion_object_name] = ret_obj
 
         return gateway_json_response(ret_obj)
 
@@ -633,6 +885,9 @@ def get_resource(resource_id):
 
 #Example operation to return a list of resources of a specific type like
 #http://hostname:port/ion-service/find_resources/BankAccount
+#The resources can be paged through in order of resource id with the limit, offset and cursor parameters like
+#http://hostname:port/ion-service/find_resources/BankAccount?limit=100
+#http://hostname:port/ion-service/find_resources/BankAccount?limit=100&cursor=<next_cursor of the previous page>
 @app.route('/ion-service/rest/find_resources/<resource_type>')
 def list_resources_by_type(resource_type):
 
@@ -644,10 +899,19 @@ def list_resources_by_type(resource_type):
         ion_actor_id, expiry = get_governance_info_from_request()
         ion_actor_id, expiry = validate_request(ion_actor_id, expiry)
 
-        #Resource Types are not in unicode
-        res_list,_ = client.find_resources(restype=convert_unicode(resource_type) )
+        limit, offset, cursor = get_paging_from_request()
+        if not limit and not offset and not cursor:
+            #Resource Types are not in unicode
+            res_list,_ = client.find_resources(restype=convert_unicode(resource_type) )
+
+            return gateway_json_response(res_list)
 
-        return gateway_json_response(res_list)
+        #Find only the ids and read the resources of the requested page
+        res_ids,_ = client.find_resources(restype=convert_unicode(resource_type), id_only=True )
+        page, paging = page_ids(sorted(res_ids), limit, offset, cursor)
+        res_list = client.read_mult(page) if page else []
+
+        return gateway_json_response(res_list, paging)
 
     except Exception, e:
         return build_error_response(e)
@@ -661,7 +925,21 @@ def get_viz_image(data_product_id, img_name):
 
     # Create client to interface with the viz service
     vs_cli = VisualizationServiceProcessClient(node=Container.instance.node, process=service_gateway_instance)
-    return app.response_class(vs_cli.get_image(data_product_id, img_name),mimetype='image/png')
+
+    image = vs_cli.get_image(data_product_id, img_name)
+    if not image:
+        return app.response_class(image,mimetype='image/png')
+
+    # The ETag is the SHA1 of the image, a client already holding it is answered with no body. Images are replaced
+    # as new data arrives, so clients revalidate them on every use
+    etag = hashlib.sha1(image).hexdigest()
+    if etag in request.if_none_match:
+        resp = app.response_class(status=304)
+    else:
+        resp = app.response_class(image,mimetype='image/png')
+    resp.set_etag(etag)
+    resp.cache_control.no_cache = True
+    return resp
 
 
 
@@ -3,7 +3,7 @@
 __author__ = 'Stephen P. Henrie'
 __license__ = 'Apache 2.0'
 
-import unittest
+import unittest, time
 from mock import Mock, patch
 from pyon.util.unit_test import PyonTestCase
 from pyon.util.int_test import IonIntegrationTestCase
@@ -11,9 +11,73 @@ from nose.plugins.attrib import attr
 
 from pyon.core.exception import BadRequest, Conflict, Inconsistent, NotFound
 from pyon.public import PRED, RT, IonObject
-from ion.services.coi.org_management_service import OrgManagementService
+from pyon.util.log import log
+from ion.services.coi.org_management_service import OrgManagementService, ROOT_ION_ORG_NAME
+from ion.services.coi.policy_management_service import MEMBER_ROLE, MANAGER_ROLE
 from interface.services.coi.iorg_management_service import OrgManagementServiceClient
 
+class FakeResource(object):
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class FakeResourceRegistry(object):
+    """
+    An in memory resource registry with the queries used to resolve user roles, which counts the calls made to it
+    and the rows they return and takes latency seconds for each call plus row_latency seconds for each row.
+    """
+
+    def __init__(self, latency=0, row_latency=0):
+        self.latency = latency
+        self.row_latency = row_latency
+        self.calls = 0
+        self.rows = 0
+        self.resources = dict()
+        self.assocs_by_subject = dict()
+        self.assocs_by_object = dict()
+
+    def _call(self, rows):
+        self.calls += 1
+        self.rows += len(rows)
+        time.sleep(self.latency + self.row_latency * len(rows))
+        return rows
+
+    def add(self, type_, **kwargs):
+        res = FakeResource(_id='id_%d' % len(self.resources), type_=type_, **kwargs)
+        self.resources[res._id] = res
+        return res
+
+    def delete(self, object_id):
+        del self.resources[object_id]
+        for index in (self.assocs_by_subject, self.assocs_by_object):
+            for key in index.keys():
+                index[key] = [a for a in index[key] if object_id not in (a.s, a.o)]
+
+    def associate(self, subject, predicate, object):
+        assoc = FakeResource(s=subject._id, p=predicate, o=object._id)
+        self.assocs_by_subject.setdefault(assoc.s, []).append(assoc)
+        self.assocs_by_object.setdefault(assoc.o, []).append(assoc)
+
+    def read(self, object_id='', rev_id=''):
+        if not self.resources.has_key(object_id):
+            raise NotFound('Object with id %s does not exist.' % object_id)
+        return self._call([self.resources[object_id]])[0]
+
+    def find_resources(self, restype='', lcstate='', name='', id_only=False):
+        return self._call([res for res in self.resources.values() if res.type_ == restype and (not name or res.name == name)]), []
+
+    def find_objects(self, subject='', predicate='', object_type='', id_only=False):
+        subject_id = getattr(subject, '_id', subject)
+        objects = [self.resources[a.o] for a in self.assocs_by_subject.get(subject_id, []) if a.p == predicate]
+        return self._call([o for o in objects if o.type_ == object_type]), []
+
+    def find_subjects(self, subject_type='', predicate='', object='', id_only=False):
+        object_id = getattr(object, '_id', object)
+        subjects = [self.resources[a.s] for a in self.assocs_by_object.get(object_id, []) if a.p == predicate]
+        return self._call([s for s in subjects if s.type_ == subject_type]), []
+
+
 @attr('UNIT', group='coi')
 class TestOrgManagementService(PyonTestCase):
 
@@ -97,6 +161,90 @@ class TestOrgManagementService(PyonTestCase):
         self.mock_delete.assert_called_once_with('bad')
 
 
+    def _create_orgs(self, registry, org_count, roles_per_org, member_count=0, resource_count=0):
+        #Orgs with a manager, member and other roles, a user enrolled in all of them and granted a role in every
+        #other one. Each Org also has member_count other members and resource_count shared resources
+        user = registry.add(RT.ActorIdentity, name='user')
+        registry.add(RT.Org, name=ROOT_ION_ORG_NAME)
+        members = [registry.add(RT.ActorIdentity, name='member_%d' % i) for i in range(member_count)]
+
+        for i in range(org_count):
+            org = registry.add(RT.Org, name='org_%d' % i)
+            registry.associate(org, PRED.hasMembership, user)
+            for member in members:
+                registry.associate(org, PRED.hasMembership, member)
+            for j in range(resource_count):
+                registry.associate(org, PRED.hasResource, registry.add(RT.DataProduct, name='resource_%d_%d' % (i, j)))
+
+        for i, org in enumerate([res for res in registry.resources.values() if res.type_ == RT.Org]):
+            role_names = [MANAGER_ROLE, MEMBER_ROLE] + ['role_%d' % j for j in range(roles_per_org - 2)]
+            for j, name in enumerate(role_names):
+                role = registry.add(RT.UserRole, name=name, org_id=org._id)
+                registry.associate(org, PRED.hasRole, role)
+                if j == 2 and i % 2:
+                    registry.associate(user, PRED.hasRole, role)
+                    for member in members[:(i % 10)]:
+                        registry.associate(member, PRED.hasRole, role)
+
+        return user
+
+    def _find_all_roles_by_org(self, user):
+        #The roles of the user found one Org at a time
+        ret_val = dict()
+        for org in self.org_management_service._find_enrolled_orgs(user):
+            ret_val[org.name] = self.org_management_service._find_org_roles_by_user(org, user)
+        return ret_val
+
+    def test_find_all_roles_by_user(self):
+        registry = FakeResourceRegistry()
+        self.org_management_service.clients.resource_registry = registry
+        user = self._create_orgs(registry, 5, 4)
+
+        expected = self._find_all_roles_by_org(user)
+        roles = self.org_management_service.find_all_roles_by_user(user._id)
+
+        self.assertEqual(sorted(roles.keys()), sorted(expected.keys()))
+        self.assertEqual(len(roles), 6)
+        for org_name, role_list in roles.iteritems():
+            self.assertEqual([r._id for r in role_list], [r._id for r in expected[org_name]])
+            self.assertEqual(role_list[-1].name, MEMBER_ROLE)
+
+        #An Org without a membership role is inconsistent
+        registry.delete([r for r in registry.resources.values() if r.type_ == RT.UserRole and r.name == MEMBER_ROLE][0]._id)
+        with self.assertRaises(Inconsistent):
+            self.org_management_service.find_all_roles_by_user(user._id)
+
+    def test_find_all_roles_by_user_benchmark(self):
+        #Compare the registry calls, rows and time to resolve the roles of a user in 100 Orgs of 500 members and
+        #200 resources each
+        registry = FakeResourceRegistry(latency=0.0005, row_latency=0.000002)
+        self.org_management_service.clients.resource_registry = registry
+        user = self._create_orgs(registry, 100, 5, member_count=500, resource_count=200)
+        org_list = self.org_management_service._find_enrolled_orgs(user)
+
+        registry.calls = registry.rows = 0
+        start = time.time()
+        expected = self._find_all_roles_by_org(user)
+        by_org_time = time.time() - start
+        by_org_calls, by_org_rows = registry.calls, registry.rows
+
+        registry.calls = registry.rows = 0
+        start = time.time()
+        roles = self.org_management_service._find_all_org_roles_by_user(org_list, user)
+        bulk_time = time.time() - start
+        bulk_calls, bulk_rows = registry.calls, registry.rows
+
+        log.info('Roles of a user in %d Orgs: %d calls, %d rows in %f s by Org; %d calls, %d rows in %f s in bulk' %
+                 (len(roles), by_org_calls, by_org_rows, by_org_time, bulk_calls, bulk_rows, bulk_time))
+
+        self.assertEqual(dict((k, [r._id for r in v]) for k, v in roles.iteritems()),
+            dict((k, [r._id for r in v]) for k, v in expected.iteritems()))
+        self.assertEqual(bulk_calls, 2)
+        #Only the user's roles and one membership role per Org are fetched, not the Orgs' members or resources
+        self.assertEqual(bulk_rows, len(org_list) + sum(len(v) - 1 for v in roles.itervalues()))
+        self.assertLess(bulk_time, by_org_time)
+
+
 @attr('INT', group='coi')
 class TestOrgManagementServiceInt(IonIntegrationTestCase):
 
@@ -3,7 +3,7 @@
 __author__ = 'Stephen P. Henrie'
 __license__ = 'Apache 2.0'
 
-import unittest
+import unittest, time
 from mock import Mock, patch
 from pyon.util.unit_test import PyonTestCase
 from pyon.util.int_test import IonIntegrationTestCase
@@ -11,6 +11,7 @@ from nose.plugins.attrib import attr
 
 from pyon.core.exception import BadRequest, Conflict, Inconsistent, NotFound
 from pyon.public import PRED, RT, IonObject
+from pyon.util.log import log
 from ion.services.coi.policy_management_service import PolicyManagementService
 from interface.services.coi.ipolicy_management_service import PolicyManagementServiceClient
 
@@ -153,6 +154,119 @@ class TestPolicyManagementService(PyonTestCase):
         self.assertEqual(ex.message, 'Role bad role does not exist')
         self.mock_read.assert_called_once_with('bad role', '')
 
+    def _setup_service_policies(self, latency=0):
+        #An org and a service with a policy each, read from a registry taking latency seconds per call
+        org = Mock()
+        org._id = 'org_id'
+        org.name = 'Org'
+        service = Mock()
+        service._id = 'service_id'
+        service.name = 'bank'
+
+        org_policy = Mock()
+        org_policy._id = 'org_policy_id'
+        org_policy.enabled = True
+        org_policy.rule = '<Rule id="org"/>'
+        service_policy = Mock()
+        service_policy._id = 'service_policy_id'
+        service_policy.enabled = True
+        service_policy.rule = '<Rule id="service"/>'
+
+        resources = {'org_id': org, 'service_id': service, 'org_policy_id': org_policy, 'service_policy_id': service_policy}
+        self.policies = {'org_id': [org_policy], 'service_id': [service_policy]}
+
+        def read(resource_id, rev=''):
+            time.sleep(latency)
+            return resources.get(resource_id)
+
+        def find_resources(restype=None, name=None, **kwargs):
+            time.sleep(latency)
+            return [service], []
+
+        def find_objects(subject, predicate, object_type, **kwargs):
+            time.sleep(latency)
+            return list(self.policies.get(subject, [])), []
+
+        self.mock_read.side_effect = read
+        self.mock_find_resources.side_effect = find_resources
+        self.mock_find_objects.side_effect = find_objects
+        self.mock_get_association = self.policy_management_service.clients.resource_registry.get_association
+        self.mock_get_association.return_value = 'assoc_id'
+        self.policy_management_service.event_pub = Mock()
+
+        return org_policy, service_policy
+
+    def test_active_service_policy_rules_cache(self):
+        org_policy, service_policy = self._setup_service_policies()
+
+        rules = self.policy_management_service.get_active_service_policy_rules('org_id', 'bank')
+        self.assertIn('<Rule id="org"/><Rule id="service"/>', rules)
+        self.assertEqual(self.mock_find_objects.call_count, 2)
+
+        #Cached rules are returned without going to the registry
+        self.assertEqual(self.policy_management_service.get_active_service_policy_rules('org_id', 'bank'), rules)
+        self.assertEqual(self.mock_find_objects.call_count, 2)
+
+        #Disabling a policy invalidates the rules that include it
+        service_policy.enabled = False
+        self.policy_management_service.update_policy(service_policy)
+        rules = self.policy_management_service.get_active_service_policy_rules('org_id', 'bank')
+        self.assertNotIn('<Rule id="service"/>', rules)
+        self.assertEqual(self.mock_find_objects.call_count, 4)
+
+        #As does removing a policy from a resource the rules came from
+        self.policies['org_id'] = []
+        self.policy_management_service.remove_resource_policy('org_id', 'org_policy_id')
+        rules = self.policy_management_service.get_active_service_policy_rules('org_id', 'bank')
+        self.assertNotIn('<Rule id="org"/>', rules)
+
+        #And resource policy events from other processes
+        self.policies['org_id'] = [org_policy]
+        event = Mock()
+        event.origin = 'org_policy_id'
+        event.resource_id = 'org_id'
+        self.policy_management_service.resource_policy_event_callback(event)
+        rules = self.policy_management_service.get_active_service_policy_rules('org_id', 'bank')
+        self.assertIn('<Rule id="org"/>', rules)
+
+        #Resource rules are cached separately
+        rules = self.policy_management_service.get_active_resource_policy_rules('service_id')
+        self.assertNotIn('<Rule id="org"/>', rules)
+        self.assertEqual(len(self.policy_management_service.policy_rules_cache), 2)
+
+        self.policy_management_service.resource_policy_event_callback(event)
+        self.assertEqual(self.policy_management_service.policy_rules_cache.keys(), [('', 'service_id')])
+
+    def test_active_policy_rules_not_found(self):
+        self._setup_service_policies()
+
+        with self.assertRaises(NotFound):
+            self.policy_management_service.get_active_resource_policy_rules('bad')
+
+        with self.assertRaises(NotFound):
+            self.policy_management_service.get_active_service_policy_rules('bad', 'bank')
+
+        self.assertEqual(self.policy_management_service.policy_rules_cache, {})
+
+    def test_active_policy_rules_latency(self):
+        #Measure the policy decision latency with a registry taking 1 ms per call
+        self._setup_service_policies(latency=0.001)
+        count = 100
+
+        start = time.time()
+        for i in xrange(count):
+            self.policy_management_service.policy_rules_cache.clear()
+            self.policy_management_service.get_active_service_policy_rules('org_id', 'bank')
+        uncached_time = (time.time() - start) / count
+
+        start = time.time()
+        for i in xrange(count):
+            self.policy_management_service.get_active_service_policy_rules('org_id', 'bank')
+        cached_time = (time.time() - start) / count
+
+        log.info('Service policy rules: %f ms assembled, %f ms cached' % (uncached_time * 1000, cached_time * 1000))
+        self.assertLess(cached_time, uncached_time)
+
 
 @attr('INT', group='coi')
 class TestPolicyManagementServiceInt(IonIntegrationTestCase):
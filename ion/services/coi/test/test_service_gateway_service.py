@@ -6,14 +6,20 @@
 __author__ = 'Stephen P. Henrie'
 __license__ = 'Apache 2.0'
 
-import simplejson, json
+import simplejson, json, time, gzip, StringIO, hashlib
+from mock import Mock, patch
+from pyon.util.unit_test import PyonTestCase
 from pyon.util.int_test import IonIntegrationTestCase
 from nose.plugins.attrib import attr
 from webtest import TestApp
 
+from pyon.core.exception import BadRequest
 from pyon.core.registry import get_message_class_in_parm_type, getextends
+from pyon.util.lru_cache import LRUCache
 from ion.services.coi.service_gateway_service import ServiceGatewayService, app, convert_unicode, GATEWAY_RESPONSE, \
-            GATEWAY_ERROR, GATEWAY_ERROR_MESSAGE, GATEWAY_ERROR_EXCEPTION, GATEWAY_ERROR_TRACE
+            GATEWAY_ERROR, GATEWAY_ERROR_MESSAGE, GATEWAY_ERROR_EXCEPTION, GATEWAY_ERROR_TRACE, GATEWAY_PAGING, \
+            build_message_headers, get_client_operations, page_ids, buffer_chunks, gzip_chunks, \
+            json_response, gateway_json_response, build_error_response, page_find_result
 
 from interface.services.coi.iservice_gateway_service import ServiceGatewayServiceClient
 from pyon.util.containers import DictDiffer
@@ -22,6 +28,171 @@ from pyon.util.log import log
 import unittest
 import os
 
+class FakeServiceClient(object):
+
+    instances = 0
+
+    def __init__(self, node=None, process=None):
+        FakeServiceClient.instances += 1
+
+    def find_things(self, name='', count=0, headers=None):
+        return name, count
+
+    def _private(self):
+        pass
+
+@attr('UNIT', group='coi-sgs')
+class TestServiceGatewayService(PyonTestCase):
+
+    def setUp(self):
+        self.service_gateway_service = ServiceGatewayService()
+        self.service_gateway_service.name = 'service_gateway'
+        self.service_gateway_service.user_data_cache = LRUCache(10,0,0)
+        self.service_gateway_service.user_cache_expiry_ms = 60000
+        self.service_gateway_service.org_client = Mock()
+        self.service_gateway_service.service_dispatch = dict()
+        self.service_gateway_service.service_clients = dict()
+
+        patcher = patch('ion.services.coi.service_gateway_service.service_gateway_instance', self.service_gateway_service)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        role = Mock()
+        role.name = 'ION_MANAGER'
+        self.mock_find_all_roles_by_user = self.service_gateway_service.org_client.find_all_roles_by_user
+        self.mock_find_all_roles_by_user.return_value = {'ION': [role]}
+
+    def test_role_cache(self):
+        headers = build_message_headers('user1', '0')
+        self.assertEqual(headers['ion-actor-roles'], {'ION': ['ION_MANAGER']})
+        headers = build_message_headers('user1', '0')
+        self.assertEqual(headers['ion-actor-roles'], {'ION': ['ION_MANAGER']})
+        self.assertEqual(self.mock_find_all_roles_by_user.call_count, 1)
+
+        #A role change evicts the user
+        event = Mock()
+        event.origin = 'org1'
+        event.user_id = 'user1'
+        event.role_name = 'ION_MANAGER'
+        self.service_gateway_service.user_role_event_callback(event)
+        build_message_headers('user1', '0')
+        self.assertEqual(self.mock_find_all_roles_by_user.call_count, 2)
+
+        #Expired roles are looked up again
+        self.service_gateway_service.user_cache_expiry_ms = 1
+        time.sleep(0.01)
+        build_message_headers('user1', '0')
+        self.assertEqual(self.mock_find_all_roles_by_user.call_count, 3)
+
+        #Anonymous users have no roles
+        headers = build_message_headers('anonymous', '0')
+        self.assertEqual(headers['ion-actor-roles'], {})
+        self.assertEqual(self.mock_find_all_roles_by_user.call_count, 3)
+
+    @patch('ion.services.coi.service_gateway_service.Container')
+    @patch('ion.services.coi.service_gateway_service.get_message_class_in_parm_type')
+    def test_service_dispatch(self, mock_parm_type, mock_container):
+        mock_parm_type.return_value = 'str'
+        FakeServiceClient.instances = 0
+
+        self.assertEqual(get_client_operations(FakeServiceClient), ['find_things'])
+
+        entry = self.service_gateway_service.get_service_operation('fake', 'find_things', FakeServiceClient)
+        self.assertEqual(entry['args'], ['name', 'count'])
+        self.assertEqual(entry['param_types'], {'name': 'str', 'count': 'str'})
+        self.assertIsInstance(entry['client'], FakeServiceClient)
+
+        #Requests reuse the entry and the client
+        self.assertIs(self.service_gateway_service.get_service_operation('fake', 'find_things', FakeServiceClient), entry)
+        self.assertEqual(mock_parm_type.call_count, 2)
+        self.assertEqual(FakeServiceClient.instances, 1)
+
+        self.assertRaises(BadRequest, self.service_gateway_service.get_service_operation, 'fake', 'missing', FakeServiceClient)
+        self.assertRaises(BadRequest, self.service_gateway_service.get_service_operation, 'fake', '_private', FakeServiceClient)
+
+    def test_page_ids(self):
+        ids = ['a', 'b', 'c', 'd', 'e']
+
+        page, paging = page_ids(ids, 2, 0, '')
+        self.assertEqual(page, ['a', 'b'])
+        self.assertEqual(paging, {'limit': 2, 'offset': 0, 'total': 5, 'next_cursor': 'b'})
+
+        page, paging = page_ids(ids, 2, 0, paging['next_cursor'])
+        self.assertEqual(page, ['c', 'd'])
+
+        page, paging = page_ids(ids, 2, 0, paging['next_cursor'])
+        self.assertEqual(page, ['e'])
+        self.assertIsNone(paging['next_cursor'])
+
+        page, paging = page_ids(ids, 0, 3, '')
+        self.assertEqual(page, ['d', 'e'])
+        self.assertIsNone(paging['next_cursor'])
+
+    def test_streamed_json(self):
+        response_data = {'data': {GATEWAY_RESPONSE: [{'name': 'resource %d' % i} for i in range(10000)]}}
+        encoder = simplejson.JSONEncoder(separators=(',', ':'))
+
+        chunks = list(buffer_chunks(encoder.iterencode(response_data)))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(simplejson.loads(''.join(chunks)), response_data)
+
+        compressed = ''.join(gzip_chunks(iter(chunks)))
+        self.assertLess(len(compressed), len(''.join(chunks)))
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO.StringIO(compressed)).read(), ''.join(chunks))
+
+    def test_json_encoding_error(self):
+        # An object without a __dict__ can not be encoded by ion_object_encoder
+        with app.test_request_context('/ion-service/resource_registry/read'):
+            self.assertRaises(AttributeError, json_response, {'data': [object()]})
+
+            try:
+                response = gateway_json_response([object()])
+            except Exception, e:
+                response = build_error_response(e)
+
+            response_data = simplejson.loads(''.join(response.response))
+            self.assertIn(GATEWAY_ERROR, response_data['data'])
+            self.assertEqual(response_data['data'][GATEWAY_ERROR][GATEWAY_ERROR_EXCEPTION], 'AttributeError')
+
+    def test_page_find_result(self):
+        result = (['a', 'b', 'c'], ['assoc_a', 'assoc_b', 'assoc_c'])
+
+        with app.test_request_context('/ion-service/resource_registry/find_objects?limit=2&offset=1'):
+            page, paging = page_find_result(result)
+            self.assertEqual(page, (['b', 'c'], ['assoc_b', 'assoc_c']))
+            self.assertEqual(paging, {'limit': 2, 'offset': 1, 'total': 3})
+
+        with app.test_request_context('/ion-service/resource_registry/find_objects?limit=2&cursor=a'):
+            self.assertRaises(BadRequest, page_find_result, result)
+
+    @patch('ion.services.coi.service_gateway_service.Container')
+    @patch('ion.services.coi.service_gateway_service.VisualizationServiceProcessClient', autospec=True)
+    def test_viz_image_conditional(self, mock_client_class, mock_container):
+        image = '\x89PNG image'
+        etag = hashlib.sha1(image).hexdigest()
+        vs_cli = mock_client_class.return_value
+        vs_cli.get_image.return_value = image
+        self.service_gateway_service.trusted_originators = None
+        test_app = TestApp(app)
+
+        #The image is sent with its ETag
+        response = test_app.get('/ion-viz-products/image/dp1/temp.png')
+        self.assertEqual(response.body, image)
+        self.assertEqual(response.headers['ETag'], '"%s"' % etag)
+        self.assertEqual(response.headers['Cache-Control'], 'no-cache')
+        vs_cli.get_image.assert_called_with('dp1', 'temp.png')
+
+        #A client holding the current image is not sent it
+        response = test_app.get('/ion-viz-products/image/dp1/temp.png', headers={'If-None-Match': '"%s"' % etag}, status=304)
+        self.assertEqual(response.body, '')
+        self.assertEqual(response.headers['ETag'], '"%s"' % etag)
+
+        #A replaced image is sent with its own ETag
+        vs_cli.get_image.return_value = '\x89PNG new image'
+        response = test_app.get('/ion-viz-products/image/dp1/temp.png', headers={'If-None-Match': '"%s"' % etag})
+        self.assertEqual(response.body, '\x89PNG new image')
+        self.assertEqual(response.headers['ETag'], '"%s"' % hashlib.sha1('\x89PNG new image').hexdigest())
+
 @attr('LOCOINT', 'INT', group='coi-sgs')
 @unittest.skipIf(os.getenv('CEI_LAUNCH_TEST', False), 'Skip test while in CEI LAUNCH mode')
 class TestServiceGatewayServiceInt(IonIntegrationTestCase):
@@ -280,3 +451,54 @@ class TestServiceGatewayServiceInt(IonIntegrationTestCase):
         self.assertEqual(data_product_id, data_product_obj['_id'])
 
         self.delete_data_product_resource(data_product_id)
+
+    def test_list_resources_by_type_paging(self):
+
+        data_product_ids = sorted([self.create_data_product_resource() for i in range(3)])
+
+        response = self.test_app.get('/ion-service/rest/find_resources/DataProduct?limit=2')
+        self.check_response_headers(response)
+        response_data = response.json['data'][GATEWAY_RESPONSE]
+        paging = response.json['data'][GATEWAY_PAGING]
+        self.assertEqual([convert_unicode(obj['_id']) for obj in response_data], data_product_ids[:2])
+        self.assertEqual(paging['total'], 3)
+        self.assertEqual(paging['next_cursor'], data_product_ids[1])
+
+        response = self.test_app.get('/ion-service/rest/find_resources/DataProduct?limit=2&cursor=' + paging['next_cursor'])
+        response_data = response.json['data'][GATEWAY_RESPONSE]
+        paging = response.json['data'][GATEWAY_PAGING]
+        self.assertEqual([convert_unicode(obj['_id']) for obj in response_data], data_product_ids[2:])
+        self.assertIsNone(paging['next_cursor'])
+
+        response = self.test_app.get('/ion-service/rest/find_resources/DataProduct?limit=-1')
+        self.assertIn(GATEWAY_ERROR, response.json['data'])
+
+        response = self.test_app.get('/ion-service/resource_registry/find_resources?restype=DataProduct&id_only=True&limit=1&offset=1')
+        response_data = response.json['data'][GATEWAY_RESPONSE]
+        self.assertEqual(len(response_data[0]), 1)
+        self.assertEqual(response.json['data'][GATEWAY_PAGING]['total'], 3)
+
+        response = self.test_app.get('/ion-service/rest/find_resources/DataProduct', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        response_data = simplejson.loads(gzip.GzipFile(fileobj=StringIO.StringIO(response.body)).read())
+        self.assertEqual(len(response_data['data'][GATEWAY_RESPONSE]), 3)
+
+        for data_product_id in data_product_ids:
+            self.delete_data_product_resource(data_product_id)
+
+    def test_gateway_request_rate(self):
+
+        count = 200
+        url = '/ion-service/resource_registry/find_resources?name=TestDataProduct&id_only=True'
+
+        response = self.test_app.get(url)
+        self.check_response_headers(response)
+        self.assertIn(GATEWAY_RESPONSE, response.json['data'])
+
+        start_time = time.time()
+        for i in range(count):
+            response = self.test_app.get(url)
+        elapsed = time.time() - start_time
+        self.assertIn(GATEWAY_RESPONSE, response.json['data'])
+
+        log.info('Service Gateway handled %d requests in %f s: %f requests/s' % (count, elapsed, count / elapsed))
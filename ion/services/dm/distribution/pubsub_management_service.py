@@ -322,7 +322,7 @@ class PubsubManagementService(BasePubsubManagementService):
                 if subscription.is_active:
                     self._bind_subscription(self.XP,subscription.exchange_name, '%s.data' % stream_id)
 
-            subscription.query.stream_ids = current_streams
+            subscription.query.stream_ids = list(updated_streams)
             id, rev = self.clients.resource_registry.update(subscription)
             return True
 
@@ -13,13 +13,14 @@ from pyon.core.exception import NotFound
 from pyon.public import RT, PRED, log, IonObject
 from pyon.public import CFG
 from pyon.core.exception import IonException
-from interface.objects import ExchangeQuery, IngestionConfiguration, ProcessDefinition
+from interface.objects import ExchangeQuery, StreamQuery, IngestionConfiguration, ProcessDefinition
 from interface.objects import DatasetIngestionConfiguration, DatasetIngestionByStream, DatasetIngestionTypeEnum
 from pyon.event.event import EventPublisher
 from pyon.core.object import IonObjectSerializer, IonObjectBase
 
 
 from pyon.datastore.datastore import DataStore
+from ion.services.dm.utility.hash_ring import HashRing
 
 
 
@@ -53,10 +54,14 @@ class IngestionManagementService(BaseIngestionManagementService):
         self.serializer = IonObjectSerializer()
         self.process_definition_id = None
 
+        # When True each ingestion worker gets its own subscription and owns the streams the hash ring assigns to it
+        self.partition_streams = False
+
 
     def on_start(self):
         super(IngestionManagementService,self).on_start()
         self.event_publisher = EventPublisher(event_type="DatasetIngestionConfigurationEvent")
+        self.partition_streams = self.CFG.get_safe('process.partition_streams', False)
 
         res_list , _ = self.clients.resource_registry.find_resources(
             restype=RT.ProcessDefinition,
@@ -89,12 +94,15 @@ class IngestionManagementService(BaseIngestionManagementService):
         # Give each ingestion configuration its own queue name to receive data on
         exchange_name = 'ingestion_queue'
 
-        ##------------------------------------------------------------------------------------
-        ## declare our intent to subscribe to all messages on the exchange point
-        query = ExchangeQuery()
+        subscription_id = None
+        if not self.partition_streams:
+            ##------------------------------------------------------------------------------------
+            ## declare our intent to subscribe to all messages on the exchange point
+            query = ExchangeQuery()
 
-        subscription_id = self.clients.pubsub_management.create_subscription(query=query,\
-            exchange_name=exchange_name, name='Ingestion subscription', description='Subscription for ingestion workers')
+            subscription_id = self.clients.pubsub_management.create_subscription(query=query,\
+                exchange_name=exchange_name, name='Ingestion subscription', description='Subscription for ingestion workers')
+        # Partitioned workers each create their own stream subscription in _launch_transforms
 
         ##------------------------------------------------------------------------------------------
 
@@ -127,6 +135,11 @@ class IngestionManagementService(BaseIngestionManagementService):
         This method spawns the two transform processes without activating them...Note: activating the transforms does the binding
         """
 
+        if self.partition_streams:
+            self._launch_partitioned_transforms(range(number_of_workers), number_of_workers, ingestion_configuration_id,
+                ingestion_configuration, process_definition_id)
+            return
+
         description = 'Ingestion worker'
 
         configuration = self.serializer.serialize(ingestion_configuration)
@@ -151,14 +164,149 @@ class IngestionManagementService(BaseIngestionManagementService):
             self.clients.resource_registry.create_association(ingestion_configuration_id, PRED.hasTransform, transform_id)
 
 
+    @staticmethod
+    def _worker_names(number_of_workers):
+        return ['worker_%d' % (i+1) for i in xrange(number_of_workers)]
+
+    def _launch_partitioned_transforms(self, indices, number_of_workers, ingestion_configuration_id, ingestion_configuration, process_definition_id):
+        """
+        Spawns a worker for each index with its own, initially empty, stream subscription. Streams are bound to a
+        worker's subscription as dataset configurations assign them, so each stream is only ever ingested by one worker
+        and in order.
+        """
+        description = 'Ingestion worker'
+
+        configuration = self.serializer.serialize(ingestion_configuration)
+        configuration.pop('type_')
+        configuration['configuration_id'] = ingestion_configuration_id
+
+        workers = self._worker_names(number_of_workers)
+
+        transform_ids = []
+        for i in indices:
+            worker = workers[i]
+            subscription_id = self.clients.pubsub_management.create_subscription(query=StreamQuery(stream_ids=[]),
+                exchange_name='%s_%s_%s' % (self.base_exchange_name, ingestion_configuration_id, worker),
+                name='Ingestion subscription %s' % worker, description='Subscription for ingestion %s' % worker)
+
+            # The worker reads the streams it owns from its subscription, which _rebalance keeps current
+            worker_configuration = dict(configuration)
+            worker_configuration['partition'] = {'worker':worker, 'subscription_id':subscription_id}
+
+            name = '(%s)_Ingestion_Worker_%s' % (ingestion_configuration_id, i+1)
+            transform_id = self.clients.transform_management.create_transform(
+                name = name,
+                description = description,
+                in_subscription_id= subscription_id,
+                out_streams = {},
+                process_definition_id=process_definition_id,
+                configuration=worker_configuration)
+
+            if not transform_id:
+                raise IngestionManagementServiceException('Transform could not be launched by ingestion.')
+            self.clients.resource_registry.create_association(ingestion_configuration_id, PRED.hasTransform, transform_id)
+            transform_ids.append(transform_id)
+
+        return transform_ids
+
+    def _partitioned_workers(self, ingestion_configuration_id):
+        """
+        @brief Finds the workers of a partitioned ingestion configuration
+        @param ingestion_configuration_id str
+        @retval dict of worker name : (transform_id, subscription)
+        """
+        transforms, _ = self.clients.resource_registry.find_objects(ingestion_configuration_id, PRED.hasTransform, RT.Transform, False)
+        workers = {}
+        for transform in transforms:
+            worker = (transform.configuration.get('partition') or {}).get('worker')
+            if worker is None:
+                raise IngestionManagementServiceException('Ingestion worker %s has no partition configuration!' % transform._id)
+            subscription_ids, _ = self.clients.resource_registry.find_objects(transform._id, PRED.hasSubscription, RT.Subscription, True)
+            if not subscription_ids:
+                raise IngestionManagementServiceException('Ingestion worker %s has no subscription!' % transform._id)
+            workers[worker] = (transform._id, self.clients.pubsub_management.read_subscription(subscription_ids[0]))
+        return workers
+
+    def _set_worker_streams(self, subscription, stream_ids):
+        self.clients.pubsub_management.update_subscription(subscription._id, StreamQuery(stream_ids=list(stream_ids)))
+
+    def _assign_stream(self, ingestion_configuration_id, stream_id):
+        """
+        Binds the stream to the subscription of the worker that owns it on the hash ring
+        """
+        workers = self._partitioned_workers(ingestion_configuration_id)
+        if not workers:
+            raise NotFound('No transforms associated with this ingestion configuration!')
+
+        worker = HashRing(workers.keys()).get_node(stream_id)
+        _, subscription = workers[worker]
+        stream_ids = list(subscription.query.stream_ids or [])
+        if stream_id not in stream_ids:
+            log.debug('Assigning stream %s to ingestion %s', stream_id, worker)
+            self._set_worker_streams(subscription, stream_ids + [stream_id])
+
+    def _rebalance(self, ingestion_configuration_id, ingestion_configuration):
+        """
+        Launches or removes workers to match number_of_workers and moves the streams whose owner changed on the hash
+        ring. Moved streams are unbound from their old owner before they are bound to the new one, so no packet is
+        ingested by two workers; packets published in between are not delivered.
+        """
+        number_of_workers = ingestion_configuration.number_of_workers
+        workers = self._partitioned_workers(ingestion_configuration_id)
+        names = self._worker_names(number_of_workers)
+
+        active = any(subscription.is_active for _, subscription in workers.values())
+        missing = [i for i, name in enumerate(names) if name not in workers]
+        if missing:
+            transform_ids = self._launch_partitioned_transforms(missing, number_of_workers, ingestion_configuration_id,
+                ingestion_configuration, self.process_definition_id)
+            if active:
+                for transform_id in transform_ids:
+                    self.clients.transform_management.activate_transform(transform_id)
+            workers = self._partitioned_workers(ingestion_configuration_id)
+
+        current = dict((name, set(subscription.query.stream_ids or [])) for name, (_, subscription) in workers.iteritems())
+        stream_ids = set()
+        for streams in current.values():
+            stream_ids.update(streams)
+
+        assignment = dict((name, set(streams)) for name, streams in HashRing(names).partition(stream_ids).iteritems())
+
+        # Unbind first: stop the workers leaving the ring and take the moved streams off their old owners
+        for name, (transform_id, subscription) in workers.iteritems():
+            if name not in names:
+                if subscription.is_active:
+                    self.clients.transform_management.deactivate_transform(transform_id)
+            elif current[name].difference(assignment[name]):
+                current[name].intersection_update(assignment[name])
+                self._set_worker_streams(subscription, current[name])
+
+        # Then bind the moved streams to their new owners
+        for name in names:
+            if assignment[name].difference(current[name]):
+                self._set_worker_streams(workers[name][1], assignment[name])
+
+        for name, (transform_id, subscription) in workers.iteritems():
+            if name not in names:
+                self.clients.transform_management.delete_transform(transform_id)
+                self.clients.pubsub_management.delete_subscription(subscription._id)
+
     def update_ingestion_configuration(self, ingestion_configuration=None):
         """Change the number of workers or the default policy for ingesting data on each stream
 
         @param ingestion_configuration    IngestionConfiguration
         """
         log.debug("Updating ingestion configuration")
+        previous = None
+        if self.partition_streams:
+            previous = self.clients.resource_registry.read(ingestion_configuration._id)
+
         id, rev = self.clients.resource_registry.update(ingestion_configuration)
 
+        if previous is not None and previous.number_of_workers != ingestion_configuration.number_of_workers:
+            log.info('Rebalancing ingestion configuration %s onto %d workers', id, ingestion_configuration.number_of_workers)
+            self._rebalance(id, ingestion_configuration)
+
     def read_ingestion_configuration(self, ingestion_configuration_id=''):
         """Get an existing ingestion configuration object.
 
@@ -226,6 +374,12 @@ class IngestionManagementService(BaseIngestionManagementService):
         if len(transform_ids) < 1:
             raise NotFound('The ingestion configuration %s does not exist' % str(ingestion_configuration_id))
 
+        if self.partition_streams:
+            # partitioned workers each have their own subscription
+            for transform_id in transform_ids:
+                self.clients.transform_management.activate_transform(transform_id)
+            return True
+
         # since all ingestion worker transforms have the same subscription, only deactivate one
         self.clients.transform_management.activate_transform(transform_ids[0])
 
@@ -250,6 +404,12 @@ class IngestionManagementService(BaseIngestionManagementService):
         if len(transform_ids) < 1:
             raise NotFound('The ingestion configuration %s does not exist' % str(ingestion_configuration_id))
 
+        if self.partition_streams:
+            # partitioned workers each have their own subscription
+            for transform_id in transform_ids:
+                self.clients.transform_management.deactivate_transform(transform_id)
+            return True
+
         # since all ingestion worker transforms have the same subscription, only deactivate one
         self.clients.transform_management.deactivate_transform(transform_ids[0])
 
@@ -321,6 +481,9 @@ class IngestionManagementService(BaseIngestionManagementService):
 
         self.clients.resource_registry.create_association(dataset_id, PRED.hasIngestionConfiguration, ingestion_configuration_id)
 
+        if self.partition_streams:
+            self._assign_stream(ingestion_configuration_id, stream_id)
+
         self.event_publisher.publish_event(
             origin=ingestion_configuration_id, # Use the ingestion configuration ID as the origin!
             description = dset_ingest_config.description,
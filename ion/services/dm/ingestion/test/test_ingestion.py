@@ -10,11 +10,13 @@ import gevent
 from gevent.timeout import Timeout
 from pyon.util.async import spawn
 
-from mock import Mock
+from mock import Mock, patch
 from prototype.sci_data.stream_defs import SBE37_CDM_stream_definition, ctd_stream_packet
 from pyon.util.unit_test import PyonTestCase
 from pyon.util.int_test import IonIntegrationTestCase
 from ion.services.dm.ingestion.ingestion_management_service import IngestionManagementService
+from ion.processes.data.ingestion.ingestion_worker import IngestionWorker
+from ion.services.dm.utility.hash_ring import HashRing
 from nose.plugins.attrib import attr
 from pyon.core.exception import NotFound, BadRequest
 from pyon.public import StreamPublisherRegistrar, CFG
@@ -27,7 +29,7 @@ from interface.services.coi.iresource_registry_service import ResourceRegistrySe
 from pyon.public import RT, PRED, log, IonObject
 
 from pyon.datastore.datastore import DataStore
-from interface.objects import ExchangeQuery, DatasetIngestionConfiguration
+from interface.objects import ExchangeQuery, DatasetIngestionConfiguration, IngestionConfiguration
 from pyon.ion.process import StandaloneProcess
 
 from pyon.event.event import EventSubscriber
@@ -332,6 +334,252 @@ class IngestionTest(PyonTestCase):
         self.assertEqual(ex.message, 'The ingestion configuration wrong_configuration_id does not exist')
 
 
+    def test_launch_partitioned_transforms(self):
+        """
+        Test that partitioned workers each get their own stream subscription and partition config
+        """
+        service = IngestionManagementService()
+        service.clients = self._create_service_mock('ingestion_management')
+        service.partition_streams = True
+        service.clients.pubsub_management.create_subscription.side_effect = ['sub_1', 'sub_2']
+        service.clients.transform_management.create_transform.side_effect = ['transform_1', 'transform_2']
+
+        service._launch_transforms(2, None, 'ingest_config_id', IngestionConfiguration(), 'process_definition_id')
+
+        self.assertEquals(service.clients.pubsub_management.create_subscription.call_count, 2)
+        exchange_names = [c[1]['exchange_name'] for c in service.clients.pubsub_management.create_subscription.call_args_list]
+        self.assertEquals(len(set(exchange_names)), 2)
+
+        configurations = [c[1]['configuration'] for c in service.clients.transform_management.create_transform.call_args_list]
+        self.assertEquals([c['partition']['worker'] for c in configurations], ['worker_1', 'worker_2'])
+        self.assertEquals([c['partition']['subscription_id'] for c in configurations], ['sub_1', 'sub_2'])
+        self.assertEquals(service.clients.resource_registry.create_association.call_count, 2)
+
+    def test_assign_stream(self):
+        """
+        Test that a dataset's stream is bound to exactly one partitioned worker
+        """
+        self.ingestion_service.partition_streams = True
+        subscriptions = {}
+        workers = {}
+        for worker in ('worker_1', 'worker_2'):
+            subscription = Mock()
+            subscription._id = 'sub_%s' % worker
+            subscription.query.stream_ids = []
+            subscriptions[subscription._id] = subscription
+            workers[worker] = ('transform_%s' % worker, subscription)
+        self.ingestion_service._partitioned_workers = Mock(return_value=workers)
+        mock_update = self.ingestion_service.clients.pubsub_management.update_subscription
+
+        self.ingestion_service._assign_stream('ingest_config_id', 'stream_id')
+
+        self.assertEquals(mock_update.call_count, 1)
+        subscription_id, query = mock_update.call_args[0]
+        self.assertIn(subscription_id, subscriptions)
+        self.assertEquals(query.stream_ids, ['stream_id'])
+
+    def _partitioned_deployment(self, number_of_workers, stream_ids):
+        """
+        Fakes active partitioned workers with the streams bound as the hash ring assigns them. Every subscription update
+        records whether a stream is bound to more than one active worker
+        """
+        self.workers = {}
+        self.double_bound = []
+
+        def add_worker(name, streams, is_active):
+            subscription = Mock()
+            subscription._id = 'sub_%s' % name
+            subscription.query.stream_ids = list(streams)
+            subscription.is_active = is_active
+            self.workers[name] = ('transform_%s' % name, subscription)
+            return 'transform_%s' % name
+
+        def subscription_of(transform_id):
+            return [subscription for t, subscription in self.workers.values() if t == transform_id][0]
+
+        def update_subscription(subscription_id, query):
+            [subscription for _, subscription in self.workers.values() if subscription._id == subscription_id][0].query.stream_ids = list(query.stream_ids)
+            bound = [stream_id for _, subscription in self.workers.values() if subscription.is_active for stream_id in subscription.query.stream_ids]
+            self.double_bound.extend(stream_id for stream_id in set(bound) if bound.count(stream_id) > 1)
+
+        def launch(indices, number_of_workers, *args):
+            names = IngestionManagementService._worker_names(number_of_workers)
+            return [add_worker(names[i], [], False) for i in indices]
+
+        def set_active(is_active):
+            def callback(transform_id):
+                subscription_of(transform_id).is_active = is_active
+            return callback
+
+        def delete_transform(transform_id):
+            for name, (t, _) in self.workers.items():
+                if t == transform_id:
+                    del self.workers[name]
+
+        names = IngestionManagementService._worker_names(number_of_workers)
+        for name, streams in HashRing(names).partition(stream_ids).iteritems():
+            add_worker(name, streams, True)
+
+        service = self.ingestion_service
+        service._partitioned_workers = Mock(side_effect=lambda ingestion_configuration_id: dict(self.workers))
+        service._launch_partitioned_transforms = Mock(side_effect=launch)
+        service.clients.pubsub_management.update_subscription.side_effect = update_subscription
+        service.clients.transform_management.activate_transform.side_effect = set_active(True)
+        service.clients.transform_management.deactivate_transform.side_effect = set_active(False)
+        service.clients.transform_management.delete_transform.side_effect = delete_transform
+
+    def _assert_balanced(self, number_of_workers, stream_ids):
+        names = IngestionManagementService._worker_names(number_of_workers)
+        self.assertEquals(sorted(self.workers.keys()), names)
+        assignment = HashRing(names).partition(stream_ids)
+        for name, (_, subscription) in self.workers.iteritems():
+            self.assertTrue(subscription.is_active)
+            self.assertEquals(sorted(subscription.query.stream_ids), sorted(assignment[name]))
+        self.assertEquals(self.double_bound, [])
+
+    def test_rebalance_grow(self):
+        stream_ids = ['stream_%d' % i for i in xrange(50)]
+        self._partitioned_deployment(2, stream_ids)
+        ingestion_configuration = IngestionConfiguration(number_of_workers=3)
+
+        self.ingestion_service._rebalance('ingest_config_id', ingestion_configuration)
+
+        self._assert_balanced(3, stream_ids)
+        self.assertEquals(self.ingestion_service._launch_partitioned_transforms.call_args[0][0], [2])
+        self.assertFalse(self.mock_transform_delete.called)
+
+    def test_rebalance_shrink(self):
+        stream_ids = ['stream_%d' % i for i in xrange(50)]
+        self._partitioned_deployment(3, stream_ids)
+        ingestion_configuration = IngestionConfiguration(number_of_workers=2)
+
+        self.ingestion_service._rebalance('ingest_config_id', ingestion_configuration)
+
+        self._assert_balanced(2, stream_ids)
+        self.mock_transform_deactivate.assert_called_once_with('transform_worker_3')
+        self.mock_transform_delete.assert_called_once_with('transform_worker_3')
+        self.ingestion_service.clients.pubsub_management.delete_subscription.assert_called_once_with('sub_worker_3')
+
+
+@attr('UNIT', group='dm')
+class IngestionWorkerBatchTest(PyonTestCase):
+
+    def setUp(self):
+        self.worker = IngestionWorker()
+        with patch('ion.processes.data.ingestion.ingestion_worker.EventPublisher'):
+            self.worker.on_init()
+        self.worker.db = Mock()
+        self.worker.db._ion_object_to_persistence_dict = lambda obj: {'obj':obj}
+        self.worker.batch_size = 3
+        self.worker.batch_latency = 60.0
+
+        self.dset_config = Mock()
+        self.dset_config.dataset_id = 'dataset_id'
+        self.dset_config.stream_id = 'stream_id'
+
+    def _attributes(self, records):
+        return {'variables':['temperature'], 'number_of_records':records, 'updated_metadata':True, 'updated_data':False}
+
+    def test_batch_flush_on_size(self):
+        for i in xrange(2):
+            self.worker.persist_immutable('granule_%d' % i)
+            self.worker._add_to_batch('granule_%d' % i, self.dset_config, self._attributes(10))
+
+        self.assertFalse(self.worker.db.create_doc_mult.called)
+        self.assertFalse(self.worker.event_pub.publish_event.called)
+
+        self.worker.persist_immutable('granule_2')
+        self.worker._add_to_batch('granule_2', self.dset_config, self._attributes(5))
+
+        self.assertEquals(self.worker.db.create_doc_mult.call_count, 1)
+        docs = self.worker.db.create_doc_mult.call_args[0][0]
+        self.assertEquals(len(docs), 3)
+        self.assertFalse(self.worker.db.create_doc.called)
+
+        self.assertEquals(self.worker.event_pub.publish_event.call_count, 1)
+        ingest_attributes = self.worker.event_pub.publish_event.call_args[1]['ingest_attributes']
+        self.assertEquals(ingest_attributes['number_of_records'], 25)
+        self.assertEquals(ingest_attributes['number_of_granules'], 3)
+        self.assertEquals(ingest_attributes['variables'], ['temperature'])
+        self.assertEquals(self.worker._batch, [])
+
+    def test_batch_duplicate_docs(self):
+        self.worker.persist_immutable('granule')
+        self.worker.persist_immutable('granule')
+        self.worker._add_to_batch('granule', self.dset_config, self._attributes(1))
+        self.worker.flush_batch()
+
+        docs = self.worker.db.create_doc_mult.call_args[0][0]
+        self.assertEquals(len(docs), 1)
+
+    def test_batch_bulk_refused(self):
+        self.worker.db.create_doc_mult.side_effect = BadRequest('conflict')
+        self.worker.persist_immutable('granule')
+        self.worker._add_to_batch('granule', self.dset_config, self._attributes(1))
+        self.worker.flush_batch()
+
+        self.assertEquals(self.worker.db.create_doc.call_count, 1)
+
+    def test_batch_files_written_first(self):
+        calls = []
+        self.worker.db.create_doc_mult.side_effect = lambda *args, **kwargs: calls.append('docs')
+        self.worker.event_pub.publish_event.side_effect = lambda *args, **kwargs: calls.append('event')
+
+        self.worker.persist_immutable('granule')
+        self.worker._batch_files.append(('granule.hdf5', 'values'))
+        self.worker._add_to_batch('granule', self.dset_config, self._attributes(1))
+
+        with patch.object(IngestionWorker, '_write_file', side_effect=lambda *args: calls.append('file')):
+            self.worker.flush_batch()
+
+        self.assertEquals(calls, ['file', 'docs', 'event'])
+
+
+
+@attr('UNIT', group='dm')
+class IngestionWorkerPartitionTest(PyonTestCase):
+
+    def setUp(self):
+        self.worker = IngestionWorker()
+        with patch('ion.processes.data.ingestion.ingestion_worker.EventPublisher'):
+            self.worker.on_init()
+        self.worker.partition_subscription_id = 'subscription_id'
+        self.worker.ingest_config_id = 'ingest_config_id'
+        self.worker.dataset_configs = {}
+        self.worker.resource_reg_client = Mock()
+
+        self.subscription = Mock()
+        self.subscription.query.stream_ids = ['stream_1']
+        self.worker.resource_reg_client.read.return_value = self.subscription
+
+    def test_owns_stream(self):
+        self.assertTrue(self.worker.owns_stream('stream_1'))
+        self.assertFalse(self.worker.owns_stream('stream_2'))
+
+        # A rebalance moves stream_2 onto the worker's subscription
+        self.subscription.query.stream_ids = ['stream_1', 'stream_2']
+        self.assertTrue(self.worker.owns_stream('stream_2'))
+        self.worker.resource_reg_client.read.assert_called_with('subscription_id')
+
+    def test_lookup_retry(self):
+        dset_config = Mock()
+        dset_config._id = 'dset_config_id'
+        dset_config.configuration.stream_id = 'stream_1'
+        mock_find_resources = self.worker.resource_reg_client.find_resources
+        mock_find_resources.return_value = [], None
+        self.worker.resource_reg_client.find_objects.return_value = ['ingest_config_id'], None
+
+        self.assertIsNone(self.worker.lookup_dataset_config('stream_1'))
+        # A failed lookup is not repeated within the interval
+        self.assertIsNone(self.worker.lookup_dataset_config('stream_1'))
+        self.assertEquals(mock_find_resources.call_count, 1)
+
+        mock_find_resources.return_value = [dset_config], None
+        self.worker._config_lookups['stream_1'] -= self.worker.config_lookup_interval
+        self.assertEquals(self.worker.lookup_dataset_config('stream_1'), dset_config)
+        self.assertEquals(self.worker.dataset_configs['stream_1'], dset_config)
+        self.assertNotIn('stream_1', self.worker._config_lookups)
+
 @attr('INT', group='dm')
 class IngestionManagementServiceIntTest(IonIntegrationTestCase):
 
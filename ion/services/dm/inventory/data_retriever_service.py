@@ -48,6 +48,9 @@ class DataRetrieverService(BaseDataRetrieverService):
         """
         delivery_format
             - fields
+            - time (inclusive lower and upper bound in the time coordinate)
+            - records
+            - streaming (publish records sized granules while reading instead of merging the dataset first)
         """
         if not dataset_id:
             raise BadRequest('(Data Retriever Service %s): No dataset provided.' % self.name)
@@ -167,6 +167,49 @@ class DataRetrieverServiceTest(PyonTestCase):
         self.mock_pd_cancel.assert_called_with('1')
 
 
+@attr('UNIT',group='dm')
+class ReplayProcessUnitTest(PyonTestCase):
+    def setUp(self):
+        self.replay = ReplayProcess()
+
+    def test_time_slice(self):
+        import numpy as np
+        time_vector = np.arange(1,201, dtype=np.float64)
+
+        slice_ = ReplayProcess._time_slice(time_vector, (101,171))
+        self.assertEquals((slice_.start, slice_.stop), (100, 171))
+        self.assertEquals(len(time_vector[slice_]), 71)
+
+        slice_ = ReplayProcess._time_slice(time_vector, (100.5,101.5))
+        self.assertEquals(time_vector[slice_].tolist(), [101.0])
+
+        slice_ = ReplayProcess._time_slice(time_vector, (300,400))
+        self.assertFalse(slice_.stop > slice_.start)
+
+    def test_in_time_bounds(self):
+        granule = StreamGranuleContainer()
+        self.assertTrue(ReplayProcess._in_time_bounds(granule, (0,10)))
+
+        granule.identifiables['time_bounds'] = DotDict({'value_pair':[5,15]})
+        self.assertTrue(ReplayProcess._in_time_bounds(granule, (0,10)))
+        self.assertTrue(ReplayProcess._in_time_bounds(granule, (15,20)))
+        self.assertFalse(ReplayProcess._in_time_bounds(granule, (16,20)))
+        self.assertFalse(ReplayProcess._in_time_bounds(granule, (0,4)))
+
+    def test_get_time_index(self):
+        import numpy as np
+        self.replay.data_stream_id = 'data_stream'
+        granule = StreamGranuleContainer()
+        granule.identifiables['data_stream'] = DotDict({'values':'hdf'})
+        self.replay._time_vector = Mock(return_value=np.array([1.,2.,2.,4.,8.]))
+
+        self.assertEquals(self.replay._get_time_index(granule, 0.), 0)
+        self.assertEquals(self.replay._get_time_index(granule, 2.), 1)
+        self.assertEquals(self.replay._get_time_index(granule, 3.), 2)
+        self.assertEquals(self.replay._get_time_index(granule, 5.), 3)
+        self.assertEquals(self.replay._get_time_index(granule, 9.), 4)
+
+
 
 
 @attr('INT', group='dm')
@@ -433,3 +476,56 @@ class DataRetrieverServiceIntTest(IonIntegrationTestCase):
             assertions(not cc.proc_manager.procs.has_key(pid),'Process was not terminated correctly.')
 
 
+
+    def test_streaming_replay(self):
+        self.make_some_data()
+        dsm_cli = self.dsm_cli
+        dr_cli = self.dr_cli
+        rr_cli = self.rr_cli
+        pubsub_cli = self.ps_cli
+        assertions = self.assertTrue
+        cc = self.container
+        incr_lock = RLock()
+        dataset_id = dsm_cli.create_dataset(stream_id='I am very special', datastore_name=self.datastore_name, view_name='datasets/dataset_by_id')
+        replay_id, stream_id = dr_cli.define_replay(dataset_id=dataset_id, delivery_format={'fields':['temperature'], 'time':(101,171),'records':10, 'streaming':True})
+
+        definition = pubsub_cli.find_stream_definition(stream_id=stream_id,id_only=False).container
+        data_stream_id = definition.data_stream_id
+        encoding_id = definition.identifiables[data_stream_id].encoding_id
+        element_count_id = definition.identifiables[data_stream_id].element_count_id
+
+        replay = rr_cli.read(replay_id)
+        pid = replay.process_id
+
+        result = gevent.event.AsyncResult()
+        records_rcvd = gevent.queue.Queue()
+
+        def check_msg(msg, header):
+            assertions(isinstance(msg, StreamGranuleContainer), 'Msg is not a container')
+            hdf_string = msg.identifiables[msg.data_stream_id].values
+            sha1 = hashlib.sha1(hdf_string).hexdigest().upper()
+
+            assertions(sha1 == msg.identifiables[encoding_id].sha1, 'Checksum doesn\'t match.')
+            record_count = msg.identifiables[element_count_id].value
+            assertions(record_count>0 and record_count<=10, 'record count size is incorrect.')
+
+            incr_lock.acquire()
+            if not records_rcvd.empty():
+                initial_value = records_rcvd.get()
+            else:
+                initial_value = 0
+            total = initial_value + record_count
+            records_rcvd.put(total)
+            if total == 71:
+                result.set(True)
+            incr_lock.release()
+
+        self.start_listener(stream_id=stream_id, callback=check_msg)
+
+        dr_cli.start_replay(replay_id=replay_id)
+
+        assertions(result.get(timeout=10), 'Did not receive a msg from replay')
+
+        dr_cli.cancel_replay(replay_id=replay_id)
+        if not (os.getenv('CEI_LAUNCH_TEST', False)):
+            assertions(not cc.proc_manager.procs.has_key(pid),'Process was not terminated correctly.')
@@ -0,0 +1,68 @@
+'''
+@file ion/services/dm/utility/hash_ring.py
+@description Consistent hash ring used to assign streams to ingestion workers
+'''
+import bisect
+import hashlib
+
+
+class HashRing(object):
+    '''
+    Maps keys onto a set of nodes so that adding or removing a node only moves the keys that node gains or loses,
+    roughly 1/N of them.
+    '''
+
+    def __init__(self, nodes=None, replicas=64):
+        '''
+        @param nodes iterable of node names
+        @param replicas number of points each node places on the ring, more points give a more even spread
+        '''
+        self.replicas = replicas
+        self._ring = {}
+        self._points = []
+        for node in nodes or []:
+            self.add_node(node)
+
+    @staticmethod
+    def _hash(key):
+        return long(hashlib.md5(key).hexdigest()[:16], 16)
+
+    @property
+    def nodes(self):
+        return sorted(set(self._ring.values()))
+
+    def add_node(self, node):
+        for i in xrange(self.replicas):
+            point = self._hash('%s:%d' % (node, i))
+            if point not in self._ring:
+                bisect.insort(self._points, point)
+            self._ring[point] = node
+
+    def remove_node(self, node):
+        for i in xrange(self.replicas):
+            point = self._hash('%s:%d' % (node, i))
+            if self._ring.get(point) == node:
+                del self._ring[point]
+                self._points.remove(point)
+
+    def get_node(self, key):
+        '''
+        @brief Finds the node that owns key
+        @param key str
+        @retval node name or None if the ring is empty
+        '''
+        if not self._points:
+            return None
+        i = bisect.bisect(self._points, self._hash(key)) % len(self._points)
+        return self._ring[self._points[i]]
+
+    def partition(self, keys):
+        '''
+        @brief Groups keys by the node that owns them
+        @param keys iterable of str
+        @retval dict of node : list of keys, every node is present
+        '''
+        retval = dict((node, []) for node in self.nodes)
+        for key in keys:
+            retval[self.get_node(key)].append(key)
+        return retval
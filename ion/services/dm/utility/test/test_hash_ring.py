@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+'''
+@file ion/services/dm/utility/test/test_hash_ring.py
+@test ion.services.dm.utility.hash_ring
+'''
+
+from pyon.util.unit_test import PyonTestCase
+from nose.plugins.attrib import attr
+
+from ion.services.dm.utility.hash_ring import HashRing
+
+
+@attr('UNIT', group='dm')
+class HashRingTest(PyonTestCase):
+
+    def setUp(self):
+        self.streams = ['stream_%d' % i for i in xrange(1000)]
+
+    def test_partition(self):
+        ring = HashRing(['worker_1', 'worker_2', 'worker_3'])
+        partition = ring.partition(self.streams)
+
+        self.assertEquals(sorted(partition.keys()), ['worker_1', 'worker_2', 'worker_3'])
+        self.assertEquals(sum(len(v) for v in partition.values()), len(self.streams))
+        for node, streams in partition.iteritems():
+            # Roughly even spread
+            self.assertTrue(len(streams) > 200)
+            for stream in streams:
+                self.assertEquals(ring.get_node(stream), node)
+
+    def test_rebalance_moves_few_keys(self):
+        before = HashRing(['worker_1', 'worker_2', 'worker_3'])
+        after = HashRing(['worker_1', 'worker_2', 'worker_3', 'worker_4'])
+
+        moved = [s for s in self.streams if before.get_node(s) != after.get_node(s)]
+        # Only the keys taken by the new worker move
+        for stream in moved:
+            self.assertEquals(after.get_node(stream), 'worker_4')
+        self.assertTrue(len(moved) < len(self.streams) / 2)
+
+    def test_remove_node(self):
+        ring = HashRing(['worker_1', 'worker_2'])
+        ring.remove_node('worker_2')
+        self.assertEquals(ring.nodes, ['worker_1'])
+        self.assertEquals(set(ring.get_node(s) for s in self.streams), set(['worker_1']))
+
+        self.assertEquals(HashRing().get_node('stream'), None)